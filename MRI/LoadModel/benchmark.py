@@ -0,0 +1,756 @@
+# 基准测试文件：对模型推理和训练中的各项优化进行性能测试
+# 用法：
+#   python benchmark.py engine     # 对比eager模式与折叠/编译后的推理引擎
+#   python benchmark.py tiled      # 对比整图推理与分块推理的峰值内存和耗时
+#   python benchmark.py hashgrid   # 对比hashgrid与Fourier/SIREN达到目标PSNR所需的时间
+#   python benchmark.py stack      # 对比N次逐个推理与ModelStack批量推理的吞吐量
+#   python benchmark.py precision  # 对比fp32/bf16/fp16推理的延迟、权重内存和渲染PSNR
+#   python benchmark.py checkpoint # 对比pickle检查点与.inr服务格式的冷加载时间和每个模型的RSS
+#   python benchmark.py meta --init meta_init.inr  # 对比随机初始化与元学习初始化达到目标PSNR所需的步数
+#   python benchmark.py anneal     # 对比有无频率退火时达到目标PSNR所需的轮数
+#   python benchmark.py experts    # 对比单一MLP与空间分块专家MLP的参数量、训练步耗时和推理延迟
+#   python benchmark.py kspace     # 对比即时计算K空间与读取预计算K空间缓存的取样本耗时
+#   python benchmark.py coils      # 对比不同虚拟线圈数（SVD线圈压缩）的训练步耗时和达到目标PSNR所需的时间
+#   python benchmark.py partial_dft # 对比完整fft2与部分DFT的K空间损失在不同加速倍数下的耗时和数值差异
+#   python benchmark.py multislice # 对比逐个切片训练与堆叠模型批量训练B个切片的每切片耗时
+#   python benchmark.py metrics    # 对比每步同步计算指标与按间隔、后台线程计算指标的训练步吞吐量
+#   python benchmark.py skimage    # 对照skimage验证metrics.py的PSNR/SSIM/NSE，并对比批量计算与逐张计算的耗时
+#   python benchmark.py repack --original data/dataset.hdf5 --repacked data/dataset_repacked.hdf5  # 对比重新打包前后按索引读取的吞吐量
+
+import os
+import copy
+import time
+import tempfile
+import yaml
+import resource
+import argparse
+import multiprocessing
+import torch
+import numpy as np
+from torch.utils.data import Subset, DataLoader
+from skimage.metrics import peak_signal_noise_ratio, structural_similarity
+
+from model import Fullmodel, StackedFullmodel, apply_hashgrid_defaults, build_model, share_encoder
+from dataset import MRIDataset, make_data_loader
+from kspace_cache import build_cache
+from kspace_ops import mask_to_index, forward_sampled, gather_sampled, sampled_error
+from train import MetricScheduler, train_epoch_image
+from metrics import nse, psnr, ssim
+from serving_format import save_inr, load_inr
+from meta_init import load_meta_init
+from inference import (InferenceEngine, ModelStack, make_coordinate_grid, measure_latency, evaluate_tiled,
+                       render_psnr)
+
+
+# 用于基准测试的模型结构：config.yaml中的研究配置和ModelService的默认服务配置
+BENCHMARK_CONFIGS = {
+    "config_512x6": dict(
+        encoding_mode="fourier", in_features=2, out_features=512,
+        coordinate_scales=[1.0, 1.0], mlp_hidden_features=512,
+        mlp_hidden_layers=6, omega_0=25, activation="sine"),
+    "service_256x4": dict(
+        encoding_mode="fourier", in_features=2, out_features=20,
+        coordinate_scales=[1.0, 1.0], mlp_hidden_features=256,
+        mlp_hidden_layers=4, omega_0=30, activation="sine"),
+}
+
+
+def benchmark_engine(args):
+    """对比eager模式与推理引擎在CPU上的延迟
+
+    Args:
+        args: 命令行参数（grids, repeats, backends）
+    """
+    torch.set_grad_enabled(False)
+    for name, config in BENCHMARK_CONFIGS.items():
+        model = Fullmodel(**config).eval()
+        engines = {backend: InferenceEngine(model, backend=backend) for backend in args.backends}
+        for size in args.grids:
+            coords = make_coordinate_grid(size, size)
+            reference = model(coords)
+            eager_ms = measure_latency(model, coords, repeats=args.repeats)
+            print(f"[{name}] {size}x{size} eager: {eager_ms:.1f} ms")
+            for backend, engine in engines.items():
+                engine_ms = measure_latency(engine, coords, repeats=args.repeats)
+                max_err = (engine(coords) - reference).abs().max().item()
+                print(f"[{name}] {size}x{size} {backend}: {engine_ms:.1f} ms, "
+                      f"加速比 {eager_ms / engine_ms:.2f}x, 最大误差 {max_err:.2e}")
+
+
+def _render_peak_rss(config_name, size, memory_budget_mb, result_queue):
+    """在独立进程中渲染一次，返回(耗时秒, 峰值RSS MB)"""
+    torch.set_grad_enabled(False)
+    model = Fullmodel(**BENCHMARK_CONFIGS[config_name]).eval()
+    coords = make_coordinate_grid(size, size)
+    start = time.perf_counter()
+    if memory_budget_mb is None:
+        model(coords)
+    else:
+        evaluate_tiled(model, coords, memory_budget=memory_budget_mb * 1024 * 1024)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    result_queue.put((elapsed, peak_mb))
+
+
+def benchmark_tiled(args):
+    """对比整图推理与分块推理的峰值内存和耗时
+
+    每种模式在单独的spawn进程中运行，保证峰值RSS互不影响。
+
+    Args:
+        args: 命令行参数（config, sizes, budgets）
+    """
+    ctx = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        for budget in [None] + args.budgets:
+            queue = ctx.Queue()
+            process = ctx.Process(target=_render_peak_rss, args=(args.config, size, budget, queue))
+            process.start()
+            elapsed, peak_mb = queue.get()
+            process.join()
+            mode = "整图" if budget is None else f"分块(预算 {budget} MB)"
+            print(f"[{args.config}] {size}x{size} {mode}: {elapsed * 1000:.0f} ms, 峰值RSS {peak_mb:.0f} MB")
+
+
+def benchmark_stack(args):
+    """对比N个切片模型逐个推理与ModelStack批量推理的单切片吞吐量
+
+    Args:
+        args: 命令行参数（config, counts, size, repeats）
+    """
+    torch.set_grad_enabled(False)
+    coords = make_coordinate_grid(args.size, args.size)
+    for count in args.counts:
+        models = [Fullmodel(**BENCHMARK_CONFIGS[args.config]).eval() for _ in range(count)]
+        engines = [InferenceEngine(model, backend="jit") for model in models]
+        stack = ModelStack(models)
+
+        def sequential(c):
+            return [engine(c) for engine in engines]
+
+        sequential_ms = measure_latency(sequential, coords, repeats=args.repeats)
+        stack_ms = measure_latency(stack, coords, repeats=args.repeats)
+        max_err = max((s - e(coords)).abs().max().item() for s, e in zip(stack(coords), engines))
+        print(f"[{args.config}] N={count} {args.size}x{args.size}: "
+              f"逐个 {sequential_ms / count:.1f} ms/切片，堆叠 {stack_ms / count:.1f} ms/切片，"
+              f"加速比 {sequential_ms / stack_ms:.2f}x，最大误差 {max_err:.2e}")
+
+
+def load_config(path="config.yaml"):
+    """读取训练配置文件（hashgrid编码时应用hashgrid_defaults，与start.py一致）"""
+    with open(path, "r", encoding="utf-8") as f:
+        return apply_hashgrid_defaults(yaml.safe_load(f))
+
+
+def fit_until_psnr(model, loader, device, learning_rate, target_psnr, max_epochs,
+                   max_seconds=None, supervision_mode="kspace_csm", lambda_tv=1e-5, anneal_epochs=None):
+    """训练模型直到PSNR达到目标值
+
+    Args:
+        model: 待训练的模型
+        loader: 数据加载器
+        device: 计算设备
+        learning_rate: 学习率
+        target_psnr: 目标PSNR
+        max_epochs: 最大训练轮数
+        max_seconds: 最长训练时间（秒），None表示不限制
+        supervision_mode: 监督模式
+        lambda_tv: 总变差正则化系数
+        anneal_epochs: 频率退火的轮数，None表示不更新退火进度
+
+    Returns:
+        (训练轮数, 训练耗时秒, 最佳PSNR, 是否达到目标)
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=float(learning_rate))
+    best_psnr = 0.0
+    start = time.perf_counter()
+    for epoch in range(max_epochs):
+        if anneal_epochs:
+            model.set_anneal_progress(epoch / anneal_epochs)
+        _, psnr, _, _ = train_epoch_image(model, loader, optimizer, device,
+                                          supervision_mode=supervision_mode, lambda_tv=lambda_tv)
+        best_psnr = max(best_psnr, float(psnr))
+        elapsed = time.perf_counter() - start
+        if best_psnr >= target_psnr:
+            return epoch + 1, elapsed, best_psnr, True
+        if max_seconds is not None and elapsed > max_seconds:
+            break
+    return epoch + 1, time.perf_counter() - start, best_psnr, False
+
+
+def _slice_loader(config, index, **dataset_kwargs):
+    """构造单切片训练用的数据加载器"""
+    dataset = MRIDataset(config["dataset_path"], split='train', **dataset_kwargs)
+    return DataLoader(Subset(dataset, [index]), batch_size=1, shuffle=False)
+
+
+def benchmark_hashgrid(args):
+    """对比hashgrid编码与Fourier/SIREN基线达到目标PSNR所需的时间
+
+    Args:
+        args: 命令行参数（config, index, target_psnr, max_epochs, max_seconds, hash_lr）
+    """
+    config = load_config(args.config)
+    device = torch.device("cuda" if torch.cuda.is_available() and config["gpu_id"] >= 0 else "cpu")
+    loader = _slice_loader(config, args.index)
+
+    # hashgrid使用config.yaml中hashgrid_defaults的小型解码器和学习率（--hash-lr可覆盖学习率）
+    hash_config = copy.deepcopy(config)
+    hash_config["encoder"]["encoding_mode"] = "hashgrid"
+    hash_config = apply_hashgrid_defaults(hash_config)
+    variants = [
+        ("fourier_siren", config, config["learning_rate"]),
+        ("hashgrid", hash_config, args.hash_lr if args.hash_lr is not None else hash_config["learning_rate"]),
+    ]
+
+    for name, variant_config, learning_rate in variants:
+        torch.manual_seed(0)
+        model = build_model(variant_config).to(device)
+        num_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
+        epochs, seconds, best_psnr, reached = fit_until_psnr(
+            model, loader, device, learning_rate, args.target_psnr, args.max_epochs,
+            max_seconds=args.max_seconds, supervision_mode=config["supervision_mode"],
+            lambda_tv=config["lambda_tv"])
+        status = "达到目标" if reached else "未达到目标"
+        print(f"[{name}] 参数量 {num_params}，{status} {args.target_psnr:.1f} dB："
+              f"{epochs} 轮，{seconds:.1f} s，最佳PSNR {best_psnr:.2f} dB")
+
+
+def benchmark_precision(args):
+    """对比不同推理精度的延迟、权重内存和相对fp32的渲染PSNR
+
+    Args:
+        args: 命令行参数（checkpoint, size, repeats, backend, precisions）
+    """
+    torch.set_grad_enabled(False)
+    if args.checkpoint:
+        models = {args.checkpoint: torch.load(args.checkpoint, map_location="cpu", weights_only=False).eval()}
+    else:
+        models = {name: Fullmodel(**config).eval() for name, config in BENCHMARK_CONFIGS.items()}
+
+    coords = make_coordinate_grid(args.size, args.size)
+    for name, model in models.items():
+        reference_engine = InferenceEngine(model, backend=args.backend)
+        reference = reference_engine(coords)
+        for precision in args.precisions:
+            try:
+                engine = InferenceEngine(model, backend=args.backend, precision=precision)
+            except (ValueError, RuntimeError) as e:
+                print(f"[{name}] {precision}: 不可用 ({e})")
+                continue
+            latency_ms = measure_latency(engine, coords, repeats=args.repeats)
+            psnr = render_psnr(reference, engine(coords))
+            print(f"[{name}] {precision} ({engine.backend}): {latency_ms:.1f} ms, "
+                  f"权重 {engine.weight_bytes / 2 ** 20:.2f} MB, 相对fp32 PSNR {psnr:.2f} dB")
+
+
+def _current_rss_mb():
+    """当前进程的常驻内存（MB），非Linux系统退回到峰值RSS"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _cold_load(paths, result_queue):
+    """在独立进程中加载一组模型文件，返回(加载耗时秒, 加载后RSS增量MB, 首次渲染后RSS增量MB)"""
+    torch.set_grad_enabled(False)
+    coords = make_coordinate_grid(64, 64)
+    baseline = _current_rss_mb()
+    start = time.perf_counter()
+    models = [load_inr(path) if path.endswith(".inr")
+              else torch.load(path, map_location="cpu", weights_only=False).eval()
+              for path in paths]
+    elapsed = time.perf_counter() - start
+    loaded = _current_rss_mb() - baseline
+    for model in models:
+        model(coords)
+    rendered = _current_rss_mb() - baseline
+    result_queue.put((elapsed, loaded, rendered))
+
+
+def benchmark_checkpoint(args):
+    """对比pickle检查点与.inr服务格式的冷加载时间和内存
+
+    每种格式写出count个模型文件，在单独的spawn进程中全部加载（模拟ModelService冷启动），
+    再各渲染一次64x64网格使权重页真正被访问。
+
+    Args:
+        args: 命令行参数（config, count）
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        formats = {"pickle (.pt)": [], ".inr fp32": [], ".inr fp16": []}
+        for i in range(args.count):
+            model = Fullmodel(**BENCHMARK_CONFIGS[args.config]).eval()
+            pickle_path = os.path.join(tmp_dir, f"model_{i}.pt")
+            torch.save(model, pickle_path)
+            formats["pickle (.pt)"].append(pickle_path)
+            for dtype, name in (("float32", ".inr fp32"), ("float16", ".inr fp16")):
+                path = os.path.join(tmp_dir, f"model_{i}_{dtype}.inr")
+                save_inr(model, path, dtype=dtype)
+                formats[name].append(path)
+
+        for name, paths in formats.items():
+            queue = ctx.Queue()
+            process = ctx.Process(target=_cold_load, args=(paths, queue))
+            process.start()
+            elapsed, loaded, rendered = queue.get()
+            process.join()
+            size_mb = os.path.getsize(paths[0]) / 2 ** 20
+            print(f"[{args.config}] {name}: 文件 {size_mb:.2f} MB，加载 {args.count} 个模型 {elapsed * 1000:.0f} ms "
+                  f"({elapsed * 1000 / args.count:.1f} ms/模型)，每个模型RSS {loaded / args.count:.2f} MB "
+                  f"(渲染后 {rendered / args.count:.2f} MB)")
+
+
+def benchmark_meta(args):
+    """对比随机SIREN初始化与元学习初始化达到目标PSNR所需的训练步数
+
+    评估切片应在元学习时通过--exclude排除。
+
+    Args:
+        args: 命令行参数（config, init, indices, target_psnr, max_epochs）
+    """
+    config = load_config(args.config)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    for index in args.indices:
+        loader = _slice_loader(config, index)
+        for name in ("随机初始化", "元学习初始化"):
+            torch.manual_seed(0)
+            model = build_model(config)
+            if name == "元学习初始化":
+                load_meta_init(model, args.init)
+            epochs, seconds, best_psnr, reached = fit_until_psnr(
+                model.to(device), loader, device, config["learning_rate"], args.target_psnr, args.max_epochs,
+                supervision_mode=config["supervision_mode"], lambda_tv=config["lambda_tv"])
+            status = "达到" if reached else "未达到"
+            print(f"[切片 {index}] {name}: {status}目标 {args.target_psnr:.1f} dB，"
+                  f"{epochs} 步，{seconds:.1f} s，最佳PSNR {best_psnr:.2f} dB")
+
+
+def benchmark_anneal(args):
+    """对比有无频率退火时达到目标PSNR所需的轮数
+
+    Args:
+        args: 命令行参数（config, indices, target_psnr, max_epochs, num_bands, anneal_epochs）
+    """
+    config = load_config(args.config)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    for index in args.indices:
+        loader = _slice_loader(config, index)
+        for anneal_epochs in [None] + args.anneal_epochs:
+            run_config = copy.deepcopy(config)
+            run_config["frequency_annealing"] = {"enabled": anneal_epochs is not None, "num_bands": args.num_bands}
+            torch.manual_seed(0)
+            model = build_model(run_config).to(device)
+            epochs, seconds, best_psnr, reached = fit_until_psnr(
+                model, loader, device, config["learning_rate"], args.target_psnr, args.max_epochs,
+                supervision_mode=config["supervision_mode"], lambda_tv=config["lambda_tv"],
+                anneal_epochs=anneal_epochs)
+            name = "无退火" if anneal_epochs is None else f"退火({args.num_bands}频带, {anneal_epochs}轮)"
+            status = "达到" if reached else "未达到"
+            print(f"[切片 {index}] {name}: {status}目标 {args.target_psnr:.1f} dB，"
+                  f"{epochs} 轮，{seconds:.1f} s，最佳PSNR {best_psnr:.2f} dB")
+
+
+def benchmark_experts(args):
+    """对比单一MLP与参数量相同的空间分块专家MLP
+
+    Args:
+        args: 命令行参数（size, grid, repeats）
+    """
+    gx, gy = args.grid
+    base = BENCHMARK_CONFIGS["config_512x6"]
+    expert_width = int(base["mlp_hidden_features"] / (gx * gy) ** 0.5)
+    variants = {
+        "单一MLP 512x6": Fullmodel(**base),
+        f"{gx}x{gy}专家 {expert_width}x6": Fullmodel(**dict(base, mlp_hidden_features=expert_width, experts=[gx, gy])),
+    }
+    coords = make_coordinate_grid(args.size, args.size)
+    target = torch.randn(coords.shape[0], 2)
+    for name, model in variants.items():
+        num_params = sum(p.numel() for p in model.net.parameters())
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+
+        def train_step(c):
+            # measure_latency在no_grad下计时，训练步需要显式开启梯度
+            with torch.enable_grad():
+                loss = torch.nn.functional.mse_loss(model(c), target)
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+
+        train_ms = measure_latency(train_step, coords, repeats=args.repeats)
+        model.eval()
+        with torch.no_grad():
+            infer_ms = measure_latency(model, coords, repeats=args.repeats)
+        print(f"{name}: 参数量 {num_params / 1e6:.2f} M，训练步 {train_ms:.1f} ms，"
+              f"推理 {args.size}x{args.size} {infer_ms:.1f} ms")
+
+
+def benchmark_kspace(args):
+    """对比即时计算K空间与读取预计算缓存时MRIDataset取样本的耗时
+
+    Args:
+        args: 命令行参数（config, cache_dir, indices, repeats）
+    """
+    config = load_config(args.config)
+    build_cache(config["dataset_path"], args.cache_dir)
+    variants = {
+        "即时计算": MRIDataset(config["dataset_path"], split='train', cache_slices=0),
+        "K空间缓存": MRIDataset(config["dataset_path"], split='train', cache_slices=0, kspace_cache_dir=args.cache_dir),
+    }
+    indices = args.indices or list(range(len(variants["即时计算"])))
+    for name, dataset in variants.items():
+        dataset[indices[0]]
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for index in indices:
+                dataset[index]
+        per_sample_ms = (time.perf_counter() - start) * 1000 / (args.repeats * len(indices))
+        print(f"{name}: 每个样本 {per_sample_ms:.2f} ms")
+
+
+def benchmark_coils(args):
+    """对比全部物理线圈与SVD压缩到不同虚拟线圈数时的训练速度和精度
+
+    Args:
+        args: 命令行参数（config, index, coils, target_psnr, max_epochs, max_seconds）
+    """
+    config = load_config(args.config)
+    device = torch.device("cuda" if torch.cuda.is_available() and config["gpu_id"] >= 0 else "cpu")
+    for virtual_coils in [None] + sorted(args.coils, reverse=True):
+        loader = _slice_loader(config, args.index, virtual_coils=virtual_coils)
+        batch = next(iter(loader))
+        num_coils = batch["gt_csm"].shape[1]
+        energy = float(batch["coil_energy"][0])
+
+        torch.manual_seed(0)
+        model = build_model(config).to(device)
+        epochs, seconds, best_psnr, reached = fit_until_psnr(
+            model, loader, device, config["learning_rate"], args.target_psnr, args.max_epochs,
+            max_seconds=args.max_seconds, supervision_mode=config["supervision_mode"],
+            lambda_tv=config["lambda_tv"])
+        name = "物理线圈" if virtual_coils is None else "虚拟线圈"
+        status = "达到目标" if reached else "未达到目标"
+        print(f"[{name} {num_coils}] 保留能量 {energy:.4f}，每轮 {seconds * 1000 / epochs:.1f} ms，"
+              f"{status} {args.target_psnr:.1f} dB：{epochs} 轮，{seconds:.1f} s，最佳PSNR {best_psnr:.2f} dB")
+
+
+def _cartesian_mask(size, acceleration, center_fraction=0.08, seed=0):
+    """按行采样的Cartesian掩模：中心的全采样区域加上随机采样线，采样线总数约为size / acceleration"""
+    generator = torch.Generator().manual_seed(seed)
+    num_center = int(size * center_fraction)
+    rows = torch.zeros(size, dtype=torch.bool)
+    # fft2的输出未做fftshift，低频位于两端
+    rows[:num_center // 2] = True
+    rows[size - (num_center - num_center // 2):] = True
+    remaining = max(size // acceleration - int(rows.sum()), 0)
+    candidates = (~rows).nonzero().flatten()
+    rows[candidates[torch.randperm(len(candidates), generator=generator)[:remaining]]] = True
+    return rows[:, None].float().expand(size, size).clone()
+
+
+def benchmark_partial_dft(args):
+    """对比完整fft2（稠密掩模）与部分DFT的K空间损失（前向+反向）
+
+    Args:
+        args: 命令行参数（size, coils, accelerations, repeats）
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    image = torch.randn(args.size, args.size, dtype=torch.complex64, device=device)
+    csm = torch.randn(1, args.coils, args.size, args.size, dtype=torch.complex64, device=device)
+    for acceleration in args.accelerations:
+        mask = _cartesian_mask(args.size, acceleration).to(device)
+        gt_kspace = torch.fft.fft2(torch.randn_like(csm)) * mask
+        mask_index = {key: value.to(device) for key, value in mask_to_index(mask.cpu()).items()}
+
+        def dense_loss(img):
+            error = (torch.view_as_real(torch.fft.fft2(img * csm) - gt_kspace) ** 2).sum(dim=-1)
+            return (error * mask).sum() / (mask.sum() * args.coils + 1e-6)
+
+        def partial_loss(img):
+            pred = forward_sampled(img * csm, mask_index)
+            return sampled_error(pred, gather_sampled(gt_kspace, mask_index), mask_index, args.coils)
+
+        def step(loss_fn):
+            def run(img):
+                with torch.enable_grad():
+                    img = img.detach().requires_grad_(True)
+                    loss_fn(img).backward()
+            return run
+
+        dense_ms = measure_latency(step(dense_loss), image, repeats=args.repeats)
+        partial_ms = measure_latency(step(partial_loss), image, repeats=args.repeats)
+        dense_value, partial_value = dense_loss(image).item(), partial_loss(image).item()
+        num_lines = mask_index["lines"].numel()
+        operator = "部分DFT" if mask_index["dft"].numel() else "fft2+gather"
+        print(f"{acceleration}x加速（{num_lines}/{args.size} 线，{operator}）：完整fft2 {dense_ms:.2f} ms，"
+              f"采样线 {partial_ms:.2f} ms，加速比 {dense_ms / partial_ms:.2f}x，"
+              f"损失相对差异 {abs(partial_value - dense_value) / abs(dense_value):.2e}")
+
+
+def benchmark_multislice(args):
+    """对比逐个切片训练与StackedFullmodel一步训练B个切片的每切片训练步耗时
+
+    Args:
+        args: 命令行参数（config, counts, steps）
+    """
+    config = load_config(args.config)
+    device = torch.device("cuda" if torch.cuda.is_available() and config["gpu_id"] >= 0 else "cpu")
+    dataset = MRIDataset(config["dataset_path"], split='train')
+
+    def seconds_per_epoch(model, loader):
+        optimizer = torch.optim.Adam(model.parameters(), lr=float(config["learning_rate"]))
+        train_epoch_image(model, loader, optimizer, device, supervision_mode=config["supervision_mode"],
+                          lambda_tv=config["lambda_tv"])
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            train_epoch_image(model, loader, optimizer, device, supervision_mode=config["supervision_mode"],
+                              lambda_tv=config["lambda_tv"])
+        return (time.perf_counter() - start) / args.steps
+
+    for count in args.counts:
+        indices = list(range(count))
+        # 逐个切片：每个切片一个Fullmodel，依次训练
+        sequential = sum(seconds_per_epoch(build_model(config).to(device),
+                                           make_data_loader(Subset(dataset, [index])))
+                         for index in indices)
+        stacked_model = StackedFullmodel(share_encoder([build_model(config) for _ in indices])).to(device)
+        stacked = seconds_per_epoch(stacked_model, make_data_loader(Subset(dataset, indices), batch_size=count))
+        print(f"{count} 个切片：逐个训练每切片 {sequential * 1000 / count:.1f} ms，"
+              f"堆叠批量训练每切片 {stacked * 1000 / count:.1f} ms，吞吐量提升 {sequential / stacked:.2f}x")
+
+
+def benchmark_metrics(args):
+    """对比每步同步计算PSNR/SSIM/NSE与MetricScheduler按间隔、在后台线程计算时的训练步吞吐量
+
+    Args:
+        args: 命令行参数（config, index, intervals, steps）
+    """
+    config = load_config(args.config)
+    device = torch.device("cuda" if torch.cuda.is_available() and config["gpu_id"] >= 0 else "cpu")
+    loader = _slice_loader(config, args.index)
+
+    def steps_per_second(scheduler):
+        torch.manual_seed(0)
+        model = build_model(config).to(device)
+        optimizer = torch.optim.Adam(model.parameters(), lr=float(config["learning_rate"]))
+        start = time.perf_counter()
+        for epoch in range(args.steps):
+            evaluate = scheduler is None or scheduler.should_evaluate(epoch, args.steps)
+            train_epoch_image(model, loader, optimizer, device, supervision_mode=config["supervision_mode"],
+                              lambda_tv=config["lambda_tv"], compute_metrics=evaluate, metric_scheduler=scheduler)
+            if scheduler is not None:
+                if evaluate:
+                    scheduler.submit(epoch)
+                scheduler.poll()
+        if scheduler is not None:
+            scheduler.finish()
+        return args.steps / (time.perf_counter() - start)
+
+    baseline = steps_per_second(None)
+    print(f"每步同步计算指标: {baseline:.2f} 步/秒")
+    for interval in args.intervals:
+        for background in (False, True):
+            rate = steps_per_second(MetricScheduler(interval=interval, background=background))
+            mode = "后台线程" if background else "同步"
+            print(f"间隔 {interval}，{mode}: {rate:.2f} 步/秒（{rate / baseline:.2f}x）")
+
+
+def benchmark_skimage(args):
+    """对照skimage.metrics验证metrics.py的PSNR/SSIM/NSE，并对比批量torch计算与逐张skimage计算的耗时
+
+    Args:
+        args: 命令行参数（count, size）
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    generator = torch.Generator().manual_seed(0)
+    # 平滑的随机图像加噪声，取值在[0, 1]
+    gt = torch.nn.functional.avg_pool2d(torch.rand(args.count, 1, args.size + 7, args.size + 7, generator=generator,
+                                                   dtype=torch.float64), 8, stride=1)[:, 0]
+    pred = (gt + 0.05 * torch.randn(gt.shape, generator=generator, dtype=torch.float64)).clamp(0, 1)
+    gt_np, pred_np = gt.numpy(), pred.numpy()
+
+    def skimage_metrics():
+        values = {"psnr": [], "ssim_gaussian": [], "ssim_uniform": [], "nse": []}
+        for p, g in zip(pred_np, gt_np):
+            data_range = g.max() - g.min()
+            values["psnr"].append(peak_signal_noise_ratio(g, p, data_range=1.0))
+            values["ssim_gaussian"].append(structural_similarity(p, g, data_range=data_range, gaussian_weights=True,
+                                                                 sigma=1.5, use_sample_covariance=False))
+            values["ssim_uniform"].append(structural_similarity(p, g, data_range=data_range))
+            values["nse"].append(np.sum((p - g) ** 2) / np.sum(g ** 2))
+        return {key: np.array(value) for key, value in values.items()}
+
+    def torch_metrics(p, g):
+        return {
+            "psnr": psnr(p, g),
+            "ssim_gaussian": ssim(p, g),
+            "ssim_uniform": ssim(p, g, gaussian=False),
+            "nse": nse(p, g),
+        }
+
+    start = time.perf_counter()
+    reference = skimage_metrics()
+    skimage_seconds = time.perf_counter() - start
+
+    for dtype in (torch.float64, torch.float32):
+        p, g = pred.to(device, dtype), gt.to(device, dtype)
+        torch_metrics(p, g)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        values = torch_metrics(p, g)
+        values = {key: value.cpu().numpy() for key, value in values.items()}
+        elapsed = time.perf_counter() - start
+        errors = "，".join(f"{key} {np.abs(values[key] - reference[key]).max():.2e}" for key in reference)
+        print(f"{str(dtype).split('.')[-1]}（{device.type}）: 与skimage的最大绝对误差 {errors}；"
+              f"{args.count} 张 {elapsed * 1000:.1f} ms，skimage逐张 {skimage_seconds * 1000:.1f} ms"
+              f"（{skimage_seconds / elapsed:.1f}x）")
+
+
+def benchmark_repack(args):
+    """对比重新打包前后按索引读取trnOrg/trnMask/trnCsm的耗时和吞吐量
+
+    Args:
+        args: 命令行参数（original, repacked, indices, repeats）
+    """
+    for name, path in (("原始文件", args.original), ("重新打包", args.repacked)):
+        dataset = MRIDataset(path, split='train', cache_slices=0)
+        indices = args.indices or list(range(len(dataset)))
+        arrays = (dataset.org_data, dataset.mask_data, dataset.csm_data)
+        nbytes = 0
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for index in indices:
+                nbytes += sum(array[index].nbytes for array in arrays)
+        elapsed = time.perf_counter() - start
+        per_slice_ms = elapsed * 1000 / (args.repeats * len(indices))
+        print(f"{name} ({os.path.getsize(path) / 2 ** 20:.1f} MB): 每个切片 {per_slice_ms:.2f} ms，"
+              f"{nbytes / 2 ** 20 / elapsed:.0f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MRI INR 基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    engine_parser = subparsers.add_parser("engine", help="推理引擎 vs eager模式")
+    engine_parser.add_argument("--grids", type=int, nargs="+", default=[256, 512])
+    engine_parser.add_argument("--repeats", type=int, default=10)
+    engine_parser.add_argument("--backends", nargs="+", default=["folded", "jit"])
+    engine_parser.set_defaults(func=benchmark_engine)
+
+    tiled_parser = subparsers.add_parser("tiled", help="整图推理 vs 分块推理")
+    tiled_parser.add_argument("--config", choices=list(BENCHMARK_CONFIGS), default="config_512x6")
+    tiled_parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024])
+    tiled_parser.add_argument("--budgets", type=int, nargs="+", default=[64, 256])
+    tiled_parser.set_defaults(func=benchmark_tiled)
+
+    hash_parser = subparsers.add_parser("hashgrid", help="hashgrid vs Fourier/SIREN 的time-to-PSNR")
+    hash_parser.add_argument("--config", default="config.yaml")
+    hash_parser.add_argument("--index", type=int, default=1)
+    hash_parser.add_argument("--target-psnr", type=float, default=30.0)
+    hash_parser.add_argument("--max-epochs", type=int, default=20000)
+    hash_parser.add_argument("--max-seconds", type=float, default=None)
+    hash_parser.add_argument("--hash-lr", type=float, default=None, help="默认使用hashgrid_defaults中的learning_rate")
+    hash_parser.set_defaults(func=benchmark_hashgrid)
+
+    stack_parser = subparsers.add_parser("stack", help="逐个推理 vs ModelStack批量推理")
+    stack_parser.add_argument("--config", choices=list(BENCHMARK_CONFIGS), default="service_256x4")
+    stack_parser.add_argument("--counts", type=int, nargs="+", default=[1, 4, 16])
+    stack_parser.add_argument("--size", type=int, default=256)
+    stack_parser.add_argument("--repeats", type=int, default=5)
+    stack_parser.set_defaults(func=benchmark_stack)
+
+    precision_parser = subparsers.add_parser("precision", help="fp32 vs bf16/fp16 推理")
+    precision_parser.add_argument("--checkpoint", default=None, help="完整模型文件（.pt），默认使用随机初始化的基准配置")
+    precision_parser.add_argument("--size", type=int, default=512)
+    precision_parser.add_argument("--repeats", type=int, default=10)
+    precision_parser.add_argument("--backend", default="jit")
+    precision_parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "fp16"])
+    precision_parser.set_defaults(func=benchmark_precision)
+
+    checkpoint_parser = subparsers.add_parser("checkpoint", help="pickle检查点 vs .inr服务格式")
+    checkpoint_parser.add_argument("--config", choices=list(BENCHMARK_CONFIGS), default="config_512x6")
+    checkpoint_parser.add_argument("--count", type=int, default=16)
+    checkpoint_parser.set_defaults(func=benchmark_checkpoint)
+
+    meta_parser = subparsers.add_parser("meta", help="随机初始化 vs 元学习初始化的steps-to-PSNR")
+    meta_parser.add_argument("--config", default="config.yaml")
+    meta_parser.add_argument("--init", required=True, help="meta_init.py生成的.inr文件")
+    meta_parser.add_argument("--indices", type=int, nargs="+", default=[1])
+    meta_parser.add_argument("--target-psnr", type=float, default=30.0)
+    meta_parser.add_argument("--max-epochs", type=int, default=20000)
+    meta_parser.set_defaults(func=benchmark_meta)
+
+    anneal_parser = subparsers.add_parser("anneal", help="有无频率退火的epochs-to-PSNR")
+    anneal_parser.add_argument("--config", default="config.yaml")
+    anneal_parser.add_argument("--indices", type=int, nargs="+", default=[1])
+    anneal_parser.add_argument("--target-psnr", type=float, default=30.0)
+    anneal_parser.add_argument("--max-epochs", type=int, default=20000)
+    anneal_parser.add_argument("--num-bands", type=int, default=8)
+    anneal_parser.add_argument("--anneal-epochs", type=int, nargs="+", default=[500, 2000])
+    anneal_parser.set_defaults(func=benchmark_anneal)
+
+    experts_parser = subparsers.add_parser("experts", help="单一MLP vs 空间分块专家MLP")
+    experts_parser.add_argument("--size", type=int, default=256)
+    experts_parser.add_argument("--grid", type=int, nargs=2, default=[2, 2])
+    experts_parser.add_argument("--repeats", type=int, default=5)
+    experts_parser.set_defaults(func=benchmark_experts)
+
+    kspace_parser = subparsers.add_parser("kspace", help="即时计算K空间 vs 预计算K空间缓存")
+    kspace_parser.add_argument("--config", default="config.yaml")
+    kspace_parser.add_argument("--cache-dir", default="./data/kspace_cache")
+    kspace_parser.add_argument("--indices", type=int, nargs="*", default=None, help="默认使用全部切片")
+    kspace_parser.add_argument("--repeats", type=int, default=3)
+    kspace_parser.set_defaults(func=benchmark_kspace)
+
+    coils_parser = subparsers.add_parser("coils", help="物理线圈 vs SVD虚拟线圈的训练速度和精度")
+    coils_parser.add_argument("--config", default="config.yaml")
+    coils_parser.add_argument("--index", type=int, default=1)
+    coils_parser.add_argument("--coils", type=int, nargs="+", default=[8, 4, 2])
+    coils_parser.add_argument("--target-psnr", type=float, default=30.0)
+    coils_parser.add_argument("--max-epochs", type=int, default=5000)
+    coils_parser.add_argument("--max-seconds", type=float, default=None)
+    coils_parser.set_defaults(func=benchmark_coils)
+
+    partial_parser = subparsers.add_parser("partial_dft", help="完整fft2 vs 部分DFT的K空间损失")
+    partial_parser.add_argument("--size", type=int, default=256)
+    partial_parser.add_argument("--coils", type=int, default=12)
+    partial_parser.add_argument("--accelerations", type=int, nargs="+", default=[2, 4, 8, 16])
+    partial_parser.add_argument("--repeats", type=int, default=20)
+    partial_parser.set_defaults(func=benchmark_partial_dft)
+
+    multislice_parser = subparsers.add_parser("multislice", help="逐个切片训练 vs 堆叠模型批量训练")
+    multislice_parser.add_argument("--config", default="config.yaml")
+    multislice_parser.add_argument("--counts", type=int, nargs="+", default=[2, 4, 8])
+    multislice_parser.add_argument("--steps", type=int, default=20)
+    multislice_parser.set_defaults(func=benchmark_multislice)
+
+    metrics_parser = subparsers.add_parser("metrics", help="每步同步计算指标 vs 按间隔后台计算指标")
+    metrics_parser.add_argument("--config", default="config.yaml")
+    metrics_parser.add_argument("--index", type=int, default=1)
+    metrics_parser.add_argument("--intervals", type=int, nargs="+", default=[1, 10, 100])
+    metrics_parser.add_argument("--steps", type=int, default=200)
+    metrics_parser.set_defaults(func=benchmark_metrics)
+
+    skimage_parser = subparsers.add_parser("skimage", help="metrics.py vs skimage.metrics的数值和耗时")
+    skimage_parser.add_argument("--count", type=int, default=32)
+    skimage_parser.add_argument("--size", type=int, default=256)
+    skimage_parser.set_defaults(func=benchmark_skimage)
+
+    repack_parser = subparsers.add_parser("repack", help="重新打包前后的按索引读取")
+    repack_parser.add_argument("--original", required=True)
+    repack_parser.add_argument("--repacked", required=True)
+    repack_parser.add_argument("--indices", type=int, nargs="*", default=None, help="默认使用全部切片")
+    repack_parser.add_argument("--repeats", type=int, default=3)
+    repack_parser.set_defaults(func=benchmark_repack)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
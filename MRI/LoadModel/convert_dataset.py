@@ -1,8 +1,31 @@
+# 数据集导出文件：把h5数据集导出为图片文件或单个可内存映射的数据包
+# 主要功能：
+# 1. 进程池并行导出：每个worker直接把归一化结果编码为uint8灰度PNG（不经过matplotlib）
+# 2. 断点续传：manifest.json记录已完成的切片，重新运行时跳过已导出的切片
+# 3. 可选地导出为单个数据包（npy：每类数据一个可内存映射的.npy文件；hdf5：单个h5文件），代替成千上万个小文件
+# 4. 与原有的matplotlib逐张保存方式对比吞吐量（切片/秒）
+# 用法：
+#   python convert_dataset.py data/dataset.hdf5 --workers 8
+#   python convert_dataset.py data/dataset.hdf5 --format npy -o data/converted_bundle
+#   python convert_dataset.py data/dataset.hdf5 --compare 16      # 在前16个切片上对比新旧导出方式
+
 import h5py
 import os
+import json
+import time
+import tempfile
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
+from PIL import Image
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+
+from repack_dataset import open_mask
+
+# 导出的数据类别和每类图像的组成
+COMPLEX_PARTS = ("magnitude", "real", "imag")
+MANIFEST_NAME = "manifest.json"
 
 def normalize01(img):
     """
@@ -71,67 +94,264 @@ def save_complex_image(data, save_path, index, prefix):
         cmap='gray'
     )
 
-def convert_dataset(file_path):
+def convert_dataset_matplotlib(file_path, base_dir="data/converted_dataset", indices=None):
     """
-    转换h5数据集为图片文件
+    原有的导出方式：单进程逐张调用plt.imsave（保留用于吞吐量对比）
     """
-    print("开始读取数据集...")
     with h5py.File(file_path, 'r') as data:
-        # 获取数据
-        org_data = data['trnOrg'][:]      # 原始图像
-        mask_data = data['trnMask'][:]    # 掩模
-        csm_data = data['trnCsm'][:]      # 线圈灵敏度图
-        
-        num_samples = len(org_data)
-        print(f"总共有 {num_samples} 个样本")
-        
-        # 创建保存目录
-        base_dir = "data/converted_dataset"
+        org_data = data['trnOrg']
+        mask_data = open_mask(data)
+        csm_data = data['trnCsm']
+        indices = range(len(org_data)) if indices is None else indices
+
         original_dir = os.path.join(base_dir, "original")
         kspace_dir = os.path.join(base_dir, "kspace")
         mask_dir = os.path.join(base_dir, "mask")
         csm_dir = os.path.join(base_dir, "csm")
-        
-        os.makedirs(original_dir, exist_ok=True)
-        os.makedirs(kspace_dir, exist_ok=True)
         os.makedirs(mask_dir, exist_ok=True)
-        os.makedirs(csm_dir, exist_ok=True)
-        
-        print("开始转换数据...")
-        for i in tqdm(range(num_samples)):
-            # 保存原始图像
-            save_complex_image(org_data[i], original_dir, i, "original")
-            
-            # 计算并保存K空间数据
-            kspace = np.fft.fft2(org_data[i])
-            save_complex_image(kspace, kspace_dir, i, "kspace")
-            
-            # 保存掩模
-            plt.imsave(
-                os.path.join(mask_dir, f"mask_{i}.png"),
-                mask_data[i],
-                cmap='gray'
-            )
-            
-            # 保存每个通道的线圈灵敏度图
-            for j in range(csm_data.shape[1]):
-                save_complex_image(
-                    csm_data[i, j],
-                    os.path.join(csm_dir, f"channel_{j}"),
-                    i,
-                    f"csm_ch{j}"
-                )
-        
-        print("数据转换完成！")
-        print(f"文件已保存到 {base_dir} 目录下")
-        print("目录结构：")
-        print(f"- {base_dir}/")
-        print("  ├── original/  (原始图像)")
-        print("  ├── kspace/   (K空间数据)")
-        print("  ├── mask/     (采样掩模)")
-        print("  └── csm/      (线圈灵敏度图)")
+
+        for i in tqdm(indices):
+            org = org_data[i]
+            save_complex_image(org, original_dir, i, "original")
+            save_complex_image(np.fft.fft2(org), kspace_dir, i, "kspace")
+            plt.imsave(os.path.join(mask_dir, f"mask_{i}.png"), mask_data[i], cmap='gray')
+            csm = csm_data[i]
+            for j in range(csm.shape[0]):
+                save_complex_image(csm[j], os.path.join(csm_dir, f"channel_{j}"), i, f"csm_ch{j}")
+
+
+def to_uint8(img):
+    """
+    归一化到[0,1]后量化为uint8，与plt.imsave的gray色图取值一致（256级，int(x * 256)截断到255）
+    """
+    img = np.asarray(img, dtype=np.float64)
+    min_val, max_val = img.min(), img.max()
+    if max_val > min_val:
+        img = (img - min_val) / (max_val - min_val)
+    else:
+        img = np.zeros_like(img)
+    return np.minimum((img * 256).astype(np.int32), 255).astype(np.uint8)
+
+
+def complex_parts_uint8(data):
+    """
+    复数数据的幅度、实部、虚部，形状为(3, H, W)的uint8
+    """
+    return np.stack([to_uint8(np.abs(data)), to_uint8(np.real(data)), to_uint8(np.imag(data))])
+
+
+def encode_slice(org, mask, csm):
+    """
+    计算单个切片的全部导出图像
+
+    Returns:
+        dict: original (3, H, W)、kspace (3, H, W)、mask (H, W)、csm (C, 3, H, W)，均为uint8
+    """
+    return {
+        "original": complex_parts_uint8(org),
+        "kspace": complex_parts_uint8(np.fft.fft2(org)),
+        "mask": to_uint8(mask),
+        "csm": np.stack([complex_parts_uint8(coil) for coil in csm]),
+    }
+
+
+# worker进程中打开的数据集（每个进程只打开一次）
+_worker_data = None
+
+
+def _init_worker(file_path):
+    global _worker_data
+    data = h5py.File(file_path, 'r')
+    _worker_data = (data['trnOrg'], open_mask(data), data['trnCsm'])
+
+
+def _png_paths(base_dir, index, num_coils):
+    """
+    单个切片的PNG文件路径（与原有导出方式的目录结构和文件名一致）
+    """
+    paths = {}
+    for part_index, part in enumerate(COMPLEX_PARTS):
+        paths[("original", part_index)] = os.path.join(base_dir, "original", f"original_{part}_{index}.png")
+        paths[("kspace", part_index)] = os.path.join(base_dir, "kspace", f"kspace_{part}_{index}.png")
+        for j in range(num_coils):
+            paths[("csm", j, part_index)] = os.path.join(base_dir, "csm", f"channel_{j}", f"csm_ch{j}_{part}_{index}.png")
+    paths[("mask",)] = os.path.join(base_dir, "mask", f"mask_{index}.png")
+    return paths
+
+
+def _export_slice(task):
+    """
+    worker任务：编码一个切片。PNG格式时直接写文件并返回None，数据包格式时返回编码结果由主进程写入
+    """
+    index, base_dir, output_format = task
+    org_data, mask_data, csm_data = _worker_data
+    images = encode_slice(org_data[index], mask_data[index], csm_data[index])
+    if output_format != "png":
+        return index, images
+    for key, path in _png_paths(base_dir, index, images["csm"].shape[0]).items():
+        array = images[key[0]]
+        for sub_index in key[1:]:
+            array = array[sub_index]
+        Image.fromarray(array, mode='L').save(path, compress_level=1)
+    return index, None
+
+
+def _dataset_stamp(file_path):
+    stat = os.stat(file_path)
+    return {"dataset": os.path.abspath(file_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _load_manifest(output_dir, file_path, output_format):
+    """
+    读取manifest；数据集或导出格式与之前不一致时从头开始
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    expected = dict(_dataset_stamp(file_path), format=output_format)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if all(manifest.get(key) == value for key, value in expected.items()):
+            return manifest
+        print("数据集或导出格式已变化，重新导出全部切片")
+    return dict(expected, completed=[])
+
+
+def _save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+class _BundleWriter:
+    """
+    数据包写入器：npy格式为每类数据一个.npy文件（np.load(mmap_mode='r')可直接映射），hdf5格式为单个h5文件
+    """
+    def __init__(self, output_dir, output_format, num_samples, H, W, C):
+        shapes = {
+            "original": (num_samples, 3, H, W),
+            "kspace": (num_samples, 3, H, W),
+            "mask": (num_samples, H, W),
+            "csm": (num_samples, C, 3, H, W),
+        }
+        self.h5 = None
+        if output_format == "hdf5":
+            self.h5 = h5py.File(os.path.join(output_dir, "bundle.hdf5"), 'a')
+            self.arrays = {name: self.h5.require_dataset(name, shape=shape, dtype=np.uint8,
+                                                         chunks=(1,) + shape[1:])
+                           for name, shape in shapes.items()}
+        else:
+            self.arrays = {}
+            for name, shape in shapes.items():
+                path = os.path.join(output_dir, name + ".npy")
+                mode = "r+" if os.path.exists(path) else "w+"
+                self.arrays[name] = np.lib.format.open_memmap(path, mode=mode, dtype=np.uint8, shape=shape)
+
+    def write(self, index, images):
+        for name, array in images.items():
+            self.arrays[name][index] = array
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+        else:
+            for array in self.arrays.values():
+                array.flush()
+
+
+def convert_dataset(file_path, output_dir="data/converted_dataset", workers=None, output_format="png",
+                    indices=None, manifest_interval=16):
+    """
+    并行、可断点续传地导出h5数据集
+
+    Args:
+        file_path: h5数据集路径
+        output_dir: 输出目录
+        workers: worker进程数，None表示使用全部CPU核心
+        output_format: "png"（与原有目录结构一致的PNG文件）、"npy"或"hdf5"（单个数据包）
+        indices: 导出的切片索引，None表示全部
+        manifest_interval: 每完成多少个切片更新一次manifest
+
+    Returns:
+        本次导出的吞吐量（切片/秒）
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with h5py.File(file_path, 'r') as data:
+        num_samples, H, W = data['trnOrg'].shape
+        C = data['trnCsm'].shape[1]
+    indices = list(range(num_samples)) if indices is None else list(indices)
+
+    manifest = _load_manifest(output_dir, file_path, output_format)
+    completed = set(manifest["completed"])
+    pending = [index for index in indices if index not in completed]
+    print(f"总共有 {len(indices)} 个切片，已完成 {len(indices) - len(pending)} 个，待导出 {len(pending)} 个")
+
+    if output_format == "png":
+        for name in ("original", "kspace", "mask"):
+            os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+        for j in range(C):
+            os.makedirs(os.path.join(output_dir, "csm", f"channel_{j}"), exist_ok=True)
+        writer = None
+    else:
+        writer = _BundleWriter(output_dir, output_format, num_samples, H, W, C)
+
+    start = time.perf_counter()
+    tasks = [(index, output_dir, output_format) for index in pending]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(file_path,)) as pool:
+            for count, (index, images) in enumerate(tqdm(pool.map(_export_slice, tasks, chunksize=1),
+                                                         total=len(tasks)), 1):
+                if writer is not None:
+                    writer.write(index, images)
+                manifest["completed"].append(index)
+                if count % manifest_interval == 0:
+                    _save_manifest(output_dir, manifest)
+    finally:
+        if writer is not None:
+            writer.close()
+        _save_manifest(output_dir, manifest)
+
+    elapsed = time.perf_counter() - start
+    throughput = len(pending) / elapsed if pending else 0.0
+    print(f"数据导出完成：{len(pending)} 个切片，{elapsed:.1f} s，{throughput:.2f} 切片/秒")
+    print(f"文件已保存到 {output_dir} 目录下")
+    return throughput
+
+
+def compare_throughput(file_path, num_slices, workers=None):
+    """
+    在前num_slices个切片上对比原有matplotlib导出与并行PNG导出的吞吐量
+    """
+    indices = list(range(num_slices))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        convert_dataset_matplotlib(file_path, os.path.join(tmp_dir, "matplotlib"), indices)
+        legacy = num_slices / (time.perf_counter() - start)
+        parallel = convert_dataset(file_path, os.path.join(tmp_dir, "parallel"), workers=workers, indices=indices)
+    print(f"matplotlib逐张保存: {legacy:.2f} 切片/秒，并行PNG导出: {parallel:.2f} 切片/秒，"
+          f"加速比 {parallel / legacy:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出h5数据集为图片或数据包")
+    parser.add_argument("dataset", nargs="?", default="data/dataset.hdf5", help="h5数据集路径")
+    parser.add_argument("-o", "--output", default=None,
+                        help="输出目录，默认为data/converted_dataset（png）或data/converted_bundle（npy/hdf5）")
+    parser.add_argument("--format", choices=["png", "npy", "hdf5"], default="png")
+    parser.add_argument("--workers", type=int, default=None, help="worker进程数，默认使用全部CPU核心")
+    parser.add_argument("--restart", action="store_true", help="忽略manifest，从头导出")
+    parser.add_argument("--compare", type=int, default=None, metavar="N",
+                        help="在前N个切片上对比原有导出方式与并行导出的吞吐量（不保留输出）")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_throughput(args.dataset, args.compare, workers=args.workers)
+        return
+    output_dir = args.output or ("data/converted_dataset" if args.format == "png" else "data/converted_bundle")
+    if args.restart and os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        os.remove(os.path.join(output_dir, MANIFEST_NAME))
+    convert_dataset(args.dataset, output_dir, workers=args.workers, output_format=args.format)
+
 
 if __name__ == "__main__":
-    # 替换为你的数据集路径
-    dataset_path = "data/dataset.hdf5"  # 请修改为实际的数据集路径
-    convert_dataset(dataset_path) 
\ No newline at end of file
+    main()
@@ -3,13 +3,30 @@
 # 1. 数据归一化
 # 2. 数据可视化
 # 3. 数据集类定义（包含原始图像、掩模、线圈灵敏度图等）
+# 4. 惰性读取：按索引从磁盘读取切片，带LRU切片缓存，连续存储的数据集使用内存映射
+# 5. 可选地从kspace_cache.py预计算的K空间缓存读取样本
+# 6. 多进程DataLoader支持：按进程打开文件句柄、worker初始化、样本整理和预取
+# 7. 可选的SVD线圈压缩：把C个物理线圈投影到K个虚拟线圈
+# 8. 采样掩模的稀疏索引表示（每个切片只转换一次），供只在采样位置计算的K空间损失使用
 
+import os
 import h5py
 import torch
 import numpy as np
 import matplotlib.pyplot as plt
 
-from torch.utils.data import Dataset
+from collections import OrderedDict
+from torch.utils.data import Dataset, DataLoader, Subset, default_collate, get_worker_info
+
+from kspace_cache import derive_kspace, find_cache, open_cache
+from repack_dataset import MASK_DATASET, open_mask
+from kspace_ops import mask_to_index
+
+# 惰性模式下HDF5的chunk缓存大小（字节）和缓存的最近切片数
+DEFAULT_CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_CACHE_SLICES = 8
+# h5文件中的数据集名称：原始图像、采样掩模、线圈灵敏度图
+DATASET_KEYS = ('trnOrg', 'trnMask', 'trnCsm')
 
 def normalize01(img):
     """将图像归一化到[0,1]范围
@@ -33,17 +50,14 @@ def normalize01(img):
         r, c = img.shape
         img = np.reshape(img, (nimg, r, c))
 
-    img2 = np.empty(img.shape, dtype=np.float32)
+    # 对所有图像一次性计算每张图的最小值和最大值（常数图像归一化为0）
+    flat = img.reshape(nimg, -1)
+    min_val = flat.min(axis=1, keepdims=True)
+    scale = flat.max(axis=1, keepdims=True) - min_val
+    img2 = np.zeros(flat.shape, dtype=np.float32)
+    np.divide(flat - min_val, scale, out=img2, where=scale > 0, casting='unsafe')
 
-    for i in range(nimg):
-        min_val = img[i].min()
-        max_val = img[i].max()
-        if max_val > min_val:
-            img2[i] = (img[i] - min_val) / (max_val - min_val)
-        else:
-            img2[i] = 0.0
-
-    return np.squeeze(img2)
+    return np.squeeze(img2.reshape(img.shape))
 
 def vis_data(sample):
     """可视化复数数据
@@ -100,6 +114,83 @@ def vis_data(sample):
     plt.colorbar(sc)
     plt.savefig("Mag.png")
 
+def save_kspace_plots(full_kspace, masked_kspace, inverse_masked_kspace):
+    """保存完整、掩模后和反掩模的K空间幅值图（调试用）"""
+    for name, kspace in (('full_kspace', full_kspace), ('masked_kspace', masked_kspace),
+                         ('inverse_masked_kspace', inverse_masked_kspace)):
+        plt.imshow(normalize01(np.abs(kspace)), cmap=plt.cm.gray, clim=(0.0, 0.8))
+        plt.axis('off')
+        plt.savefig(f'{name}.png', bbox_inches='tight', pad_inches=0)
+        plt.close()
+
+def coil_compression_matrix(coil_kspace, num_virtual):
+    """由多线圈K空间数据计算SVD线圈压缩矩阵
+
+    对线圈数据矩阵A (C, H*W)做SVD，取前num_virtual个左奇异向量U_K，压缩矩阵为U_K^H；
+    通过C x C的Gram矩阵A A^H做特征分解计算，代价与图像大小线性相关。
+
+    Args:
+        coil_kspace: 采样到的线圈K空间数据 (C, H, W)
+        num_virtual: 虚拟线圈数K
+
+    Returns:
+        (压缩矩阵 (K, C), 保留的能量比例)
+    """
+    A = coil_kspace.reshape(coil_kspace.shape[0], -1)
+    gram = A @ A.conj().T
+    eigenvalues, eigenvectors = torch.linalg.eigh(gram)
+    # eigh按升序返回，取最大的num_virtual个
+    eigenvalues = eigenvalues.flip(0).clamp(min=0)
+    eigenvectors = eigenvectors.flip(1)
+    energy = float(eigenvalues[:num_virtual].sum() / eigenvalues.sum().clamp(min=1e-12))
+    return eigenvectors[:, :num_virtual].conj().T, energy
+
+
+def compress_coils(matrix, coil_data):
+    """把线圈维度 (C, H, W) 的数据投影到虚拟线圈 (K, H, W)"""
+    C, H, W = coil_data.shape
+    return (matrix @ coil_data.reshape(C, -1)).reshape(matrix.shape[0], H, W)
+
+
+class SliceCache:
+    """按第一维索引读取数组切片的LRU缓存
+
+    包装h5py数据集或np.memmap，整数索引的读取结果会被缓存，其他索引直接透传。
+
+    参数:
+        source: 支持source[idx]和source.shape的数组（h5py.Dataset或np.memmap）
+        max_slices: 最多缓存的切片数
+    """
+    def __init__(self, source, max_slices=DEFAULT_CACHE_SLICES):
+        self.source = source
+        self.max_slices = max_slices
+        self.shape = source.shape
+        self.dtype = source.dtype
+        self._slices = OrderedDict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, (int, np.integer)):
+            return self.source[idx]
+        idx = int(idx) + self.shape[0] if idx < 0 else int(idx)
+        cached = self._slices.get(idx)
+        if cached is not None:
+            self._slices.move_to_end(idx)
+            return cached
+
+        value = self.source[idx]
+        if not value.flags.writeable:
+            # 内存映射的只读切片拷贝一份，避免torch.from_numpy共享只读内存
+            value = np.array(value)
+        if self.max_slices > 0:
+            self._slices[idx] = value
+            while len(self._slices) > self.max_slices:
+                self._slices.popitem(last=False)
+        return value
+
+
 class MRIDataset(Dataset):
     """MRI数据集类
     
@@ -112,23 +203,54 @@ class MRIDataset(Dataset):
     Args:
         file_path: h5文件路径
         split: 数据集划分（'train'或'test'）
+        lazy: 是否按索引从磁盘读取（False时在初始化时把整个数据集读入内存）
+        cache_slices: 惰性模式下每个数组缓存的最近切片数
+        use_mmap: 惰性模式下对未分块、未压缩的连续数据集使用内存映射
+        kspace_cache_dir: kspace_cache.py的缓存根目录，找到与数据集对应的缓存时直接读取K空间派生量
+        save_plots: 每次取样本时保存K空间幅值图（调试用，会显著拖慢训练）
+        virtual_coils: SVD线圈压缩后的虚拟线圈数，None表示使用全部物理线圈
     """
-    def __init__(self, file_path, split='train'):
+    def __init__(self, file_path, split='train', lazy=True, cache_slices=DEFAULT_CACHE_SLICES, use_mmap=True,
+                 kspace_cache_dir=None, save_plots=False, virtual_coils=None):
         super(MRIDataset, self).__init__()
         self.file_path = file_path
         self.split = split
-        self.data = h5py.File(file_path, 'r')
-        
-        # 加载数据
-        self.org_data = self.data['trnOrg'][:]      # 原始图像 (N, H, W)
-        self.mask_data = self.data['trnMask'][:]    # 采样掩模 (N, H, W)
-        self.csm_data = self.data['trnCsm'][:]      # 线圈灵敏度图 (N, C, H, W)
-        
+        self.lazy = lazy
+        self.cache_slices = cache_slices
+        self.use_mmap = use_mmap
+        self.save_plots = save_plots
+        self.virtual_coils = virtual_coils
+
+        # 预计算的K空间缓存（没有缓存时在__getitem__中即时计算）
+        self.kspace_cache_path = None
+        if kspace_cache_dir is not None:
+            self.kspace_cache_path = find_cache(file_path, kspace_cache_dir)
+            if self.kspace_cache_path is None:
+                print(f"未找到数据集 {file_path} 的K空间缓存，将即时计算（可用kspace_cache.py构建）")
+
+        # 每个切片的采样索引（mask_to_index的结果），首次访问时转换
+        self._mask_indices = {}
+        # 每个切片的线圈压缩矩阵和保留的能量比例，首次访问时计算（之后的每个epoch不再重复特征分解）
+        self._coil_compression = {}
+
+        self._eager = None
+        if not lazy:
+            # 加载数据
+            with h5py.File(file_path, 'r') as data:
+                self._eager = {name: self._h5_array(data, name)[:] for name in DATASET_KEYS}
+
+        # HDF5文件句柄和内存映射按进程打开（DataLoader的worker进程各自重新打开）
+        self._handles = {}
+        self._pid = None
+        self._open()
+
         # 获取数据维度
-        self.num_samples = self.org_data[0]
+        self.num_samples = self.org_data.shape[0]
         self.H = self.org_data.shape[1]  # 图像高度
         self.W = self.org_data.shape[2]  # 图像宽度
         self.C = self.csm_data.shape[1]  # 线圈数量
+        if virtual_coils is not None and virtual_coils < self.C:
+            self.C = virtual_coils       # 压缩后的虚拟线圈数量
 
         # 生成归一化的坐标网格
         xs = np.linspace(-1, 1, self.W)
@@ -137,6 +259,86 @@ class MRIDataset(Dataset):
         coords = np.stack([grid_x, grid_y], axis=-1)
         self.coords = torch.tensor(coords, dtype=torch.float32).view(-1, 2)
 
+    def _open(self):
+        """在当前进程中打开HDF5文件、切片缓存和K空间缓存的内存映射"""
+        handles = {'data': None}
+        if self.lazy:
+            # 只打开文件并读取元数据，切片在__getitem__中按需读取
+            handles['data'] = h5py.File(self.file_path, 'r', rdcc_nbytes=DEFAULT_CHUNK_CACHE_BYTES)
+            for name in DATASET_KEYS:
+                handles[name] = self._open_array(handles['data'], name)
+        else:
+            handles.update(self._eager)
+        handles['kspace_cache'] = open_cache(self.kspace_cache_path) if self.kspace_cache_path else None
+        self._handles = handles
+        self._pid = os.getpid()
+
+    def reopen(self):
+        """丢弃继承自父进程的句柄并在当前进程重新打开（fork出的worker进程不能共用父进程的HDF5句柄）"""
+        self._handles = {}
+        self._open()
+
+    def _handle(self, name):
+        if self._pid != os.getpid():
+            self.reopen()
+        return self._handles[name]
+
+    @property
+    def data(self):
+        """HDF5文件句柄（非惰性模式下为None）"""
+        return self._handle('data')
+
+    @property
+    def org_data(self):
+        """原始图像 (N, H, W)"""
+        return self._handle('trnOrg')
+
+    @property
+    def mask_data(self):
+        """采样掩模 (N, H, W)"""
+        return self._handle('trnMask')
+
+    @property
+    def csm_data(self):
+        """线圈灵敏度图 (N, C, H, W)"""
+        return self._handle('trnCsm')
+
+    @property
+    def kspace_cache(self):
+        """K空间缓存的内存映射（字段名 -> np.memmap），没有缓存时为None"""
+        return self._handle('kspace_cache')
+
+    def __getstate__(self):
+        # 序列化到spawn的worker进程时不携带文件句柄和内存映射，在worker中首次访问时重新打开
+        state = self.__dict__.copy()
+        state['_handles'] = {}
+        state['_pid'] = None
+        return state
+
+    @staticmethod
+    def _h5_array(data, name):
+        """h5文件中的数组（repack_dataset.py按位打包的掩模会在读取时解包）"""
+        return open_mask(data) if name == MASK_DATASET else data[name]
+
+    def _open_array(self, data, name):
+        """惰性打开一个数据集：连续存储时使用内存映射，否则按索引读取HDF5，两者都带LRU切片缓存
+
+        Args:
+            data: 已打开的h5py.File
+            name: 数据集名称
+
+        Returns:
+            SliceCache
+        """
+        dataset = self._h5_array(data, name)
+        source = dataset
+        if self.use_mmap and isinstance(dataset, h5py.Dataset) and dataset.chunks is None and dataset.compression is None:
+            offset = dataset.id.get_offset()
+            if offset is not None:
+                source = np.memmap(self.file_path, dtype=dataset.dtype, mode='r',
+                                   offset=offset, shape=dataset.shape)
+        return SliceCache(source, max_slices=self.cache_slices)
+
     def __getitem__(self, idx):
         """获取单个数据样本
         
@@ -152,54 +354,43 @@ class MRIDataset(Dataset):
             - gt_loss_csm_kspace: 掩模后的线圈K空间数据
             - mask: 采样掩模
             - gt_img: 原始图像
-            - gt_csm: 线圈灵敏度图
+            - gt_csm: 线圈灵敏度图（启用线圈压缩时为虚拟线圈）
+            - coil_energy: 线圈压缩保留的能量比例（未压缩时为1.0）
+            - mask_index: 采样掩模的稀疏索引（见kspace_ops.mask_to_index）
         """
         # 获取原始数据
-        org_np = self.org_data[idx]
-        mask_np = self.mask_data[idx]
-        csm_np = self.csm_data[idx]
-
-        # 转换为PyTorch张量
-        org = torch.from_numpy(org_np)
-        mask = torch.from_numpy(mask_np).float()
-        csm = torch.from_numpy(csm_np).to(torch.complex64)
-
-        # 处理线圈维度
-        if org.ndim == 2:
-            org_expand = org.unsqueeze(0).repeat(csm.shape[0], 1, 1)
-
-        # 计算K空间数据
-        full_kspace = torch.fft.fft2(org)
-        masked_kspace = full_kspace * mask
-        inverse_masked_kspace = full_kspace * (1 - mask)
-
-        # 可视化K空间数据
-        plt.imshow(normalize01(np.abs(full_kspace)), cmap=plt.cm.gray, clim=(0.0, 0.8))
-        plt.axis('off')
-        plt.show()
-        plt.savefig('full_kspace.png', bbox_inches='tight', pad_inches=0)
-        plt.close()
-
-        plt.imshow(normalize01(np.abs(masked_kspace)), cmap=plt.cm.gray, clim=(0.0, 0.8))
-        plt.axis('off')
-        plt.show()
-        plt.savefig('masked_kspace.png', bbox_inches='tight', pad_inches=0)
-        plt.close()
+        org = torch.from_numpy(self.org_data[idx])
+        csm = torch.from_numpy(self.csm_data[idx]).to(torch.complex64)
 
-        plt.imshow(normalize01(np.abs(inverse_masked_kspace)), cmap=plt.cm.gray, clim=(0.0, 0.8))
-        plt.axis('off')
-        plt.show()
-        plt.savefig('inverse_masked_kspace.png', bbox_inches='tight', pad_inches=0)
-        plt.close()
+        if self.kspace_cache is not None:
+            # 从预计算的K空间缓存读取（内存映射的只读切片需要拷贝一份）
+            cached = {name: torch.from_numpy(np.array(array[idx])) for name, array in self.kspace_cache.items()}
+            mask = cached.pop('mask')
+            if mask.ndim == 2:
+                mask = mask.unsqueeze(0).expand(csm.shape[0], -1, -1)
+            full_kspace, masked_kspace = cached['gt_full_kspace'], cached['gt_loss_kspace']
+            full_csm_kspace, masked_csm_kspace = cached['gt_full_csm_kspace'], cached['gt_loss_csm_kspace']
+        else:
+            derived = derive_kspace(org, torch.from_numpy(self.mask_data[idx]).float(), csm)
+            mask = derived['mask']
+            full_kspace, masked_kspace = derived['gt_full_kspace'], derived['gt_loss_kspace']
+            full_csm_kspace, masked_csm_kspace = derived['gt_full_csm_kspace'], derived['gt_loss_csm_kspace']
+            if self.save_plots:
+                save_kspace_plots(full_kspace, masked_kspace, derived['inverse_masked_kspace'])
 
-        # 计算线圈相关的数据
-        csm_org = org_expand * csm
-        full_csm_kspace = torch.fft.fft2(csm_org)
+        if idx not in self._mask_indices:
+            self._mask_indices[idx] = mask_to_index(mask[0] if mask.ndim == 3 else mask)
 
-        # 处理掩模维度
-        if mask.ndim == 2:
-            mask = mask.unsqueeze(0).repeat(csm.shape[0], 1, 1)
-        masked_csm_kspace = full_csm_kspace * mask
+        coil_energy = 1.0
+        if self.virtual_coils is not None and self.virtual_coils < csm.shape[0]:
+            # 线圈压缩：压缩矩阵由采样到的线圈K空间计算，CSM和线圈K空间做同样的线性变换
+            if idx not in self._coil_compression:
+                self._coil_compression[idx] = coil_compression_matrix(masked_csm_kspace, self.virtual_coils)
+            matrix, coil_energy = self._coil_compression[idx]
+            csm = compress_coils(matrix, csm)
+            full_csm_kspace = compress_coils(matrix, full_csm_kspace)
+            masked_csm_kspace = compress_coils(matrix, masked_csm_kspace)
+            mask = mask[:self.virtual_coils]
 
         # 返回数据字典
         sample = {
@@ -211,9 +402,63 @@ class MRIDataset(Dataset):
             'mask': mask,                            # 掩模
             'gt_img': org,                           # 原始图像
             'gt_csm': csm,                           # 线圈灵敏度图
+            'coil_energy': coil_energy,              # 线圈压缩保留的能量比例
+            'mask_index': self._mask_indices[idx],   # 采样掩模的稀疏索引
         }
         return sample
 
     def __len__(self):
         """返回数据集大小"""
         return self.num_samples
+
+
+def worker_init_fn(worker_id):
+    """DataLoader worker进程的初始化函数
+
+    在worker中重新打开数据集的文件句柄，并把FFT等预处理限制为单线程，避免多个worker争抢CPU。
+    """
+    torch.set_num_threads(1)
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+    dataset = get_worker_info().dataset
+    while isinstance(dataset, Subset):
+        dataset = dataset.dataset
+    if isinstance(dataset, MRIDataset):
+        dataset.reopen()
+
+
+def collate_mri_batch(samples):
+    """整理MRIDataset样本为批次
+
+    坐标网格对所有样本相同，只保留一份并扩展为批次维度（不复制数据）；
+    各切片的采样点数可能不同，mask_index保留为每个样本一个字典的列表；其他字段与default_collate一致。
+    """
+    coords = samples[0]['coords']
+    batch = default_collate([{key: value for key, value in sample.items() if key not in ('coords', 'mask_index')}
+                             for sample in samples])
+    batch['coords'] = coords.unsqueeze(0).expand(len(samples), -1, -1)
+    if 'mask_index' in samples[0]:
+        batch['mask_index'] = [sample['mask_index'] for sample in samples]
+    return batch
+
+
+def make_data_loader(dataset, batch_size=1, shuffle=False, num_workers=0, prefetch_factor=2, pin_memory=None):
+    """创建MRIDataset的DataLoader
+
+    Args:
+        dataset: MRIDataset或其Subset
+        batch_size: 批次大小
+        shuffle: 是否打乱
+        num_workers: worker进程数，0表示在主进程中读取
+        prefetch_factor: 每个worker预取的批次数
+        pin_memory: 是否使用锁页内存（None表示有CUDA时启用），加快拷贝到GPU
+
+    Returns:
+        DataLoader
+    """
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = dict(worker_init_fn=worker_init_fn, prefetch_factor=prefetch_factor, persistent_workers=True)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+                      collate_fn=collate_mri_batch, pin_memory=pin_memory, **kwargs)
@@ -0,0 +1,197 @@
+# 蒸馏文件：把大型SIREN配置（例如config.yaml中的512x6）蒸馏为小型服务模型
+# 主要功能：
+# 1. 在稠密网格和网格单元内随机抖动的坐标上采样教师模型的复数输出
+# 2. 训练小型学生网络拟合教师输出（默认复用教师的傅里叶编码，只学习MLP）
+# 3. 教师和学生一起登记到ModelService的模型目录（教师为主模型，学生为student变体），附带延迟和保真度报告
+# 用法：
+#   python distill.py --checkpoint result/checkpoints/best_model.pt --model-dir ../app/models/slice1 --hidden-features 128 --hidden-layers 3
+
+import os
+import json
+import yaml
+import argparse
+import torch
+import torch.nn.functional as F
+
+from model import build_model, get_model_config
+from dataset import MRIDataset
+from serving_format import load_trained_model, save_inr
+from quantize import register_variant
+from prune import tradeoff_report
+from inference import evaluate_tiled, make_coordinate_grid
+
+
+STUDENT_VARIANT = "student"
+TEACHER_FILENAME = "model.inr"
+STUDENT_FILENAME = "model_student.inr"
+
+
+def build_student(teacher, hidden_features, hidden_layers, omega_0=None, activation=None):
+    """根据教师模型创建学生模型
+
+    学生沿用教师的编码器配置并复制编码器参数（傅里叶频率矩阵B等），只缩小MLP。
+    学生始终是单一的稠密MLP：教师使用空间分块专家（experts）时，学生不沿用图块划分。
+
+    Args:
+        teacher: 教师Fullmodel
+        hidden_features: 学生的隐藏层宽度
+        hidden_layers: 学生的隐藏层数量
+        omega_0: 学生的SIREN频率参数，None表示与教师相同
+        activation: 学生的激活函数，None表示与教师相同
+
+    Returns:
+        学生Fullmodel
+    """
+    config = get_model_config(teacher)
+    config["mlp"]["mlp_hidden_features"] = hidden_features
+    config["mlp"]["mlp_hidden_layers"] = hidden_layers
+    config["mlp"].pop("experts", None)
+    if omega_0 is not None:
+        config["mlp"]["omega_0"] = omega_0
+    if activation is not None:
+        config["mlp"]["activation"] = activation
+    student = build_model(config)
+    student.encoder.load_state_dict(teacher.encoder.state_dict())
+    return student
+
+
+def jittered_coords(coords, H, W, count):
+    """在网格单元内随机抖动的坐标
+
+    Args:
+        coords: 形状为[H*W, 2]的网格坐标（每行为(x, y)）
+        H, W: 网格尺寸
+        count: 采样点数
+
+    Returns:
+        形状为[count, 2]的坐标
+    """
+    index = torch.randint(0, coords.shape[0], (count,), device=coords.device)
+    cell = torch.tensor([2.0 / max(W - 1, 1), 2.0 / max(H - 1, 1)], device=coords.device)
+    noise = (torch.rand(count, 2, device=coords.device) - 0.5) * cell
+    return (coords[index] + noise).clamp(-1.0, 1.0)
+
+
+def distill(teacher, student, coords, H, W, steps=5000, batch_size=65536, jitter_ratio=0.5,
+            learning_rate=1e-4, log_interval=500):
+    """训练学生模型拟合教师模型的复数输出
+
+    每步的批次一部分取自稠密网格（教师输出预先计算），一部分为网格单元内的抖动坐标
+    （教师输出即时计算），使学生在像素之间也与教师的连续图像一致。
+
+    Args:
+        teacher: 教师模型
+        student: 学生模型（原地训练）
+        coords: 稠密网格坐标
+        H, W: 网格尺寸
+        steps: 训练步数
+        batch_size: 每步的坐标数
+        jitter_ratio: 抖动坐标所占比例
+        learning_rate: 学习率
+        log_interval: 打印间隔
+
+    Returns:
+        student
+    """
+    teacher.eval()
+    grid_output = evaluate_tiled(teacher, coords)
+    num_jitter = int(batch_size * jitter_ratio)
+    num_grid = min(batch_size - num_jitter, coords.shape[0])
+
+    optimizer = torch.optim.Adam(student.parameters(), lr=learning_rate)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=steps)
+    student.train()
+    for step in range(steps):
+        index = torch.randint(0, coords.shape[0], (num_grid,), device=coords.device)
+        batch_coords, target = coords[index], grid_output[index]
+        if num_jitter > 0:
+            jitter = jittered_coords(coords, H, W, num_jitter)
+            with torch.no_grad():
+                jitter_target = teacher(jitter)
+            batch_coords = torch.cat((batch_coords, jitter))
+            target = torch.cat((target, jitter_target))
+
+        loss = F.mse_loss(student(batch_coords), target)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        scheduler.step()
+        if (step + 1) % log_interval == 0:
+            print(f"Step {step + 1}/{steps}: 蒸馏损失 {loss.item():.4e}")
+    return student.eval()
+
+
+def complex_nse(teacher, student, coords):
+    """学生相对教师的复数输出归一化平方误差"""
+    reference = evaluate_tiled(teacher, coords)
+    candidate = evaluate_tiled(student, coords)
+    return float(((candidate - reference) ** 2).sum() / (reference ** 2).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SIREN模型蒸馏")
+    parser.add_argument("--checkpoint", required=True, help="教师模型文件（.pt或.inr）")
+    parser.add_argument("--model-dir", required=True, help="ModelService的模型目录（models/<id>）")
+    parser.add_argument("--config", default="config.yaml", help="训练配置，检查点只含state_dict时用于构建模型")
+    parser.add_argument("--hidden-features", type=int, default=128)
+    parser.add_argument("--hidden-layers", type=int, default=3)
+    parser.add_argument("--omega-0", type=float, default=None)
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=65536)
+    parser.add_argument("--jitter-ratio", type=float, default=0.5)
+    parser.add_argument("--learning-rate", type=float, default=1e-4)
+    parser.add_argument("--index", type=int, default=1, help="参考切片索引（与start.py训练使用的切片一致）")
+    parser.add_argument("--size", type=int, default=256, help="没有数据集时使用的网格边长")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    config = None
+    if os.path.exists(args.config):
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    teacher = load_trained_model(args.checkpoint, config).to(device)
+
+    # 参考切片：优先使用训练数据集中的切片，数据集不可用时只报告相对教师的指标
+    gt_img = None
+    if config is not None and os.path.exists(config["dataset_path"]):
+        sample = MRIDataset(config["dataset_path"], split='train')[args.index]
+        coords, gt_img = sample["coords"].to(device), sample["gt_img"]
+        H, W = gt_img.shape
+    else:
+        H = W = args.size
+        coords = make_coordinate_grid(H, W, device=device)
+
+    student = build_student(teacher, args.hidden_features, args.hidden_layers, omega_0=args.omega_0).to(device)
+    distill(teacher, student, coords, H, W, steps=args.steps, batch_size=args.batch_size,
+            jitter_ratio=args.jitter_ratio, learning_rate=args.learning_rate)
+
+    report = tradeoff_report(teacher, student, coords, H, W, gt_img=gt_img, repeats=args.repeats)
+    report["complex_nse_vs_original"] = complex_nse(teacher, student, coords)
+    print(json.dumps(report, ensure_ascii=False))
+
+    # 教师作为主模型、学生作为student变体登记到同一个模型目录
+    os.makedirs(args.model_dir, exist_ok=True)
+    teacher, student = teacher.cpu(), student.cpu()
+    save_inr(teacher, os.path.join(args.model_dir, TEACHER_FILENAME))
+    save_inr(student, os.path.join(args.model_dir, STUDENT_FILENAME), metadata={"distill_report": report})
+
+    info_path = os.path.join(args.model_dir, "info.json")
+    info = {}
+    if os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    info.setdefault("name", os.path.basename(os.path.normpath(args.model_dir)))
+    info.setdefault("description", "基于隐式神经表示的MRI重建模型")
+    info["model_filename"] = TEACHER_FILENAME
+    info["config"] = get_model_config(teacher)
+    info.setdefault("inference", {})["latency_ms"] = report["latency_original_ms"]
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=4)
+    register_variant(args.model_dir, STUDENT_VARIANT, STUDENT_FILENAME, report, fmt="inr",
+                     config=get_model_config(student))
+    print(f"教师和学生模型已登记到 {info_path}（学生为变体 {STUDENT_VARIANT}）")
+
+
+if __name__ == "__main__":
+    main()
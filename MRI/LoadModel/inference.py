@@ -0,0 +1,538 @@
+# 推理引擎文件：将训练好的Fullmodel冻结为优化后的推理形式
+# 主要功能：
+# 1. 常数折叠：将coordinate_scales、omega_0和sqrt(2)常数折叠进权重
+# 2. 算子融合：傅里叶编码合并为一次 线性+sin（cos(x) = sin(x + pi/2)），每层 线性+激活 融合
+# 3. 编译执行：通过torch.jit.trace + freeze 生成冻结的TorchScript图
+# 4. 分块推理：在给定内存预算下按坐标分块执行，输出写入预分配的缓冲区
+# 5. 多模型批量推理：将多个同结构模型的权重堆叠，在共享坐标网格上一次bmm求值
+# 6. 低精度推理：bf16计算或fp16权重存储，加载时与fp32渲染比较PSNR，不达标则退回fp32
+# 7. 推理计时：用于基准测试的延迟测量工具
+
+import os
+import copy
+import math
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+try:
+    from .metrics import psnr
+except ImportError:
+    from metrics import psnr
+
+
+class FoldedSiren(nn.Module):
+    """折叠后的SIREN推理网络
+
+    每一层都是 y = act(x @ W^T + b) 的形式，所有常数已折叠进W和b，
+    前向传播中不再有任何额外的逐元素乘法。
+
+    参数:
+        layers: nn.Linear层列表（傅里叶编码时第一层为折叠后的编码层）
+        activations: 每层对应的激活函数名称（'sine'、'relu'或'none'）
+        encoder: 无法折叠的编码器（例如hashgrid），在线性层之前执行；None表示没有
+    """
+    def __init__(self, layers, activations, encoder=None):
+        super(FoldedSiren, self).__init__()
+        assert len(layers) == len(activations), "层数与激活函数数量不一致"
+        self.encoder = encoder
+        self.layers = nn.ModuleList(layers)
+        self.activations = list(activations)
+        self.compute_dtype = torch.float32
+
+    def cast(self, storage_dtype, compute_dtype, keep_fp32_layers=0):
+        """转换为低精度权重
+
+        Args:
+            storage_dtype: 权重的存储精度
+            compute_dtype: 低精度层的计算精度（与storage_dtype不同时在前向中临时上转换）
+            keep_fp32_layers: 保持fp32的前几层（编码层和omega_0层的预激活值很大，对精度敏感）
+
+        Returns:
+            self
+        """
+        for layer in self.layers[keep_fp32_layers:]:
+            layer.to(storage_dtype)
+        self.compute_dtype = compute_dtype
+        return self
+
+    def forward(self, x):
+        """前向传播
+
+        Args:
+            x: 形状为[batch_size, in_features]的输入坐标
+
+        Returns:
+            形状为[batch_size, out_features]的输出
+        """
+        h = x if self.encoder is None else self.encoder(x)
+        for layer, activation in zip(self.layers, self.activations):
+            if not isinstance(layer, nn.Linear):
+                # 量化后的线性层（例如动态int8量化）：输入输出均为fp32
+                h = _apply_activation(layer(h.float()), activation)
+                continue
+            weight, bias = layer.weight, layer.bias
+            if weight.dtype != self.compute_dtype and weight.dtype != torch.float32:
+                # 仅以低精度存储的层：临时上转换到计算精度
+                weight, bias = weight.to(self.compute_dtype), bias.to(self.compute_dtype)
+            h = _apply_activation(F.linear(h.to(weight.dtype), weight, bias), activation)
+        return h.float()
+
+
+def _make_linear(weight, bias):
+    """由给定的权重和偏置构造nn.Linear层"""
+    out_features, in_features = weight.shape
+    layer = nn.Linear(in_features, out_features)
+    with torch.no_grad():
+        layer.weight.copy_(weight)
+        layer.bias.copy_(bias)
+    return layer
+
+
+def _fold_fourier_encoder(encoder):
+    """将傅里叶特征映射折叠为一个 线性+sin 层
+
+    原始计算: [sqrt(2)*sin((s*x) @ B), sqrt(2)*cos((s*x) @ B)]
+    折叠后:   sin(x @ [s^T*B, s^T*B] + [0, pi/2])，sqrt(2)留给下一层的权重
+
+    Returns:
+        (折叠后的编码层, 需要乘到下一层权重上的常数)
+    """
+    scales = encoder.coordinate_scales.detach().cpu().reshape(-1, 1)
+    B = encoder.B.detach().cpu() * scales
+    weight = torch.cat((B, B), dim=1).t().contiguous()
+    bias = torch.cat((torch.zeros(encoder.num_freq),
+                      torch.full((encoder.num_freq,), math.pi / 2)))
+    return _make_linear(weight, bias.to(weight.dtype)), math.sqrt(2)
+
+
+def fold_model(model):
+    """将Fullmodel折叠为FoldedSiren
+
+    Args:
+        model: 训练好的Fullmodel（eager模式）
+
+    Returns:
+        等价的FoldedSiren实例（位于CPU、评估模式）
+
+    Raises:
+        ValueError: 模型结构无法折叠时抛出
+    """
+    encoder = getattr(model, "encoder", None)
+    net = getattr(model, "net", None)
+    if encoder is None or net is None or not hasattr(net, "mlp"):
+        raise ValueError("Unsupported model for folding: " + type(model).__name__)
+    layers, activations = [], []
+    if getattr(model, "encoding_mode", None) == "fourier":
+        # 傅里叶编码层
+        encoder_layer, input_gain = _fold_fourier_encoder(encoder)
+        # 频率退火未完成时，各特征的权重作为逐列常数乘到下一层
+        anneal_weights = encoder.annealing_weights() if hasattr(encoder, "annealing_weights") else None
+        if anneal_weights is not None:
+            input_gain = input_gain * anneal_weights.detach().cpu()
+        layers.append(encoder_layer)
+        activations.append("sine")
+        unfolded_encoder = None
+    else:
+        # 其他编码器（例如hashgrid）保持原样，只折叠MLP部分
+        unfolded_encoder = copy.deepcopy(encoder).cpu().eval()
+        input_gain = 1.0
+
+    # MLP各层：上一层遗留的常数（标量或逐输入特征的向量）乘到当前层权重上，first层的omega_0同时乘到权重和偏置上
+    for module in net.mlp:
+        if isinstance(module, nn.Linear):
+            linear, activation, omega = module, "none", 1.0
+        elif hasattr(module, "linear"):
+            linear = module.linear
+            if hasattr(module, "omega_0"):
+                activation = "sine"
+                omega = module.omega_0 if module.is_first else 1.0
+            else:
+                activation, omega = "relu", 1.0
+        else:
+            raise ValueError("Unsupported layer for folding: " + type(module).__name__)
+
+        weight = linear.weight.detach().cpu() * (input_gain * omega)
+        bias = linear.bias.detach().cpu() * omega
+        layers.append(_make_linear(weight, bias))
+        activations.append(activation)
+        input_gain = 1.0
+
+    return FoldedSiren(layers, activations, encoder=unfolded_encoder).eval()
+
+
+# 推理精度：名称 -> (权重存储精度, 低精度层的计算精度)
+PRECISIONS = {
+    "fp32": (torch.float32, torch.float32),
+    "bf16": (torch.bfloat16, torch.bfloat16),
+    "fp16": (torch.float16, torch.float32),
+}
+FP32_LEADING_LAYERS = 2    # 低精度模式下保持fp32的前几层（傅里叶编码层和omega_0层）
+DEFAULT_MIN_PSNR = 40.0    # 精度守卫：低精度渲染相对fp32渲染的最低PSNR（dB）
+
+
+class InferenceEngine:
+    """推理引擎：冻结后的模型及其执行方式
+
+    backend说明:
+        'jit'     - 折叠 + torch.jit.trace + freeze（默认）
+        'compile' - 折叠 + torch.compile（需要PyTorch 2.x）
+        'folded'  - 仅折叠，eager执行
+        'eager'   - 原始模型，不做任何优化
+
+    precision说明:
+        'fp32' - 全精度（默认）
+        'bf16' - bf16权重与计算（eager模式下使用CPU autocast）
+        'fp16' - fp16权重存储、fp32计算，节省内存（强制使用'folded'后端，避免冻结图把上转换折叠掉）
+
+    无法折叠的模型（例如不是 编码器+ExpertMLP 结构）会自动退回eager模式。
+
+    参数:
+        model: 训练好的模型
+        backend: 执行后端
+        device: 推理设备
+        memory_budget: 分块推理的激活内存预算（字节），None表示根据可用内存自动选择
+        precision: 推理精度
+    """
+    def __init__(self, model, backend="jit", device=None, memory_budget=None, precision="fp32"):
+        if precision not in PRECISIONS:
+            raise ValueError("Unsupported precision: " + precision)
+        self.device = torch.device(device) if device is not None else torch.device("cpu")
+        self.backend = backend
+        self.memory_budget = memory_budget
+        self.precision = precision
+        self.max_width = max_feature_width(model)
+        self.guard_psnr = None
+        self.autocast_dtype = None
+        storage_dtype, compute_dtype = PRECISIONS[precision]
+
+        if backend != "eager":
+            try:
+                folded = fold_model(model)
+            except ValueError as e:
+                print(f"模型无法折叠，使用eager模式: {e}")
+                backend = "eager"
+
+        if backend == "eager":
+            if precision == "fp16":
+                raise ValueError("fp16 weight storage requires a foldable model")
+            if precision == "bf16":
+                self.autocast_dtype = torch.bfloat16
+            # 使用副本，不改变调用方模型的设备和训练/评估模式
+            self.module = copy.deepcopy(model).to(self.device).eval()
+            self.weight_bytes = _parameter_bytes(self.module)
+            self.backend = backend
+            return
+
+        if precision != "fp32":
+            folded.cast(storage_dtype, compute_dtype, keep_fp32_layers=FP32_LEADING_LAYERS)
+            if precision == "fp16" and backend == "jit":
+                backend = "folded"
+        folded = folded.to(self.device)
+        self.weight_bytes = _parameter_bytes(folded)
+
+        if backend == "folded":
+            self.module = folded
+        elif backend == "jit":
+            in_features = folded.encoder.in_features if folded.encoder is not None else folded.layers[0].in_features
+            example = torch.zeros(16, in_features, device=self.device)
+            with torch.no_grad():
+                traced = torch.jit.trace(folded, example)
+            self.module = torch.jit.freeze(traced.eval())
+        elif backend == "compile":
+            self.module = torch.compile(folded)
+        else:
+            raise ValueError("Unsupported backend: " + backend)
+        self.backend = backend
+
+    def __call__(self, coords):
+        """对坐标进行推理
+
+        Args:
+            coords: 形状为[N, in_features]的坐标张量
+
+        Returns:
+            形状为[N, 2]的float32预测结果
+        """
+        coords = coords.to(self.device, dtype=torch.float32)
+        if self.autocast_dtype is not None:
+            with torch.autocast(device_type=self.device.type, dtype=self.autocast_dtype):
+                output = evaluate_tiled(self.module, coords,
+                                        memory_budget=self.memory_budget, width=self.max_width)
+            return output.float()
+        return evaluate_tiled(self.module, coords,
+                              memory_budget=self.memory_budget, width=self.max_width)
+
+
+def _parameter_bytes(module):
+    """统计模块参数占用的字节数"""
+    return sum(p.numel() * p.element_size() for p in module.parameters())
+
+
+def render_psnr(reference, candidate):
+    """比较两次渲染结果的PSNR（幅值归一化到[0,1]后计算）
+
+    Args:
+        reference: 参考渲染，形状[N, 2]
+        candidate: 待比较的渲染，形状[N, 2]
+
+    Returns:
+        PSNR（dB）
+    """
+    def normalized_magnitude(pred):
+        mag = torch.sqrt(pred[:, 0].float() ** 2 + pred[:, 1].float() ** 2)
+        return (mag - mag.min()) / (mag.max() - mag.min() + 1e-8)
+
+    return float(psnr(normalized_magnitude(candidate).view(1, -1), normalized_magnitude(reference).view(1, -1)))
+
+
+def build_engine(model, backend="jit", device=None, memory_budget=None, precision="fp32",
+                 min_psnr=DEFAULT_MIN_PSNR, guard_size=256):
+    """创建推理引擎，低精度模式下带精度守卫
+
+    低精度引擎创建后在guard_size x guard_size网格上与fp32引擎的渲染结果比较，
+    PSNR低于min_psnr（或低精度模式不可用）时退回fp32引擎。
+
+    Args:
+        model: 训练好的模型
+        backend: 执行后端
+        device: 推理设备
+        memory_budget: 分块推理的激活内存预算（字节）
+        precision: 期望的推理精度
+        min_psnr: 精度守卫阈值（dB）
+        guard_size: 精度守卫使用的网格边长
+
+    Returns:
+        InferenceEngine实例（guard_psnr记录守卫检查的PSNR）
+    """
+    reference = InferenceEngine(model, backend=backend, device=device, memory_budget=memory_budget)
+    if precision == "fp32":
+        return reference
+
+    try:
+        candidate = InferenceEngine(model, backend=backend, device=device,
+                                    memory_budget=memory_budget, precision=precision)
+    except (ValueError, RuntimeError) as e:
+        print(f"{precision}推理不可用，使用fp32: {e}")
+        return reference
+
+    coords = make_coordinate_grid(guard_size, guard_size, device=reference.device)
+    psnr = render_psnr(reference(coords), candidate(coords))
+    candidate.guard_psnr = psnr
+    reference.guard_psnr = psnr
+    if psnr < min_psnr:
+        print(f"{precision}渲染PSNR {psnr:.2f} dB 低于阈值 {min_psnr:.2f} dB，退回fp32")
+        return reference
+    return candidate
+
+
+# 自动选择分块大小时使用的默认参数
+DEFAULT_MEMORY_FRACTION = 0.25   # 未指定预算时，最多使用可用内存的比例
+MIN_TILE_SIZE = 1024             # 最小分块大小（坐标点数）
+ACTIVATIONS_PER_ROW = 4          # 每个坐标点同时存活的激活张量个数（输入、线性输出、激活输出及余量）
+
+
+def available_memory_bytes():
+    """获取当前可用的物理内存（字节）
+
+    优先使用psutil，其次读取/proc/meminfo，最后退回到os.sysconf
+    """
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 1 << 30
+
+
+def max_feature_width(model, default=512):
+    """获取模型中最宽的线性层宽度，用于估计每个坐标点的激活内存
+
+    Args:
+        model: 任意nn.Module
+        default: 找不到线性层时（例如冻结后的TorchScript模型）使用的默认宽度
+
+    Returns:
+        最大特征维度
+    """
+    widths = [max(m.in_features, m.out_features) for m in model.modules() if isinstance(m, nn.Linear)]
+    return max(widths) if widths else default
+
+
+def auto_tile_size(num_points, width, memory_budget=None, element_size=4):
+    """根据内存预算自动选择分块大小
+
+    Args:
+        num_points: 坐标点总数
+        width: 网络最大特征宽度
+        memory_budget: 激活内存预算（字节），None表示使用可用内存的DEFAULT_MEMORY_FRACTION
+        element_size: 每个元素的字节数
+
+    Returns:
+        每块的坐标点数
+    """
+    if memory_budget is None:
+        memory_budget = available_memory_bytes() * DEFAULT_MEMORY_FRACTION
+    bytes_per_point = ACTIVATIONS_PER_ROW * width * element_size
+    tile_size = int(memory_budget // bytes_per_point)
+    tile_size = max(MIN_TILE_SIZE, tile_size // MIN_TILE_SIZE * MIN_TILE_SIZE)
+    return min(tile_size, num_points)
+
+
+def evaluate_tiled(model, coords, memory_budget=None, tile_size=None, width=None):
+    """分块执行模型推理，峰值激活内存与坐标总数无关
+
+    每块坐标依次通过网络，结果写入预分配的输出缓冲区。
+
+    Args:
+        model: 模型或任意可调用对象
+        coords: 形状为[N, in_features]的坐标张量
+        memory_budget: 激活内存预算（字节），None表示根据可用内存自动选择
+        tile_size: 显式指定每块的坐标点数（优先于memory_budget）
+        width: 网络最大特征宽度，None时从模型中推断
+
+    Returns:
+        形状为[N, out_features]的预测结果
+    """
+    num_points = coords.shape[0]
+    if tile_size is None:
+        if width is None:
+            width = max_feature_width(model) if isinstance(model, nn.Module) else 512
+        tile_size = auto_tile_size(num_points, width, memory_budget)
+
+    with torch.no_grad():
+        output = None
+        for start in range(0, num_points, tile_size):
+            end = min(start + tile_size, num_points)
+            tile_out = model(coords[start:end])
+            if output is None:
+                if end == num_points:
+                    return tile_out
+                output = torch.empty((num_points,) + tuple(tile_out.shape[1:]),
+                                     dtype=tile_out.dtype, device=tile_out.device)
+            output[start:end] = tile_out
+    return output
+
+
+class ModelStack:
+    """多模型批量推理
+
+    将N个结构相同的模型折叠后，把每层权重堆叠为[N, in, out]的批量张量，
+    对共享的坐标网格一次性求值：第一层是坐标与批量权重的广播矩阵乘，其余各层使用baddbmm。
+
+    参数:
+        models: 结构相同的模型列表
+        device: 推理设备
+        memory_budget: 分块推理的激活内存预算（字节），None表示根据可用内存自动选择
+    """
+    def __init__(self, models, device=None, memory_budget=None):
+        if not models:
+            raise ValueError("ModelStack requires at least one model")
+        self.device = torch.device(device) if device is not None else torch.device("cpu")
+        self.memory_budget = memory_budget
+
+        folded = [fold_model(model) for model in models]
+        reference = folded[0]
+        for other in folded[1:]:
+            if not _same_architecture(reference, other):
+                raise ValueError("ModelStack requires models with identical architecture")
+        if reference.encoder is not None:
+            raise ValueError("ModelStack only supports fully folded (fourier) models")
+
+        self.num_models = len(folded)
+        self.activations = list(reference.activations)
+        # 权重转置为[N, in, out]以便直接用于bmm，偏置为[N, 1, out]
+        self.weights = [torch.stack([f.layers[i].weight.detach().t() for f in folded]).contiguous().to(self.device)
+                        for i in range(len(reference.layers))]
+        self.biases = [torch.stack([f.layers[i].bias.detach() for f in folded]).unsqueeze(1).to(self.device)
+                       for i in range(len(reference.layers))]
+        self.max_width = max(max(w.shape[1], w.shape[2]) for w in self.weights)
+
+    def _forward_tile(self, coords):
+        """对一块坐标求所有模型的输出，返回[tile, N, out]"""
+        h = torch.matmul(coords, self.weights[0]) + self.biases[0]
+        h = _apply_activation(h, self.activations[0])
+        for weight, bias, activation in zip(self.weights[1:], self.biases[1:], self.activations[1:]):
+            h = _apply_activation(torch.baddbmm(bias, h, weight), activation)
+        return h.transpose(0, 1)
+
+    def __call__(self, coords):
+        """在共享坐标网格上对所有模型求值
+
+        Args:
+            coords: 形状为[P, in_features]的坐标张量
+
+        Returns:
+            形状为[N, P, out_features]的预测结果
+        """
+        output = evaluate_tiled(self._forward_tile, coords.to(self.device),
+                                memory_budget=self.memory_budget,
+                                width=self.max_width * self.num_models)
+        return output.transpose(0, 1)
+
+
+def _apply_activation(h, activation):
+    """按名称应用激活函数"""
+    if activation == "sine":
+        return torch.sin(h)
+    if activation == "relu":
+        return F.relu(h)
+    return h
+
+
+def _same_architecture(a, b):
+    """判断两个FoldedSiren的结构是否相同"""
+    if a.activations != b.activations or len(a.layers) != len(b.layers):
+        return False
+    if (a.encoder is None) != (b.encoder is None):
+        return False
+    return all(x.weight.shape == y.weight.shape for x, y in zip(a.layers, b.layers))
+
+
+def measure_latency(fn, coords, repeats=10, warmup=2):
+    """测量推理延迟
+
+    Args:
+        fn: 推理函数（模型或InferenceEngine）
+        coords: 输入坐标
+        repeats: 计时重复次数
+        warmup: 预热次数
+
+    Returns:
+        平均单次推理时间（毫秒）
+    """
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn(coords)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(coords)
+        elapsed = time.perf_counter() - start
+    return elapsed / repeats * 1000.0
+
+
+def make_coordinate_grid(H, W, device=None):
+    """生成归一化的坐标网格（与MRIDataset.coords的排列方式一致）
+
+    Args:
+        H, W: 网格高度和宽度
+        device: 目标设备
+
+    Returns:
+        形状为[H*W, 2]的float32坐标张量，每行为(x, y)
+    """
+    xs = torch.linspace(-1, 1, W, device=device)
+    ys = torch.linspace(-1, 1, H, device=device)
+    grid_y, grid_x = torch.meshgrid(ys, xs, indexing='ij')
+    return torch.stack([grid_x, grid_y], dim=-1).view(-1, 2)
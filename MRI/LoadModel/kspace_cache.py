@@ -0,0 +1,209 @@
+# K空间缓存文件：把MRIDataset样本中确定性的K空间派生量预先计算并保存为可内存映射的.npy文件
+# 主要功能：
+# 1. derive_kspace：由原始图像、掩模和线圈灵敏度图计算K空间派生量（MRIDataset与缓存构建共用）
+# 2. 按数据集文件的SHA1建立缓存目录（<cache_dir>/<sha1>/），manifest.json记录文件大小和修改时间，
+#    打开缓存时只比较大小和修改时间，不必每次重新计算哈希
+# 3. 训练时MRIDataset通过np.load(mmap_mode='r')读取缓存，取样本只是一次切片读取
+# 用法：
+#   python kspace_cache.py --dataset ./data/dataset.hdf5 --cache-dir ./data/kspace_cache
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import h5py
+import torch
+import numpy as np
+from tqdm import tqdm
+
+from repack_dataset import open_mask
+
+
+CACHE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# 缓存的派生量及其dtype（mask按二维保存，读取时再扩展到线圈维度）
+CACHE_FIELDS = {
+    "gt_full_kspace": np.complex64,
+    "gt_loss_kspace": np.complex64,
+    "gt_full_csm_kspace": np.complex64,
+    "gt_loss_csm_kspace": np.complex64,
+    "mask": np.float32,
+}
+
+
+def derive_kspace(org, mask, csm):
+    """计算单个切片的K空间派生量
+
+    Args:
+        org: 原始复数图像 (H, W)
+        mask: 采样掩模 (H, W)，浮点型
+        csm: 线圈灵敏度图 (C, H, W)，complex64
+
+    Returns:
+        dict: gt_full_kspace、gt_loss_kspace、inverse_masked_kspace、
+              gt_full_csm_kspace、gt_loss_csm_kspace和扩展到线圈维度的mask
+    """
+    full_kspace = torch.fft.fft2(org)
+    masked_kspace = full_kspace * mask
+    inverse_masked_kspace = full_kspace * (1 - mask)
+
+    # 线圈图像 = 原始图像 x 线圈灵敏度（广播代替repeat）
+    full_csm_kspace = torch.fft.fft2(org.unsqueeze(0) * csm)
+    coil_mask = mask.unsqueeze(0).expand(csm.shape[0], -1, -1) if mask.ndim == 2 else mask
+    masked_csm_kspace = full_csm_kspace * coil_mask
+
+    return {
+        "gt_full_kspace": full_kspace,
+        "gt_loss_kspace": masked_kspace,
+        "inverse_masked_kspace": inverse_masked_kspace,
+        "gt_full_csm_kspace": full_csm_kspace,
+        "gt_loss_csm_kspace": masked_csm_kspace,
+        "mask": coil_mask,
+    }
+
+
+def file_sha1(path, chunk_size=16 * 1024 * 1024):
+    """流式计算文件的SHA1"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _read_manifest(cache_path):
+    manifest_path = os.path.join(cache_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_cache(dataset_path, cache_dir):
+    """查找与数据集文件对应的缓存目录
+
+    先按文件大小和修改时间匹配manifest；大小一致但修改时间不同时（例如文件被复制过）
+    再计算SHA1确认内容是否相同。
+
+    Args:
+        dataset_path: h5数据集文件路径
+        cache_dir: 缓存根目录
+
+    Returns:
+        缓存目录路径，没有可用缓存时返回None
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+    stamp = _file_stamp(dataset_path)
+    candidates = []
+    for name in sorted(os.listdir(cache_dir)):
+        manifest = _read_manifest(os.path.join(cache_dir, name))
+        if manifest is None or manifest.get("version") != CACHE_VERSION or manifest["size"] != stamp["size"]:
+            continue
+        if manifest["mtime"] == stamp["mtime"]:
+            return os.path.join(cache_dir, name)
+        candidates.append(name)
+    if candidates:
+        sha1 = file_sha1(dataset_path)
+        if sha1 in candidates:
+            return os.path.join(cache_dir, sha1)
+    return None
+
+
+def open_cache(cache_path):
+    """以只读内存映射方式打开缓存
+
+    Returns:
+        dict: 字段名 -> np.memmap，形状为(N, ...)
+    """
+    return {name: np.load(os.path.join(cache_path, name + ".npy"), mmap_mode="r") for name in CACHE_FIELDS}
+
+
+def build_cache(dataset_path, cache_dir, overwrite=False):
+    """为数据集构建K空间缓存
+
+    先写入临时目录，全部切片完成后再重命名，中断的构建不会被当作可用缓存。
+
+    Args:
+        dataset_path: h5数据集文件路径
+        cache_dir: 缓存根目录
+        overwrite: 已有缓存时是否重建
+
+    Returns:
+        缓存目录路径
+    """
+    sha1 = file_sha1(dataset_path)
+    cache_path = os.path.join(cache_dir, sha1)
+    if os.path.exists(cache_path):
+        if not overwrite:
+            print(f"缓存已存在: {cache_path}")
+            return cache_path
+        shutil.rmtree(cache_path)
+
+    tmp_path = cache_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    with h5py.File(dataset_path, "r") as data:
+        org_data, mask_data, csm_data = data["trnOrg"], open_mask(data), data["trnCsm"]
+        N, H, W = org_data.shape
+        C = csm_data.shape[1]
+        shapes = {
+            "gt_full_kspace": (N, H, W),
+            "gt_loss_kspace": (N, H, W),
+            "gt_full_csm_kspace": (N, C, H, W),
+            "gt_loss_csm_kspace": (N, C, H, W),
+            "mask": (N, H, W),
+        }
+        arrays = {name: np.lib.format.open_memmap(os.path.join(tmp_path, name + ".npy"), mode="w+",
+                                                  dtype=dtype, shape=shapes[name])
+                  for name, dtype in CACHE_FIELDS.items()}
+
+        for idx in tqdm(range(N), desc="构建K空间缓存"):
+            org = torch.from_numpy(org_data[idx])
+            mask = torch.from_numpy(mask_data[idx]).float()
+            csm = torch.from_numpy(csm_data[idx]).to(torch.complex64)
+            derived = derive_kspace(org, mask, csm)
+            for name in CACHE_FIELDS:
+                value = mask if name == "mask" else derived[name]
+                arrays[name][idx] = value.numpy()
+        for array in arrays.values():
+            array.flush()
+        del arrays
+
+    manifest = {
+        "version": CACHE_VERSION,
+        "dataset": os.path.abspath(dataset_path),
+        "sha1": sha1,
+        **_file_stamp(dataset_path),
+        "num_samples": N,
+        "fields": {name: np.dtype(dtype).name for name, dtype in CACHE_FIELDS.items()},
+    }
+    with open(os.path.join(tmp_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.rename(tmp_path, cache_path)
+    return cache_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预计算MRIDataset的K空间缓存")
+    parser.add_argument("--dataset", required=True, help="h5数据集文件")
+    parser.add_argument("--cache-dir", required=True, help="缓存根目录（与config.yaml的kspace_cache_dir一致）")
+    parser.add_argument("--overwrite", action="store_true", help="重建已有缓存")
+    args = parser.parse_args()
+
+    cache_path = build_cache(args.dataset, args.cache_dir, overwrite=args.overwrite)
+    size_mb = sum(os.path.getsize(os.path.join(cache_path, name + ".npy")) for name in CACHE_FIELDS) / 2 ** 20
+    print(f"K空间缓存已保存到: {cache_path}（{size_mb:.1f} MB）")
+
+
+if __name__ == "__main__":
+    main()
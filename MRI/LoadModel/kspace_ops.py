@@ -0,0 +1,157 @@
+# K空间运算文件：采样掩模的稀疏索引表示和只在采样位置计算的K空间损失
+# 主要功能：
+# 1. mask_to_index：把稠密的(H, W)采样掩模转换为采样索引
+#    - Cartesian掩模（整行或整列采样）表示为采样线列表
+#    - 其他掩模表示为展平后的采样位置索引和对应的掩模值
+# 2. sampled_kspace_error：只gather采样位置计算误差，误差张量和反向传播的内存与采样率成比例
+# 3. forward_sampled：Cartesian线采样时只计算采样线上的K空间
+#    （沿读出方向FFT，再用限制在采样线上的小型稠密DFT矩阵代替相位编码方向的FFT）
+
+import torch
+
+
+# line_axis的取值：0表示非Cartesian（使用flat索引），-2表示按行采样，-1表示按列采样
+NON_CARTESIAN = 0
+ROW_LINES = -2
+COLUMN_LINES = -1
+
+# 采样线占比不超过该值（4倍及以上加速）时使用部分DFT，否则完整fft2后再gather
+# （benchmark.py partial_dft：2倍加速时部分DFT比fft2慢，4倍起才更快）
+PARTIAL_DFT_MAX_FRACTION = 0.25
+
+
+def partial_dft_matrix(lines, n):
+    """只包含采样线的DFT矩阵 D[l, y] = exp(-2*pi*i * lines[l] * y / n)
+
+    相位在float64下按(lines * y) mod n计算，再转换为complex64，与torch.fft的数值一致。
+
+    Args:
+        lines: 采样线索引 (L,)
+        n: 相位编码方向的长度
+
+    Returns:
+        complex64矩阵 (L, n)
+    """
+    positions = torch.arange(n, dtype=torch.long)
+    phase = (lines.long()[:, None] * positions[None, :]) % n
+    angle = -2.0 * torch.pi * phase.double() / n
+    return torch.polar(torch.ones_like(angle), angle).to(torch.complex64)
+
+
+def mask_to_index(mask):
+    """把二维采样掩模转换为采样索引表示
+
+    Args:
+        mask: 采样掩模 (H, W)
+
+    Returns:
+        dict:
+            - line_axis: 采样线所在的维度（ROW_LINES/COLUMN_LINES），非Cartesian时为NON_CARTESIAN
+            - lines: 采样线的索引（非Cartesian时为空）
+            - flat: 展平后采样位置的索引（Cartesian时为空）
+            - weights: flat对应位置的掩模值（Cartesian时为空）
+            - total_weight: 掩模值之和（与稠密掩模的mask.sum()一致）
+            - dft: 部分DFT矩阵 (L, n)，只在Cartesian且采样线占比不超过PARTIAL_DFT_MAX_FRACTION时非空
+    """
+    mask = torch.as_tensor(mask).float()
+    sampled = mask != 0
+    binary = bool(((mask == 0) | (mask == 1)).all())
+    empty = torch.zeros(0, dtype=torch.long)
+    index = {
+        'line_axis': torch.tensor(NON_CARTESIAN),
+        'lines': empty,
+        'flat': empty,
+        'weights': torch.zeros(0),
+        'total_weight': mask.sum(),
+        'dft': torch.zeros(0, 0, dtype=torch.complex64),
+    }
+    if binary:
+        for line_axis, reduce_dim in ((ROW_LINES, 1), (COLUMN_LINES, 0)):
+            sampled_lines = sampled.any(dim=reduce_dim)
+            full_lines = sampled[sampled_lines] if reduce_dim == 1 else sampled[:, sampled_lines].T
+            if bool(full_lines.all()):
+                lines = sampled_lines.nonzero().flatten()
+                n = mask.shape[line_axis]
+                index.update(line_axis=torch.tensor(line_axis), lines=lines)
+                if lines.numel() <= PARTIAL_DFT_MAX_FRACTION * n:
+                    index['dft'] = partial_dft_matrix(lines, n)
+                return index
+    flat = sampled.flatten().nonzero().flatten()
+    index.update(flat=flat, weights=mask.flatten()[flat])
+    return index
+
+
+def sample_mask_index(batch, i=0):
+    """取批次中第i个样本的采样索引（兼容default_collate和collate_mri_batch的整理结果）"""
+    mask_index = batch['mask_index']
+    if isinstance(mask_index, list):
+        return mask_index[i]
+    return {key: value[i] for key, value in mask_index.items()}
+
+
+def mask_index_to(mask_index, device):
+    """把采样索引的张量移动到指定设备（line_axis留在CPU上，读取时不需要设备同步）"""
+    return {key: value if key == 'line_axis' else value.to(device, non_blocking=True)
+            for key, value in mask_index.items()}
+
+
+def gather_sampled(kspace, mask_index):
+    """从(..., H, W)的K空间中取出采样位置的值
+
+    Returns:
+        Cartesian时为(..., L, W)或(..., H, L)，否则为(..., n)
+    """
+    line_axis = int(mask_index['line_axis'])
+    if line_axis != NON_CARTESIAN:
+        return kspace.index_select(line_axis + kspace.ndim, mask_index['lines'])
+    return kspace.flatten(-2)[..., mask_index['flat']]
+
+
+def forward_sampled(coil_images, mask_index):
+    """计算线圈图像在采样位置上的K空间，等价于gather_sampled(fft2(coil_images), mask_index)
+
+    mask_index带有部分DFT矩阵时（Cartesian线采样），先沿读出方向做一维FFT，
+    再与(L, n)的DFT矩阵相乘得到采样线，不计算未采样的相位编码线；否则完整fft2后再gather。
+
+    Args:
+        coil_images: 线圈图像 (..., H, W)
+        mask_index: mask_to_index的返回值
+
+    Returns:
+        采样位置的K空间（形状同gather_sampled）
+    """
+    dft = mask_index['dft']
+    if dft.numel() == 0:
+        return gather_sampled(torch.fft.fft2(coil_images), mask_index)
+    if int(mask_index['line_axis']) == ROW_LINES:
+        # 按行采样：沿列方向（读出）FFT，再对行做部分DFT
+        return torch.matmul(dft, torch.fft.fft(coil_images, dim=-1))
+    # 按列采样：沿行方向FFT，再对列做部分DFT
+    return torch.matmul(torch.fft.fft(coil_images, dim=-2), dft.T)
+
+
+def sampled_error(pred_sampled, gt_sampled, mask_index, num_coils):
+    """采样位置上的K空间均方误差（输入为gather_sampled/forward_sampled的结果）"""
+    error = (torch.view_as_real(pred_sampled - gt_sampled) ** 2).sum(dim=-1)
+    if int(mask_index['line_axis']) == NON_CARTESIAN:
+        error = error * mask_index['weights']
+    return error.sum() / (num_coils * mask_index['total_weight'] + 1e-6)
+
+
+def sampled_kspace_error(pred_kspace, gt_kspace, mask_index):
+    """只在采样位置计算的K空间均方误差
+
+    与稠密写法 (|pred - gt|^2 * mask).sum() / (mask.sum() + 1e-6) 等价（mask在线圈维度上扩展），
+    但误差张量只包含采样位置。
+
+    Args:
+        pred_kspace: 预测的线圈K空间 (..., H, W)
+        gt_kspace: 真实的线圈K空间 (..., H, W)，可以在采样位置之外含有任意值
+        mask_index: mask_to_index的返回值（张量需与K空间位于同一设备）
+
+    Returns:
+        标量损失
+    """
+    num_coils = pred_kspace[..., 0, 0].numel()
+    return sampled_error(gather_sampled(pred_kspace, mask_index), gather_sampled(gt_kspace, mask_index),
+                         mask_index, num_coils)
@@ -0,0 +1,204 @@
+# 元学习初始化文件：用Reptile在数据集的多个切片上为给定结构学习初始化权重
+# 主要功能：
+# 1. 通用的Reptile外循环（每个任务为一个切片，内循环用Adam做少量步拟合）
+# 2. kspace_csm模式：为config.yaml中的Fullmodel学习初始化，保存为.inr文件，供start.py的meta_init_path使用
+# 3. image模式：为在线训练的模型结构学习初始化（幅值图像监督），供在线训练配置的init_path使用
+# 用法：
+#   python meta_init.py --output meta_init.inr --exclude 1
+#   python meta_init.py --target online --output online_meta_init.pt
+
+import os
+import sys
+import copy
+import json
+import random
+import argparse
+import yaml
+import torch
+import torch.nn.functional as F
+from torch.utils.data import default_collate
+
+from model import build_model, get_model_config
+from dataset import MRIDataset, normalize01
+from train import kspace_csm_loss, get_image_from_prediction
+from serving_format import save_inr, load_inr
+
+
+def reptile(model, tasks, task_loss, load_task=None, outer_steps=1000, inner_steps=16, inner_lr=1e-4,
+            meta_lr=0.1, log_interval=50):
+    """Reptile元学习
+
+    每个外循环步骤随机选取一个任务，从当前初始化出发用Adam做inner_steps步拟合，
+    然后把初始化向拟合后的权重移动meta_lr（线性衰减到0）。
+
+    Args:
+        model: 待学习初始化的模型（原地更新）
+        tasks: 任务列表
+        task_loss: 函数(model, task_data) -> loss
+        load_task: 函数(task) -> task_data，每个外循环步骤调用一次；None表示任务本身即数据
+        outer_steps: 外循环步数
+        inner_steps: 每个任务的内循环步数
+        inner_lr: 内循环学习率
+        meta_lr: 初始元学习率
+        log_interval: 打印间隔
+
+    Returns:
+        model
+    """
+    learner = copy.deepcopy(model)
+    for step in range(outer_steps):
+        task = random.choice(tasks)
+        task_data = load_task(task) if load_task is not None else task
+        learner.load_state_dict(model.state_dict())
+        learner.train()
+        optimizer = torch.optim.Adam(learner.parameters(), lr=inner_lr)
+        for _ in range(inner_steps):
+            loss = task_loss(learner, task_data)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        # 元更新：theta <- theta + eps * (phi - theta)
+        epsilon = meta_lr * (1.0 - step / outer_steps)
+        with torch.no_grad():
+            for meta_param, task_param in zip(model.parameters(), learner.parameters()):
+                if meta_param.requires_grad:
+                    meta_param.add_(task_param - meta_param, alpha=epsilon)
+
+        if (step + 1) % log_interval == 0:
+            print(f"Meta step {step + 1}/{outer_steps}: 任务损失 {loss.item():.4e}, eps {epsilon:.4f}")
+    return model
+
+
+def load_meta_init(model, path):
+    """从.inr文件加载元学习初始化（原地更新模型权重）
+
+    Args:
+        model: 与元学习初始化结构相同的Fullmodel
+        path: meta_init.py生成的.inr文件
+
+    Returns:
+        model
+
+    Raises:
+        ValueError: 模型结构与初始化不一致时抛出
+    """
+    init_model = load_inr(path)
+    if get_model_config(init_model) != get_model_config(model):
+        raise ValueError(f"Meta initialization {path} does not match the model architecture")
+    model.load_state_dict(init_model.state_dict())
+    print(f"从元学习初始化启动: {path}")
+    return model
+
+
+def _slice_batch(dataset):
+    """按索引读取切片并整理为batch_size=1的批次（与DataLoader返回的格式一致）"""
+    def load_task(index):
+        return default_collate([dataset[index]])
+    return load_task
+
+
+def _kspace_csm_task_loss(device, lambda_tv):
+    """kspace_csm监督模式的任务损失"""
+    def task_loss(model, batch):
+        coords = batch['coords'][0].to(device)
+        H, W = batch['gt_img'][0].shape
+        pred_img_complex = get_image_from_prediction(model(coords), H, W)
+        return kspace_csm_loss(pred_img_complex, batch, device, lambda_tv=lambda_tv)
+    return task_loss
+
+
+def _online_model(online_config):
+    """创建在线训练使用的模型结构"""
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from MRI.app.api.online_training import Fullmodel as OnlineFullmodel
+    return OnlineFullmodel(
+        encoding_mode=online_config["encoder"]["encoding_mode"],
+        in_features=online_config["encoder"]["in_features"],
+        out_features=online_config["encoder"]["out_features"],
+        coordinate_scales=online_config["encoder"]["coordinate_scales"],
+        mlp_hidden_features=online_config["mlp"]["mlp_hidden_features"],
+        mlp_hidden_layers=online_config["mlp"]["mlp_hidden_layers"],
+        omega_0=online_config["mlp"]["omega_0"],
+        activation=online_config["mlp"]["activation"],
+    )
+
+
+def _image_tasks(dataset, indices, size=256):
+    """把切片的幅值图像整理为在线训练的图像任务（归一化到[0,1]、缩放到size x size）"""
+    ys = torch.linspace(-1, 1, size)
+    xs = torch.linspace(-1, 1, size)
+    grid_y, grid_x = torch.meshgrid(ys, xs, indexing='ij')
+    coords = torch.stack([grid_x, grid_y], dim=-1).view(-1, 2)
+    tasks = []
+    for index in indices:
+        image = torch.from_numpy(normalize01(abs(dataset.org_data[index]))).float()
+        image = F.interpolate(image[None, None], size=(size, size), mode='bilinear', align_corners=False)[0, 0]
+        tasks.append((coords, image))
+    return tasks
+
+
+def _image_task_loss(device):
+    """图像监督的任务损失（与在线训练的image模式一致）"""
+    def task_loss(model, task):
+        coords, image = task
+        pred = model(coords.to(device)).view(image.shape)
+        return F.mse_loss(pred, image.to(device))
+    return task_loss
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reptile元学习初始化")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--target", choices=["fullmodel", "online"], default="fullmodel",
+                        help="fullmodel: config.yaml中的Fullmodel（kspace_csm监督）；online: 在线训练的模型结构（图像监督）")
+    parser.add_argument("--online-config", default=None, help="在线训练配置（JSON），target为online时使用")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--exclude", type=int, nargs="*", default=[], help="不参与元学习的切片（用于评估）")
+    parser.add_argument("--outer-steps", type=int, default=1000)
+    parser.add_argument("--inner-steps", type=int, default=16)
+    parser.add_argument("--inner-lr", type=float, default=None, help="默认使用配置中的learning_rate")
+    parser.add_argument("--meta-lr", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    dataset = MRIDataset(config["dataset_path"], split='train')
+    indices = [i for i in range(len(dataset)) if i not in set(args.exclude)]
+    print(f"使用 {len(indices)} 个切片进行元学习")
+
+    if args.target == "fullmodel":
+        model = build_model(config).to(device)
+        tasks, load_task = indices, _slice_batch(dataset)
+        task_loss = _kspace_csm_task_loss(device, config["lambda_tv"])
+        inner_lr = args.inner_lr or float(config["learning_rate"])
+    else:
+        online_config = config
+        if args.online_config:
+            with open(args.online_config, "r", encoding='utf-8') as f:
+                online_config = json.load(f)
+        model = _online_model(online_config).to(device)
+        tasks, load_task = _image_tasks(dataset, indices), None
+        task_loss = _image_task_loss(device)
+        inner_lr = args.inner_lr or float(online_config["learning_rate"])
+
+    reptile(model, tasks, task_loss, load_task=load_task, outer_steps=args.outer_steps, inner_steps=args.inner_steps,
+            inner_lr=inner_lr, meta_lr=args.meta_lr)
+
+    metadata = {"meta_init": {"outer_steps": args.outer_steps, "inner_steps": args.inner_steps,
+                              "inner_lr": inner_lr, "meta_lr": args.meta_lr, "exclude": args.exclude}}
+    model = model.cpu()
+    if args.target == "fullmodel":
+        save_inr(model, args.output, metadata=metadata)
+    else:
+        torch.save({'model_state_dict': model.state_dict(), **metadata}, args.output)
+    print(f"元学习初始化已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# 指标文件：批量计算的图像质量指标（PSNR、SSIM、NSE），全部在torch张量上完成
+# 主要功能：
+# 1. 输入为(H, W)或(..., H, W)的张量（也接受NumPy数组），逐图像计算，返回标量或(...)形状的张量，
+#    计算留在输入所在的设备上，不在主机和设备之间来回拷贝
+# 2. SSIM默认使用可分离的高斯窗口（11x11，sigma=1.5，Wang et al. 2004），先沿行、再沿列做两次一维卷积，
+#    五个局部统计量（均值、二阶矩、互相关）一次卷积得到；也支持skimage默认的7x7均匀窗口
+# 3. 训练、基线和在线训练保存的SSIM（image_quality）沿用skimage默认的7x7均匀窗口，与历史的best_ssim可比
+# 4. 与skimage.metrics的数值对照：python benchmark.py skimage
+# 用法：
+#   from metrics import psnr, ssim, nse
+#   values = ssim(pred, gt)        # pred、gt: (B, H, W)，返回(B,)
+
+import torch
+import torch.nn.functional as F
+
+
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+GAUSSIAN_SIGMA = 1.5
+# 高斯窗口的截断（与scipy.ndimage.gaussian_filter的默认值一致，sigma=1.5时窗口为11）
+GAUSSIAN_TRUNCATE = 3.5
+UNIFORM_WIN_SIZE = 7
+
+
+def _prepare(pred, target):
+    """把两组图像转换为同一设备、同一浮点类型的(N, H, W)张量
+
+    Returns:
+        (pred, target, 批次形状)
+    """
+    pred, target = torch.as_tensor(pred), torch.as_tensor(target)
+    if pred.shape != target.shape:
+        raise ValueError(f"Image shapes differ: {tuple(pred.shape)} vs {tuple(target.shape)}")
+    dtype = torch.float64 if torch.float64 in (pred.dtype, target.dtype) else torch.float32
+    lead = target.shape[:-2]
+    pred = pred.to(target.device, dtype).reshape(-1, *target.shape[-2:])
+    target = target.to(dtype).reshape(-1, *target.shape[-2:])
+    return pred, target, lead
+
+
+def psnr(pred, target, data_range=1.0):
+    """峰值信噪比（PSNR）
+
+    Args:
+        pred, target: 形状相同的图像 (..., H, W)
+        data_range: 数据范围（标量，或每张图像一个值）
+
+    Returns:
+        每张图像的PSNR（dB），形状为(...)
+    """
+    pred, target, lead = _prepare(pred, target)
+    mse = ((pred - target) ** 2).mean(dim=(-2, -1))
+    data_range = torch.as_tensor(data_range, dtype=mse.dtype, device=mse.device)
+    return (10.0 * torch.log10(data_range ** 2 / mse)).reshape(lead)
+
+
+def nse(pred, target):
+    """归一化平方误差（NSE）：sum((pred - target)^2) / sum(target^2)
+
+    Returns:
+        每张图像的NSE，形状为(...)
+    """
+    pred, target, lead = _prepare(pred, target)
+    return (((pred - target) ** 2).sum(dim=(-2, -1)) / (target ** 2).sum(dim=(-2, -1))).reshape(lead)
+
+
+def ssim_window(win_size, gaussian=True, sigma=GAUSSIAN_SIGMA, dtype=torch.float32, device=None):
+    """SSIM的一维窗口（归一化为和为1）"""
+    if not gaussian:
+        return torch.full((win_size,), 1.0 / win_size, dtype=dtype, device=device)
+    x = torch.arange(win_size, dtype=dtype, device=device) - (win_size - 1) / 2
+    window = torch.exp(-0.5 * (x / sigma) ** 2)
+    return window / window.sum()
+
+
+def _separable_filter(images, window):
+    """对(N, 1, H, W)做可分离的'valid'滤波（只保留窗口完全落在图像内的位置）"""
+    size = window.numel()
+    images = F.conv2d(images, window.view(1, 1, 1, size))
+    return F.conv2d(images, window.view(1, 1, size, 1))
+
+
+def ssim(pred, target, data_range=None, gaussian=True, win_size=None, sigma=GAUSSIAN_SIGMA,
+         sample_covariance=None):
+    """结构相似性（SSIM）
+
+    与skimage.metrics.structural_similarity一致：只在窗口完全落在图像内的位置计算SSIM图再取平均。
+    gaussian=True对应skimage的gaussian_weights=True, sigma=1.5, use_sample_covariance=False，
+    gaussian=False对应skimage的默认参数（7x7均匀窗口，样本协方差）。
+
+    Args:
+        pred, target: 形状相同的图像 (..., H, W)
+        data_range: 数据范围，None表示按每张target的max - min
+        gaussian: 是否使用高斯窗口
+        win_size: 窗口边长，None表示高斯窗口按sigma和截断计算（11），均匀窗口为7
+        sigma: 高斯窗口的标准差
+        sample_covariance: 是否使用样本协方差（N-1归一化），None表示只有均匀窗口使用
+
+    Returns:
+        每张图像的SSIM，形状为(...)
+    """
+    pred, target, lead = _prepare(pred, target)
+    if win_size is None:
+        win_size = 2 * int(GAUSSIAN_TRUNCATE * sigma + 0.5) + 1 if gaussian else UNIFORM_WIN_SIZE
+    if sample_covariance is None:
+        sample_covariance = not gaussian
+    if data_range is None:
+        data_range = target.amax(dim=(-2, -1)) - target.amin(dim=(-2, -1))
+    data_range = torch.as_tensor(data_range, dtype=target.dtype, device=target.device).reshape(-1, 1, 1)
+
+    # 一次滤波得到 E[x], E[y], E[x^2], E[y^2], E[xy]
+    N, H, W = target.shape
+    window = ssim_window(win_size, gaussian, sigma, dtype=target.dtype, device=target.device)
+    moments = torch.stack((pred, target, pred * pred, target * target, pred * target), dim=1)
+    moments = _separable_filter(moments.reshape(N * 5, 1, H, W), window)
+    ux, uy, uxx, uyy, uxy = moments.reshape(N, 5, *moments.shape[-2:]).unbind(dim=1)
+
+    cov_norm = win_size ** 2 / (win_size ** 2 - 1) if sample_covariance else 1.0
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+    c1 = (SSIM_K1 * data_range) ** 2
+    c2 = (SSIM_K2 * data_range) ** 2
+    ssim_map = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return ssim_map.mean(dim=(-2, -1)).reshape(lead)
+
+
+def image_quality(pred, target, data_range=1.0, gaussian=False):
+    """一次计算PSNR、SSIM和NSE（训练和评估脚本使用的约定：PSNR按data_range，SSIM按target的范围）
+
+    SSIM默认使用7x7均匀窗口（skimage的默认参数），与此前保存的训练指标和最佳SSIM保持可比。
+
+    Args:
+        gaussian: SSIM是否改用高斯窗口
+
+    Returns:
+        dict: psnr、ssim、nse，每个都是形状为(...)的张量
+    """
+    return {
+        "psnr": psnr(pred, target, data_range=data_range),
+        "ssim": ssim(pred, target, gaussian=gaussian),
+        "nse": nse(pred, target),
+    }
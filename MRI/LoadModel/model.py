@@ -3,13 +3,20 @@
 # 1. ReLU激活层：标准的ReLU激活函数层
 # 2. Sine激活层：SIREN中使用的正弦激活函数层
 # 3. 傅里叶特征映射：将低维坐标映射到高维空间
-# 4. 专家MLP：多层感知机网络
-# 5. 完整模型：组合以上组件的最终模型
+# 4. 多分辨率哈希网格编码：可学习的多层哈希表特征（Instant-NGP风格，纯PyTorch实现）
+# 5. 专家MLP：多层感知机网络
+# 6. 完整模型：组合以上组件的最终模型
+# 7. 堆叠模型：B个结构相同的完整模型堆叠为批量模型，一步同时训练B个切片
 
 import math
 import torch
 import numpy as np
 import torch.nn as nn
+from collections import OrderedDict
+
+
+# 编码缓存的默认内存上限（字节）
+DEFAULT_ENCODING_CACHE_BYTES = 256 * 1024 * 1024
 
 
 class ReLUActivationLayer(nn.Module):
@@ -125,8 +132,9 @@ class FourierFeatureMap(nn.Module):
         in_features: 输入特征维度（通常是2，对应x,y坐标）
         out_features: 输出特征维度（必须是偶数）
         coordinate_scales: 坐标缩放因子
+        anneal_bands: 频率退火的频带数（按|B|从低到高分组），0表示不退火
     """
-    def __init__(self, in_features, out_features, coordinate_scales):
+    def __init__(self, in_features, out_features, coordinate_scales, anneal_bands=0):
         super(FourierFeatureMap, self).__init__()
         assert out_features % 2 == 0, "Fourier Features not even number!"
         self.num_freq = out_features // 2
@@ -136,12 +144,75 @@ class FourierFeatureMap(nn.Module):
             torch.tensor(coordinate_scales, dtype=torch.float32).unsqueeze(0),
             requires_grad=False
         )
-        # 随机频率矩阵
-        self.B = torch.normal(0, 3, (in_features, self.num_freq)) * 10
+        # 随机频率矩阵（按默认设备创建，在meta设备上构建时不分配内存）
+        self.B = torch.empty(in_features, self.num_freq).normal_(0, 3) * 10
         self.B = nn.Parameter(self.B, requires_grad=False)
+        # 频率退火：训练进度（0到1），随检查点保存，1表示所有频带完全放开
+        self.anneal_bands = anneal_bands
+        self.register_buffer("anneal_progress", torch.ones(()))
+        # 进度的Python副本和对应的权重，只在进度改变时计算，前向传播不读取缓冲区（避免主机同步）
+        self._refresh_annealing(1.0)
 
-    def forward(self, x):
-        """前向传播
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
+                              missing_keys, unexpected_keys, error_msgs):
+        # 旧检查点没有退火状态，视为已完全放开
+        key = prefix + "anneal_progress"
+        if key not in state_dict:
+            state_dict[key] = torch.ones(())
+        super(FourierFeatureMap, self)._load_from_state_dict(
+            state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs)
+        self._refresh_annealing(float(self.anneal_progress))
+
+    def set_anneal_progress(self, progress):
+        """设置频率退火进度
+        
+        Args:
+            progress: 训练进度，0表示只放开最低频带，1表示放开全部频带
+        """
+        progress = min(max(float(progress), 0.0), 1.0)
+        self.anneal_progress.fill_(progress)
+        self._refresh_annealing(progress)
+
+    def _refresh_annealing(self, progress):
+        """更新进度的Python副本并重新计算各频带的权重"""
+        self._anneal_value = progress
+        self._anneal_weights = self._compute_annealing_weights(progress)
+
+    def annealing_weights(self):
+        """返回当前进度下每个傅里叶特征的权重（set_anneal_progress或加载检查点时计算并缓存）
+
+        Returns:
+            形状为[out_features]的权重；未启用退火或已完全放开时返回None
+        """
+        # 旧版本保存的完整模型没有缓存的进度，从缓冲区读取一次
+        if not hasattr(self, "_anneal_value"):
+            progress = getattr(self, "anneal_progress", None)
+            self._refresh_annealing(1.0 if progress is None else float(progress))
+        return self._anneal_weights
+
+    def _compute_annealing_weights(self, progress):
+        """计算给定进度下每个傅里叶特征的权重（由低频到高频逐步放开）
+        
+        频率按|B|的列范数排序后均分为anneal_bands个频带，第k个频带的权重为
+        (1 - cos(pi * clamp(alpha - k, 0, 1))) / 2，其中alpha = 1 + progress * (anneal_bands - 1)，
+        最低频带始终放开。
+        
+        Returns:
+            形状为[out_features]的权重；未启用退火或已完全放开时返回None
+        """
+        bands = getattr(self, "anneal_bands", 0)
+        if not bands or progress >= 1.0:
+            return None
+        order = torch.argsort(self.B.norm(dim=0))
+        band = torch.empty(self.num_freq, device=self.B.device, dtype=self.B.dtype)
+        band[order] = torch.div(torch.arange(self.num_freq, device=self.B.device) * bands,
+                                self.num_freq, rounding_mode='floor').to(self.B.dtype)
+        alpha = 1.0 + progress * (bands - 1)
+        weights = (1 - torch.cos(math.pi * (alpha - band).clamp(0.0, 1.0))) / 2
+        return torch.cat((weights, weights))
+
+    def encode(self, x):
+        """计算傅里叶特征（不经过缓存）
         
         Args:
             x: 形状为[batch_size, 2]的输入坐标
@@ -159,6 +230,196 @@ class FourierFeatureMap(nn.Module):
         # 拼接特征
         return torch.cat((sin_feat, cos_feat), dim=-1)
 
+    def enable_cache(self, max_bytes=DEFAULT_ENCODING_CACHE_BYTES):
+        """启用编码缓存
+        
+        B和coordinate_scales不参与训练，固定坐标网格的编码结果可以在训练步和多次推理之间复用。
+        缓存以(坐标形状, dtype, 设备, B和coordinate_scales的版本号)为键，命中时再比较坐标内容。
+        
+        Args:
+            max_bytes: 缓存占用的内存上限（字节），超过上限时按LRU淘汰
+        """
+        self.cache_max_bytes = int(max_bytes)
+        self._encoding_cache = OrderedDict()
+        self._encoding_cache_bytes = 0
+
+    def disable_cache(self):
+        """关闭编码缓存并释放缓存的张量"""
+        self._encoding_cache = None
+        self._encoding_cache_bytes = 0
+
+    def clear_cache(self):
+        """清空编码缓存（保持缓存开启）"""
+        if getattr(self, "_encoding_cache", None) is not None:
+            self._encoding_cache.clear()
+            self._encoding_cache_bytes = 0
+
+    def _apply(self, fn, *args, **kwargs):
+        # 设备或精度改变时缓存失效，退火权重随B重新计算
+        self.clear_cache()
+        module = super(FourierFeatureMap, self)._apply(fn, *args, **kwargs)
+        if hasattr(self, "_anneal_value"):
+            self._refresh_annealing(self._anneal_value)
+        return module
+
+    def __getstate__(self):
+        # 保存整个模型时不序列化缓存内容
+        state = self.__dict__.copy()
+        if state.get("_encoding_cache") is not None:
+            state["_encoding_cache"] = OrderedDict()
+            state["_encoding_cache_bytes"] = 0
+        return state
+
+    def forward(self, x):
+        """前向传播
+        
+        Args:
+            x: 形状为[batch_size, 2]的输入坐标
+        
+        Returns:
+            形状为[batch_size, out_features]的傅里叶特征（启用频率退火时乘以各频带的权重）
+        """
+        encoded = self._cached_encode(x)
+        weights = self.annealing_weights()
+        if weights is not None:
+            encoded = encoded * weights
+        return encoded
+
+    def _cached_encode(self, x):
+        """计算傅里叶特征，启用缓存时复用相同坐标的编码结果"""
+        # 兼容未启用缓存的模型以及旧版本保存的完整模型
+        cache = getattr(self, "_encoding_cache", None)
+        if cache is None or x.requires_grad:
+            return self.encode(x)
+
+        key = (tuple(x.shape), x.dtype, x.device, self.B._version, self.coordinate_scales._version)
+        entries = cache.get(key)
+        if entries is not None:
+            for cached_coords, cached_encoded in entries:
+                if cached_coords is x or torch.equal(cached_coords, x):
+                    cache.move_to_end(key)
+                    return cached_encoded
+
+        encoded = self.encode(x)
+        nbytes = encoded.numel() * encoded.element_size() + x.numel() * x.element_size()
+        if nbytes <= self.cache_max_bytes:
+            # 按LRU顺序淘汰，直到新条目能放入缓存
+            while self._encoding_cache_bytes + nbytes > self.cache_max_bytes and cache:
+                _, evicted = cache.popitem(last=False)
+                for cached_coords, cached_encoded in evicted:
+                    self._encoding_cache_bytes -= (cached_encoded.numel() * cached_encoded.element_size()
+                                                   + cached_coords.numel() * cached_coords.element_size())
+            cache.setdefault(key, []).append((x.detach().clone(), encoded))
+            cache.move_to_end(key)
+            self._encoding_cache_bytes += nbytes
+        return encoded
+
+
+class HashGridEncoding(nn.Module):
+    """多分辨率哈希网格编码
+    
+    在L个分辨率层级上各维护一张可学习的特征表。每个坐标在每个层级上对所在网格单元的
+    2^D个顶点特征做多线性插值，各层级的结果拼接后送入小型MLP解码器。
+    粗层级的顶点数不超过表大小时直接索引，细层级使用空间哈希。
+    
+    参数:
+        in_features: 输入坐标维度（通常是2）
+        coordinate_scales: 坐标缩放因子
+        num_levels: 分辨率层级数
+        features_per_level: 每个层级的特征维度
+        log2_table_size: 每个层级哈希表大小的log2
+        base_resolution: 最粗层级的分辨率
+        finest_resolution: 最细层级的分辨率
+    """
+    # 空间哈希使用的大质数（第一维为1以保证相邻单元的缓存局部性）
+    PRIMES = (1, 2654435761, 805459861, 3674653429)
+
+    def __init__(self, in_features, coordinate_scales, num_levels=16, features_per_level=2,
+                 log2_table_size=18, base_resolution=16, finest_resolution=512):
+        super(HashGridEncoding, self).__init__()
+        assert in_features <= len(self.PRIMES), "HashGrid最多支持4维坐标"
+        self.in_features = in_features
+        self.num_levels = num_levels
+        self.features_per_level = features_per_level
+        self.log2_table_size = log2_table_size
+        self.base_resolution = base_resolution
+        self.finest_resolution = finest_resolution
+        self.out_features = num_levels * features_per_level
+        # 坐标缩放参数
+        self.coordinate_scales = nn.Parameter(
+            torch.tensor(coordinate_scales, dtype=torch.float32).unsqueeze(0),
+            requires_grad=False
+        )
+
+        # 各层级分辨率按几何级数增长
+        if num_levels > 1:
+            growth = math.exp((math.log(finest_resolution) - math.log(base_resolution)) / (num_levels - 1))
+        else:
+            growth = 1.0
+        self.resolutions = [int(math.floor(base_resolution * growth ** level)) for level in range(num_levels)]
+        max_table_size = 2 ** log2_table_size
+        self.table_sizes = [min(max_table_size, (res + 1) ** in_features) for res in self.resolutions]
+        self.dense_levels = [(res + 1) ** in_features <= max_table_size for res in self.resolutions]
+
+        # 可学习的特征表，使用很小的均匀分布初始化
+        self.embeddings = nn.ParameterList([
+            nn.Parameter(torch.empty(size, features_per_level).uniform_(-1e-4, 1e-4))
+            for size in self.table_sizes
+        ])
+
+        self.init_buffers()
+
+    def init_buffers(self):
+        """创建不随state_dict保存的缓冲区（网格单元的2^D个顶点偏移）
+
+        在meta设备上构建模型再加载权重时（serving_format.load_inr），由加载方在CPU上重新调用。
+        """
+        offsets = [[(corner >> d) & 1 for d in range(self.in_features)] for corner in range(2 ** self.in_features)]
+        self.register_buffer("corner_offsets", torch.tensor(offsets, dtype=torch.long), persistent=False)
+
+    def _corner_index(self, corners, level):
+        """计算顶点在第level层特征表中的索引"""
+        res = self.resolutions[level]
+        if self.dense_levels[level]:
+            index = torch.zeros_like(corners[..., 0])
+            stride = 1
+            for d in range(self.in_features):
+                index = index + corners[..., d] * stride
+                stride *= res + 1
+            return index
+        index = corners[..., 0] * self.PRIMES[0]
+        for d in range(1, self.in_features):
+            index = torch.bitwise_xor(index, corners[..., d] * self.PRIMES[d])
+        return index % self.table_sizes[level]
+
+    def forward(self, x):
+        """前向传播
+        
+        Args:
+            x: 形状为[batch_size, in_features]的输入坐标，范围[-1, 1]
+        
+        Returns:
+            形状为[batch_size, num_levels * features_per_level]的编码特征
+        """
+        scaled = self.coordinate_scales * x
+        unit = ((scaled + 1) / 2).clamp(0.0, 1.0)
+        offsets = self.corner_offsets
+
+        features = []
+        for level, res in enumerate(self.resolutions):
+            pos = unit * res
+            cell = torch.floor(pos).long().clamp(max=res - 1)
+            frac = pos - cell.to(pos.dtype)
+            # 网格单元各顶点的整数坐标: [batch_size, 2^D, D]
+            corners = cell.unsqueeze(1) + offsets
+            index = self._corner_index(corners, level)
+            # 多线性插值权重: [batch_size, 2^D]
+            frac = frac.unsqueeze(1)
+            weights = torch.where(offsets.bool(), frac, 1 - frac).prod(dim=-1)
+            corner_features = self.embeddings[level][index]
+            features.append((weights.unsqueeze(-1) * corner_features).sum(dim=1))
+        return torch.cat(features, dim=-1)
+
 
 class ExpertMLP(nn.Module):
     """多层感知机网络
@@ -192,38 +453,193 @@ class ExpertMLP(nn.Module):
         return self.mlp(x)
 
 
+class PartitionedExpertMLP(nn.Module):
+    """空间分块的专家MLP（混合专家）
+    
+    图像域按坐标划分为grid[0] x grid[1]个图块，每个图块由一个小型专家MLP负责，
+    每个坐标只经过其所在图块的专家。所有专家的权重堆叠为[E, in, out]的批量张量，
+    前向时按专家对坐标排序并填充为[E, max_count, in]，用baddbmm一次求出所有专家的输出。
+    
+    参数:
+        in_features: 输入特征维度（编码器输出维度）
+        hidden_features: 每个专家的隐藏层特征维度
+        hidden_layers: 每个专家的隐藏层数量
+        out_features: 输出特征维度
+        omega_0: SIREN的频率参数
+        activation: 激活函数类型（'sine'或'relu'）
+        grid: 图块划分[gx, gy]（x方向和y方向的图块数）
+    """
+    def __init__(self, in_features, hidden_features, hidden_layers, out_features, omega_0, activation, grid):
+        super(PartitionedExpertMLP, self).__init__()
+        self.grid = [int(g) for g in grid]
+        self.num_experts = int(np.prod(self.grid))
+        self.in_features = in_features
+        self.hidden_features = hidden_features
+        self.hidden_layers = hidden_layers
+        self.out_features = out_features
+        self.omega_0 = omega_0
+        self.activation = activation.lower()
+        if self.activation not in ("sine", "relu"):
+            raise ValueError("Unsupported activation: " + activation)
+
+        dims = [in_features] + [hidden_features] * (hidden_layers + 1) + [out_features]
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for i, (fan_in, fan_out) in enumerate(zip(dims[:-1], dims[1:])):
+            weight = torch.empty(self.num_experts, fan_in, fan_out)
+            bias = torch.empty(self.num_experts, 1, fan_out)
+            self._init_layer(weight, bias, fan_in, is_first=(i == 0), is_last=(i == len(dims) - 2))
+            self.weights.append(nn.Parameter(weight))
+            self.biases.append(nn.Parameter(bias))
+
+    def _init_layer(self, weight, bias, fan_in, is_first, is_last):
+        """与单一ExpertMLP各层相同的初始化方式（每个专家独立初始化）"""
+        with torch.no_grad():
+            bound = 1 / np.sqrt(fan_in)
+            bias.uniform_(-bound, bound)
+            if is_last:
+                weight.uniform_(-bound, bound)
+            elif self.activation == "relu":
+                nn.init.normal_(weight, std=np.sqrt(2 / fan_in))
+                bias.zero_()
+            elif is_first:
+                weight.uniform_(-1 / fan_in, 1 / fan_in)
+            else:
+                weight.uniform_(-np.sqrt(6 / fan_in), np.sqrt(6 / fan_in))
+
+    def assign_experts(self, coords):
+        """根据坐标所在的图块分配专家
+        
+        Args:
+            coords: 形状为[batch_size, 2]的坐标，范围[-1, 1]
+        
+        Returns:
+            形状为[batch_size]的专家索引
+        """
+        gx, gy = self.grid
+        unit = ((coords[:, :2] + 1) / 2).clamp(0.0, 1.0)
+        ix = (unit[:, 0] * gx).long().clamp(max=gx - 1)
+        iy = (unit[:, 1] * gy).long().clamp(max=gy - 1)
+        return iy * gx + ix
+
+    def _activate(self, h, layer_index):
+        if self.activation == "relu":
+            return torch.relu(h)
+        if layer_index == 0:
+            return torch.sin(self.omega_0 * h)
+        return torch.sin(h)
+
+    def forward(self, x, coords):
+        """前向传播
+        
+        Args:
+            x: 形状为[batch_size, in_features]的编码特征
+            coords: 形状为[batch_size, 2]的原始坐标（用于分配专家）
+        
+        Returns:
+            形状为[batch_size, out_features]的输出
+        """
+        expert = self.assign_experts(coords)
+        order = torch.argsort(expert)
+        sorted_expert = expert[order]
+        counts = torch.bincount(expert, minlength=self.num_experts)
+        # 每个坐标在所属专家批次中的位置
+        starts = torch.cumsum(counts, dim=0) - counts
+        position = torch.arange(x.shape[0], device=x.device) - starts[sorted_expert]
+        max_count = int(counts.max().item()) if x.shape[0] > 0 else 0
+
+        h = x.new_zeros(self.num_experts, max_count, x.shape[1])
+        h[sorted_expert, position] = x[order]
+        num_layers = len(self.weights)
+        for i, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            h = torch.baddbmm(bias, h, weight)
+            if i < num_layers - 1:
+                h = self._activate(h, i)
+
+        out = h.new_empty(x.shape[0], self.out_features)
+        out[order] = h[sorted_expert, position]
+        return out
+
+
 class Fullmodel(nn.Module):
     """完整的MRI重建模型
     
     组合了傅里叶特征映射和MLP网络
     
     参数:
-        encoding_mode: 编码方式（目前只支持"fourier"）
+        encoding_mode: 编码方式（"fourier"或"hashgrid"）
         in_features: 输入特征维度（通常是2）
-        out_features: 傅里叶特征维度
+        out_features: 傅里叶特征维度（hashgrid模式下不使用）
         coordinate_scales: 坐标缩放因子
         mlp_hidden_features: MLP隐藏层的特征数
         mlp_hidden_layers: MLP的隐藏层数量
         omega_0: SIREN的频率参数
         activation: 激活函数类型
+        anneal_bands: 傅里叶特征频率退火的频带数，0表示不退火
+        experts: 空间分块专家的图块划分[gx, gy]，None表示使用单一的ExpertMLP
+        hash_levels: hashgrid的分辨率层级数
+        hash_features_per_level: hashgrid每个层级的特征维度
+        hash_log2_table_size: hashgrid每个层级哈希表大小的log2
+        hash_base_resolution: hashgrid最粗层级的分辨率
+        hash_finest_resolution: hashgrid最细层级的分辨率
     """
     def __init__(self,
                  encoding_mode,
                  in_features, out_features, coordinate_scales,
                  mlp_hidden_features, mlp_hidden_layers,
-                 omega_0, activation):
+                 omega_0, activation,
+                 anneal_bands=0, experts=None,
+                 hash_levels=16, hash_features_per_level=2, hash_log2_table_size=18,
+                 hash_base_resolution=16, hash_finest_resolution=512):
         super(Fullmodel, self).__init__()
         self.encoding_mode = encoding_mode.lower()
         # 创建编码器
         if self.encoding_mode == "fourier":
             self.encoder = FourierFeatureMap(
-                in_features, out_features, coordinate_scales)
+                in_features, out_features, coordinate_scales, anneal_bands=anneal_bands)
             encoder_output_dim = out_features
+        elif self.encoding_mode == "hashgrid":
+            self.encoder = HashGridEncoding(
+                in_features, coordinate_scales,
+                num_levels=hash_levels,
+                features_per_level=hash_features_per_level,
+                log2_table_size=hash_log2_table_size,
+                base_resolution=hash_base_resolution,
+                finest_resolution=hash_finest_resolution)
+            encoder_output_dim = self.encoder.out_features
         else:
             raise ValueError("Unsupported encoding_mode: " + encoding_mode)
-        # 创建MLP网络
-        self.net = ExpertMLP(encoder_output_dim, mlp_hidden_features, 
-                            mlp_hidden_layers, 2, omega_0, activation)
+        # 创建MLP网络：单一MLP，或按图块划分的专家MLP
+        if experts:
+            self.net = PartitionedExpertMLP(encoder_output_dim, mlp_hidden_features,
+                                            mlp_hidden_layers, 2, omega_0, activation, experts)
+        else:
+            self.net = ExpertMLP(encoder_output_dim, mlp_hidden_features, 
+                                mlp_hidden_layers, 2, omega_0, activation)
+
+    def enable_encoding_cache(self, max_bytes=DEFAULT_ENCODING_CACHE_BYTES):
+        """启用坐标编码缓存（固定坐标网格的编码只计算一次）
+        
+        Args:
+            max_bytes: 缓存占用的内存上限（字节）
+        """
+        if hasattr(self.encoder, "enable_cache"):
+            self.encoder.enable_cache(max_bytes)
+
+    def disable_encoding_cache(self):
+        """关闭坐标编码缓存"""
+        if hasattr(self.encoder, "disable_cache"):
+            self.encoder.disable_cache()
+
+    def clear_encoding_cache(self):
+        """显式使编码缓存失效（例如修改了B或coordinate_scales之后）"""
+        if hasattr(self.encoder, "clear_cache"):
+            self.encoder.clear_cache()
+
+    def set_anneal_progress(self, progress):
+        """设置傅里叶特征的频率退火进度（0到1），未启用退火时无效果"""
+        if hasattr(self.encoder, "set_anneal_progress"):
+            self.encoder.set_anneal_progress(progress)
 
     def forward(self, x):
         """前向传播
@@ -236,7 +652,241 @@ class Fullmodel(nn.Module):
         """
         # 编码输入坐标
         encoded = self.encoder(x)
-        # 通过MLP网络处理
+        # 通过MLP网络处理（分块专家需要原始坐标来分配专家）
+        if isinstance(self.net, PartitionedExpertMLP):
+            return self.net(encoded, x)
         out = self.net(encoded)
         return out
 
+
+class StackedFullmodel(nn.Module):
+    """B个结构相同的Fullmodel堆叠而成的批量模型（多切片训练，每个切片一个独立网络）
+    
+    所有网络共享同一个傅里叶编码器（B和coordinate_scales不参与训练，编码只计算一次），
+    因此各模型的编码器参数必须完全相同（例如用share_encoder从第一个模型复制），否则抛出ValueError；
+    MLP各层权重堆叠为[B, in, out]、偏置为[B, 1, out]：第一层是编码特征与批量权重的广播矩阵乘，
+    其余各层使用baddbmm。Adam是逐元素的，因此与分别训练B个模型等价。
+    
+    不是Fullmodel的子类（没有net属性），get_model_config、fold_model、InferenceEngine、
+    serving_format等只接受单个Fullmodel，需要先用unstack()拆分。
+    
+    参数:
+        models: 结构相同的Fullmodel列表（fourier编码、单一ExpertMLP）
+    """
+    def __init__(self, models):
+        super(StackedFullmodel, self).__init__()
+        if not models:
+            raise ValueError("StackedFullmodel requires at least one model")
+        config = get_model_config(models[0])
+        if config["encoder"]["encoding_mode"] != "fourier" or isinstance(models[0].net, PartitionedExpertMLP):
+            raise ValueError("StackedFullmodel only supports fourier encoding with a single ExpertMLP")
+        if any(get_model_config(model) != config for model in models[1:]):
+            raise ValueError("StackedFullmodel requires models with identical architecture")
+        encoder_state = models[0].encoder.state_dict()
+        for index, model in enumerate(models[1:], start=1):
+            if any(not torch.equal(value, encoder_state[key]) for key, value in model.encoder.state_dict().items()):
+                raise ValueError(f"StackedFullmodel requires identical encoders; model {index} has a different "
+                                 "Fourier matrix B (use share_encoder() before stacking freshly built models)")
+
+        self.config = config
+        self.encoding_mode = "fourier"
+        self.num_models = len(models)
+        self.encoder = models[0].encoder
+        self.activation = config["mlp"]["activation"]
+        self.omega_0 = config["mlp"]["omega_0"]
+        layers = [[_linear(module) for module in model.net.mlp] for model in models]
+        self.weights = nn.ParameterList(
+            nn.Parameter(torch.stack([linears[i].weight.detach().t() for linears in layers]).contiguous())
+            for i in range(len(layers[0])))
+        self.biases = nn.ParameterList(
+            nn.Parameter(torch.stack([linears[i].bias.detach() for linears in layers]).unsqueeze(1))
+            for i in range(len(layers[0])))
+
+    def enable_encoding_cache(self, max_bytes=DEFAULT_ENCODING_CACHE_BYTES):
+        """启用共享编码器的坐标编码缓存"""
+        self.encoder.enable_cache(max_bytes)
+
+    def disable_encoding_cache(self):
+        """关闭坐标编码缓存"""
+        self.encoder.disable_cache()
+
+    def clear_encoding_cache(self):
+        """显式使编码缓存失效"""
+        self.encoder.clear_cache()
+
+    def set_anneal_progress(self, progress):
+        """设置共享编码器的频率退火进度（0到1）"""
+        self.encoder.set_anneal_progress(progress)
+
+    def _activate(self, h, layer_index):
+        if self.activation == "relu":
+            return torch.relu(h)
+        if layer_index == 0:
+            return torch.sin(self.omega_0 * h)
+        return torch.sin(h)
+
+    def forward(self, x):
+        """前向传播
+        
+        Args:
+            x: 形状为[num_points, 2]的共享坐标网格
+        
+        Returns:
+            形状为[num_models, num_points, 2]的输出（每个网络一份）
+        """
+        encoded = self.encoder(x)
+        num_layers = len(self.weights)
+        h = torch.matmul(encoded, self.weights[0]) + self.biases[0]
+        for i in range(num_layers):
+            if i > 0:
+                h = torch.baddbmm(self.biases[i], h, self.weights[i])
+            if i < num_layers - 1:
+                h = self._activate(h, i)
+        return h
+
+    def unstack(self):
+        """拆分为B个独立的Fullmodel（位于CPU，评估模式）"""
+        models = []
+        for index in range(self.num_models):
+            model = build_model(self.config)
+            model.encoder.load_state_dict(self.encoder.state_dict())
+            with torch.no_grad():
+                for i, linear in enumerate(_linear(module) for module in model.net.mlp):
+                    linear.weight.copy_(self.weights[i][index].t())
+                    linear.bias.copy_(self.biases[i][index, 0])
+            models.append(model.eval())
+        return models
+
+
+def share_encoder(models):
+    """把第一个模型的编码器参数复制到其余模型（新建的模型各自随机生成B，堆叠训练前需要统一）
+
+    Returns:
+        models
+    """
+    encoder_state = models[0].encoder.state_dict()
+    for model in models[1:]:
+        model.encoder.load_state_dict(encoder_state)
+    return models
+
+
+def _linear(module):
+    """ExpertMLP中的层对应的nn.Linear"""
+    return module if isinstance(module, nn.Linear) else module.linear
+
+
+# hashgrid编码的可选配置项（config.yaml中encoder部分）
+HASHGRID_CONFIG_KEYS = (
+    "hash_levels", "hash_features_per_level", "hash_log2_table_size",
+    "hash_base_resolution", "hash_finest_resolution",
+)
+# hashgrid_defaults中代替mlp部分的解码器配置项
+HASHGRID_DECODER_KEYS = ("mlp_hidden_features", "mlp_hidden_layers", "omega_0", "activation")
+
+
+def apply_hashgrid_defaults(config):
+    """hashgrid编码时用config.yaml的hashgrid_defaults部分代替mlp中的解码器配置和学习率
+
+    特征表承担了大部分表示能力，hashgrid搭配小型解码器；fourier编码的配置不受影响。
+
+    Args:
+        config: 与config.yaml结构相同的字典
+
+    Returns:
+        新的配置字典（不是hashgrid编码或没有hashgrid_defaults时原样返回）
+    """
+    defaults = config.get("hashgrid_defaults")
+    if config["encoder"]["encoding_mode"] != "hashgrid" or not defaults:
+        return config
+    config = dict(config)
+    config["mlp"] = {**config["mlp"], **{key: defaults[key] for key in HASHGRID_DECODER_KEYS if key in defaults}}
+    if "learning_rate" in defaults:
+        config["learning_rate"] = defaults["learning_rate"]
+    return config
+
+
+def build_model(config):
+    """根据配置创建Fullmodel
+    
+    Args:
+        config: 与config.yaml结构相同的字典，至少包含encoder和mlp两部分
+    
+    Returns:
+        Fullmodel实例
+    """
+    config = apply_hashgrid_defaults(config)
+    encoder_config = config["encoder"]
+    mlp_config = config["mlp"]
+    in_features = encoder_config.get("in_features", 2)
+    extra = {key: encoder_config[key] for key in HASHGRID_CONFIG_KEYS if key in encoder_config}
+    # 频率退火：config.yaml的frequency_annealing部分，或get_model_config还原的encoder.anneal_bands
+    annealing = config.get("frequency_annealing") or {}
+    if annealing.get("enabled"):
+        extra["anneal_bands"] = annealing.get("num_bands", 8)
+    elif "anneal_bands" in encoder_config:
+        extra["anneal_bands"] = encoder_config["anneal_bands"]
+    if mlp_config.get("experts"):
+        extra["experts"] = mlp_config["experts"]
+    return Fullmodel(
+        encoding_mode=encoder_config["encoding_mode"],
+        in_features=in_features,
+        out_features=encoder_config.get("out_features", 256),
+        coordinate_scales=encoder_config.get("coordinate_scales", [1.0] * in_features),
+        mlp_hidden_features=mlp_config["mlp_hidden_features"],
+        mlp_hidden_layers=mlp_config["mlp_hidden_layers"],
+        omega_0=mlp_config["omega_0"],
+        activation=mlp_config["activation"],
+        **extra
+    )
+
+
+def get_model_config(model):
+    """从Fullmodel实例还原build_model所需的配置
+    
+    Args:
+        model: Fullmodel实例
+    
+    Returns:
+        与config.yaml结构相同的字典（encoder和mlp两部分），可直接传给build_model
+    """
+    if isinstance(model, StackedFullmodel):
+        raise TypeError("StackedFullmodel has no single config; call unstack() first")
+    encoder = model.encoder
+    encoder_config = {
+        "encoding_mode": getattr(model, "encoding_mode", "fourier"),
+        "coordinate_scales": encoder.coordinate_scales.detach().cpu().view(-1).tolist(),
+    }
+    if isinstance(encoder, HashGridEncoding):
+        encoder_config.update({
+            "in_features": encoder.in_features,
+            "hash_levels": encoder.num_levels,
+            "hash_features_per_level": encoder.features_per_level,
+            "hash_log2_table_size": encoder.log2_table_size,
+            "hash_base_resolution": encoder.base_resolution,
+            "hash_finest_resolution": encoder.finest_resolution,
+        })
+    else:
+        encoder_config.update({
+            "in_features": encoder.B.shape[0],
+            "out_features": encoder.out_features,
+        })
+        if getattr(encoder, "anneal_bands", 0):
+            encoder_config["anneal_bands"] = encoder.anneal_bands
+    if isinstance(model.net, PartitionedExpertMLP):
+        net = model.net
+        mlp_config = {
+            "mlp_hidden_features": net.hidden_features,
+            "mlp_hidden_layers": net.hidden_layers,
+            "omega_0": net.omega_0,
+            "activation": net.activation,
+            "experts": list(net.grid),
+        }
+    else:
+        first_layer = model.net.mlp[0]
+        mlp_config = {
+            "mlp_hidden_features": first_layer.linear.out_features,
+            "mlp_hidden_layers": len(model.net.mlp) - 2,
+            "omega_0": getattr(first_layer, "omega_0", 30),
+            "activation": "sine" if isinstance(first_layer, SineActivationLayer) else "relu",
+        }
+    return {"encoder": encoder_config, "mlp": mlp_config}
@@ -0,0 +1,259 @@
+# 剪枝文件：对训练好的SIREN模型做结构化剪枝，得到更小的稠密Fullmodel
+# 主要功能：
+# 1. 按隐藏单元的重要性（平均激活幅值 x 输出权重范数）逐层删除神经元
+# 2. 每剪一层后以原模型的输出为目标做短暂微调
+# 3. 对多个宽度生成FLOPs/延迟与PSNR/SSIM的权衡报告，产物保存为.inr并登记到info.json的variants中
+# 用法：
+#   python prune.py --checkpoint ../app/models/model1/best_model1.pt --model-dir ../app/models/model1 --widths 192 128 64
+#   python prune.py ... --promote 128    # 同时把宽度128的剪枝模型设为ModelService的默认变体
+
+import os
+import copy
+import json
+import yaml
+import argparse
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model import ExpertMLP, PartitionedExpertMLP, build_model, get_model_config
+from dataset import MRIDataset
+from serving_format import load_trained_model, save_inr
+from quantize import register_variant
+from train import normalize02
+from metrics import psnr, ssim
+from inference import InferenceEngine, evaluate_tiled, make_coordinate_grid, measure_latency
+
+
+def _mlp_linears(model):
+    """返回ExpertMLP中按顺序排列的线性层（最后一个是输出层）"""
+    if not isinstance(getattr(model, "net", None), ExpertMLP):
+        raise ValueError("Expected a model with a single ExpertMLP, got "
+                         + type(getattr(model, "net", model)).__name__)
+    return [module if isinstance(module, nn.Linear) else module.linear for module in model.net.mlp]
+
+
+def _layer_shapes(model):
+    """返回每个坐标点经过的各层的(输入维度, 输出维度)
+
+    空间分块专家（PartitionedExpertMLP）中每个坐标只经过一个专家，按单个专家的层计算。
+    """
+    if isinstance(getattr(model, "net", None), PartitionedExpertMLP):
+        return [(weight.shape[1], weight.shape[2]) for weight in model.net.weights]
+    return [(linear.in_features, linear.out_features) for linear in _mlp_linears(model)]
+
+
+def flops_per_point(model):
+    """每个坐标点的浮点运算量（乘加按2次计算，包含傅里叶投影）"""
+    flops = sum(2 * fan_in * fan_out for fan_in, fan_out in _layer_shapes(model))
+    encoder = model.encoder
+    if hasattr(encoder, "B"):
+        flops += 2 * encoder.B.shape[0] * encoder.B.shape[1]
+    return flops
+
+
+def hidden_unit_importance(model, coords, layer_index):
+    """计算第layer_index个隐藏层各输出单元的重要性
+
+    重要性 = 单元激活的平均绝对值 x 下一层对应输入列的L2范数
+
+    Args:
+        model: Fullmodel
+        coords: 用于统计激活的坐标
+        layer_index: 隐藏层在net.mlp中的位置
+
+    Returns:
+        形状为[hidden_features]的重要性分数
+    """
+    with torch.no_grad():
+        h = model.encoder(coords)
+        for module in model.net.mlp[:layer_index + 1]:
+            h = module(h)
+        activation = h.abs().mean(dim=0)
+        next_weight = _mlp_linears(model)[layer_index + 1].weight
+        return activation * next_weight.norm(dim=0)
+
+
+def _slice_linear(linear, rows=None, cols=None):
+    """按行（输出单元）和列（输入单元）截取线性层，返回新的nn.Linear"""
+    weight = linear.weight.detach()
+    bias = linear.bias.detach()
+    if rows is not None:
+        weight, bias = weight[rows], bias[rows]
+    if cols is not None:
+        weight = weight[:, cols]
+    sliced = nn.Linear(weight.shape[1], weight.shape[0]).to(weight.device)
+    with torch.no_grad():
+        sliced.weight.copy_(weight)
+        sliced.bias.copy_(bias)
+    return sliced
+
+
+def prune_layer(model, layer_index, keep):
+    """删除第layer_index个隐藏层中重要性最低的单元（原地修改）
+
+    Args:
+        model: Fullmodel
+        layer_index: 隐藏层在net.mlp中的位置
+        keep: 按原顺序保留的单元索引
+    """
+    mlp = model.net.mlp
+    current = mlp[layer_index]
+    current.linear = _slice_linear(current.linear, rows=keep)
+    following = mlp[layer_index + 1]
+    if isinstance(following, nn.Linear):
+        mlp[layer_index + 1] = _slice_linear(following, cols=keep)
+    else:
+        following.linear = _slice_linear(following.linear, cols=keep)
+
+
+def finetune(student, teacher_output, coords, steps, learning_rate=1e-5, batch_size=16384):
+    """以教师模型的输出为目标微调剪枝后的模型
+
+    Args:
+        student: 剪枝后的模型
+        teacher_output: 教师模型在coords上的输出
+        coords: 坐标
+        steps: 微调步数
+        learning_rate: 学习率
+        batch_size: 每步随机采样的坐标数
+    """
+    student.train()
+    optimizer = torch.optim.Adam(student.parameters(), lr=learning_rate)
+    for _ in range(steps):
+        index = torch.randint(0, coords.shape[0], (min(batch_size, coords.shape[0]),), device=coords.device)
+        loss = F.mse_loss(student(coords[index]), teacher_output[index])
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    student.eval()
+
+
+def prune_to_width(model, teacher_output, coords, width, finetune_steps, learning_rate):
+    """逐层把所有隐藏层剪到相同宽度，每剪一层微调一次
+
+    Args:
+        model: 待剪枝的Fullmodel（原地修改）
+        teacher_output: 原模型在coords上的输出
+        coords: 坐标
+        width: 目标宽度
+        finetune_steps: 每层剪枝后的微调步数
+        learning_rate: 微调学习率
+
+    Returns:
+        与目标宽度对应配置一致的稠密Fullmodel
+    """
+    # 只支持单个ExpertMLP，分区专家（experts）的各个子网络宽度不能按一层统一剪枝
+    if not isinstance(getattr(model, "net", None), ExpertMLP):
+        raise ValueError("Pruning only supports models with a single ExpertMLP, got "
+                         + type(getattr(model, "net", model)).__name__)
+    current_width = get_model_config(model)["mlp"]["mlp_hidden_features"]
+    if not 0 < width < current_width:
+        raise ValueError(f"Pruned width must be in (0, {current_width}), got {width}")
+    num_hidden = len(model.net.mlp) - 1
+    for layer_index in range(num_hidden):
+        importance = hidden_unit_importance(model, coords, layer_index)
+        if importance.numel() > width:
+            keep = torch.sort(torch.topk(importance, width).indices).values
+            prune_layer(model, layer_index, keep)
+            finetune(model, teacher_output, coords, finetune_steps, learning_rate)
+
+    # 所有隐藏层宽度一致后，重建为标准Fullmodel（配置中的mlp_hidden_features为新宽度）
+    config = get_model_config(model)
+    config["mlp"]["mlp_hidden_features"] = width
+    pruned = build_model(config).to(coords.device)
+    pruned.load_state_dict(model.state_dict())
+    return pruned.eval()
+
+
+def tradeoff_report(teacher, student, coords, H, W, gt_img=None, repeats=10):
+    """剪枝模型相对原模型的FLOPs/延迟与PSNR/SSIM报告"""
+    teacher_engine = InferenceEngine(teacher, backend="jit")
+    student_engine = InferenceEngine(student, backend="jit")
+    reference = normalize02(_magnitude(teacher_engine(coords)).view(H, W))
+    candidate = normalize02(_magnitude(student_engine(coords)).view(H, W))
+    report = {
+        "mlp_hidden_features": student.net.mlp[0].linear.out_features,
+        "mflops_per_image": flops_per_point(student) * coords.shape[0] / 1e6,
+        "flops_ratio": flops_per_point(student) / flops_per_point(teacher),
+        "latency_ms": measure_latency(student_engine, coords, repeats=repeats),
+        "latency_original_ms": measure_latency(teacher_engine, coords, repeats=repeats),
+        "psnr_vs_original": float(psnr(candidate, reference)),
+        "ssim_vs_original": float(ssim(candidate, reference)),
+    }
+    if gt_img is not None:
+        gt = normalize02(torch.abs(gt_img))
+        report["psnr_vs_gt"] = float(psnr(candidate, gt))
+        report["ssim_vs_gt"] = float(ssim(candidate, gt))
+    return report
+
+
+def _magnitude(pred_flat):
+    return torch.sqrt(pred_flat[:, 0] ** 2 + pred_flat[:, 1] ** 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SIREN模型结构化剪枝")
+    parser.add_argument("--checkpoint", required=True, help="训练好的模型文件（.pt或.inr）")
+    parser.add_argument("--model-dir", required=True, help="保存剪枝产物的模型目录（ModelService的models/<id>）")
+    parser.add_argument("--config", default="config.yaml", help="训练配置，检查点只含state_dict时用于构建模型")
+    parser.add_argument("--widths", type=int, nargs="+", required=True, help="目标隐藏层宽度（从大到小逐级剪枝）")
+    parser.add_argument("--finetune-steps", type=int, default=200)
+    parser.add_argument("--learning-rate", type=float, default=1e-5)
+    parser.add_argument("--index", type=int, default=1, help="参考切片索引（与start.py训练使用的切片一致）")
+    parser.add_argument("--size", type=int, default=256, help="没有数据集时使用的网格边长")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--promote", type=int, default=None, help="设为ModelService默认变体的宽度")
+    args = parser.parse_args()
+    if args.promote is not None and args.promote not in args.widths:
+        parser.error(f"--promote {args.promote} must be one of --widths {args.widths}")
+
+    config = None
+    if os.path.exists(args.config):
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    teacher = load_trained_model(args.checkpoint, config).to(device)
+    teacher_width = get_model_config(teacher)["mlp"]["mlp_hidden_features"]
+    if len(set(args.widths)) != len(args.widths) or not all(0 < width < teacher_width for width in args.widths):
+        parser.error(f"--widths must be distinct and smaller than the model's hidden width {teacher_width}, "
+                     f"got {args.widths}")
+
+    # 参考切片：优先使用训练数据集中的切片，数据集不可用时只报告相对原模型的指标
+    gt_img = None
+    if config is not None and os.path.exists(config["dataset_path"]):
+        sample = MRIDataset(config["dataset_path"], split='train')[args.index]
+        coords, gt_img = sample["coords"].to(device), sample["gt_img"]
+        H, W = gt_img.shape
+    else:
+        H = W = args.size
+        coords = make_coordinate_grid(H, W, device=device)
+    teacher_output = evaluate_tiled(teacher, coords)
+
+    os.makedirs(args.model_dir, exist_ok=True)
+    student = copy.deepcopy(teacher)
+    for width in sorted(args.widths, reverse=True):
+        # 逐级剪枝：每个宽度从上一级的剪枝结果继续
+        student = prune_to_width(student, teacher_output, coords, width, args.finetune_steps, args.learning_rate)
+        report = tradeoff_report(teacher, student, coords, H, W, gt_img=gt_img, repeats=args.repeats)
+        print(json.dumps(report, ensure_ascii=False))
+
+        variant = f"pruned_w{width}"
+        filename = f"model_{variant}.inr"
+        save_inr(student.cpu(), os.path.join(args.model_dir, filename), metadata={"prune_report": report})
+        student = student.to(device)
+        register_variant(args.model_dir, variant, filename, report, fmt="inr", config=get_model_config(student))
+        print(f"宽度 {width} 的剪枝模型已保存为变体 {variant}")
+
+    if args.promote is not None:
+        info_path = os.path.join(args.model_dir, "info.json")
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        info.setdefault("inference", {})["variant"] = f"pruned_w{args.promote}"
+        with open(info_path, "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=4)
+        print(f"ModelService默认变体已设为 pruned_w{args.promote}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# 量化文件：对训练好的Fullmodel做训练后int8量化
+# 主要功能：
+# 1. 折叠模型后对隐藏层nn.Linear做动态int8量化（傅里叶编码层和omega_0层保持fp32）
+# 2. 保存为TorchScript产物，并登记到模型目录info.json的variants中，供ModelService选择
+# 3. 在参考切片上生成相对fp32模型的PSNR/SSIM回归报告和CPU延迟测试
+# 用法：
+#   python quantize.py --checkpoint ../app/models/model1/best_model1.pt --model-dir ../app/models/model1
+
+import os
+import json
+import yaml
+import argparse
+import torch
+
+from dataset import MRIDataset
+from serving_format import load_trained_model
+from train import normalize02
+from metrics import psnr, ssim
+from inference import (FP32_LEADING_LAYERS, InferenceEngine, fold_model, evaluate_tiled,
+                       make_coordinate_grid, measure_latency)
+
+
+INT8_VARIANT = "int8"
+INT8_FILENAME = "model_int8.pt"
+
+
+def quantize_model(model):
+    """对模型做动态int8量化
+
+    先折叠为FoldedSiren，再只对前FP32_LEADING_LAYERS层之后的线性层做量化：
+    编码层和omega_0层的预激活值很大，量化误差会被sin放大，保持fp32。
+
+    Args:
+        model: 训练好的Fullmodel
+
+    Returns:
+        量化后的FoldedSiren
+    """
+    folded = fold_model(model)
+    quantized_names = {f"layers.{i}" for i in range(FP32_LEADING_LAYERS, len(folded.layers))}
+    return torch.ao.quantization.quantize_dynamic(folded, quantized_names, dtype=torch.qint8)
+
+
+def export_torchscript(module, save_path, in_features):
+    """将模块trace为TorchScript并保存
+
+    Args:
+        module: 待导出的模块
+        save_path: 保存路径
+        in_features: 输入坐标维度
+
+    Returns:
+        冻结后的TorchScript模块
+    """
+    example = torch.zeros(16, in_features)
+    with torch.no_grad():
+        traced = torch.jit.trace(module.eval(), example)
+    frozen = torch.jit.freeze(traced.eval())
+    torch.jit.save(frozen, save_path)
+    return frozen
+
+
+def _magnitude_image(pred_flat, H, W):
+    """将[N, 2]的预测结果转换为归一化幅值图像（numpy）"""
+    magnitude = torch.sqrt(pred_flat[:, 0] ** 2 + pred_flat[:, 1] ** 2)
+    return normalize02(magnitude.view(H, W))
+
+
+def regression_report(reference_fn, candidate_fn, coords, H, W, gt_img=None, repeats=10):
+    """生成量化模型相对fp32模型的回归报告
+
+    Args:
+        reference_fn: fp32推理函数
+        candidate_fn: 量化模型推理函数
+        coords: 参考切片的坐标网格
+        H, W: 图像尺寸
+        gt_img: 参考切片的原始图像（可选，提供时同时报告相对真值的指标）
+        repeats: 延迟测试的重复次数
+
+    Returns:
+        dict: 指标字典
+    """
+    with torch.no_grad():
+        reference = _magnitude_image(evaluate_tiled(reference_fn, coords), H, W)
+        candidate = _magnitude_image(evaluate_tiled(candidate_fn, coords), H, W)
+
+    report = {
+        "psnr_vs_fp32": float(psnr(candidate, reference)),
+        "ssim_vs_fp32": float(ssim(candidate, reference)),
+        "latency_fp32_ms": measure_latency(reference_fn, coords, repeats=repeats),
+        "latency_int8_ms": measure_latency(candidate_fn, coords, repeats=repeats),
+    }
+    if gt_img is not None:
+        gt = normalize02(torch.abs(gt_img))
+        report["psnr_fp32_vs_gt"] = float(psnr(reference, gt))
+        report["psnr_int8_vs_gt"] = float(psnr(candidate, gt))
+        report["ssim_fp32_vs_gt"] = float(ssim(reference, gt))
+        report["ssim_int8_vs_gt"] = float(ssim(candidate, gt))
+    return report
+
+
+def register_variant(model_dir, variant, filename, report, fmt="torchscript", **extra):
+    """将模型变体登记到模型目录的info.json中
+
+    Args:
+        model_dir: 模型目录
+        variant: 变体名称
+        filename: 产物文件名（相对于模型目录）
+        report: 回归报告
+        fmt: 产物格式（"torchscript"或"inr"）
+        extra: 额外写入变体条目的字段（例如模型配置）
+    """
+    info_path = os.path.join(model_dir, "info.json")
+    info = {}
+    if os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    info.setdefault("variants", {})[variant] = {
+        "model_filename": filename,
+        "format": fmt,
+        "report": report,
+        **extra,
+    }
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fullmodel训练后int8量化")
+    parser.add_argument("--checkpoint", required=True, help="fp32模型文件")
+    parser.add_argument("--model-dir", required=True, help="保存量化产物的模型目录（ModelService的models/<id>）")
+    parser.add_argument("--config", default="config.yaml", help="训练配置，检查点只含state_dict时用于构建模型")
+    parser.add_argument("--index", type=int, default=1, help="参考切片索引（与start.py训练使用的切片一致）")
+    parser.add_argument("--size", type=int, default=256, help="没有数据集时报告使用的网格边长")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    config = None
+    if os.path.exists(args.config):
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+
+    model = load_trained_model(args.checkpoint, config)
+    quantized = quantize_model(model)
+
+    os.makedirs(args.model_dir, exist_ok=True)
+    save_path = os.path.join(args.model_dir, INT8_FILENAME)
+    in_features = quantized.encoder.in_features if quantized.encoder is not None else quantized.layers[0].in_features
+    scripted = export_torchscript(quantized, save_path, in_features)
+    print(f"int8模型已保存到: {save_path}")
+
+    # 参考切片：优先使用训练数据集中的切片，数据集不可用时只报告相对fp32的指标
+    gt_img = None
+    if config is not None and os.path.exists(config["dataset_path"]):
+        sample = MRIDataset(config["dataset_path"], split='train')[args.index]
+        coords, gt_img = sample["coords"], sample["gt_img"]
+        H, W = gt_img.shape
+    else:
+        H = W = args.size
+        coords = make_coordinate_grid(H, W)
+
+    reference = InferenceEngine(model, backend="jit")
+    report = regression_report(reference.module, scripted, coords, H, W, gt_img=gt_img, repeats=args.repeats)
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}")
+
+    register_variant(args.model_dir, INT8_VARIANT, INT8_FILENAME, report)
+    print(f"已登记到 {os.path.join(args.model_dir, 'info.json')} 的variants.{INT8_VARIANT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# 数据集重新打包文件：按切片对齐的分块和压缩方式重写h5数据集，使按索引读取只触及一个切片的数据
+# 主要功能：
+# 1. trnOrg/trnCsm以单切片为一个chunk重写，压缩方式（lzf/gzip/none）按实测的读取吞吐量选择
+# 2. trnMask（0/1掩模）按位打包为uint8位图，数据集属性packed_bits记录打包方式和原始宽度
+# 3. open_mask：透明地读取打包或未打包的掩模，供MRIDataset、kspace.py、test.py等读取数据的脚本使用
+# 用法：
+#   python repack_dataset.py data/dataset.hdf5                      # 输出 data/dataset_repacked.hdf5
+#   python repack_dataset.py data/dataset.hdf5 -o data/packed.hdf5 --compression lzf
+#   python benchmark.py repack --original data/dataset.hdf5 --repacked data/dataset_repacked.hdf5
+
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+
+# 按单切片分块重写的数据集
+SLICE_DATASETS = ('trnOrg', 'trnCsm')
+MASK_DATASET = 'trnMask'
+# 打包掩模的属性：packed_bits为1表示按位打包，mask_width/mask_dtype记录解包后的宽度和dtype
+PACKED_MASK_ATTR = 'packed_bits'
+COMPRESSIONS = {
+    'none': {},
+    'lzf': {'compression': 'lzf'},
+    'gzip': {'compression': 'gzip', 'compression_opts': 4},
+}
+
+
+class PackedMask:
+    """按位打包的掩模数据集的只读视图，索引时解包为原始dtype
+
+    参数:
+        dataset: 形状为(N, H, ceil(W/8))的uint8 h5py数据集
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.width = int(dataset.attrs['mask_width'])
+        self.dtype = np.dtype(dataset.attrs['mask_dtype'])
+        self.shape = dataset.shape[:-1] + (self.width,)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        packed = self.dataset[idx]
+        return np.unpackbits(packed, axis=-1, count=self.width).astype(self.dtype)
+
+
+def open_mask(data):
+    """读取h5文件中的采样掩模（打包时返回PackedMask，否则返回h5py数据集）
+
+    Args:
+        data: 已打开的h5py.File
+
+    Returns:
+        支持按索引读取和.shape的掩模数组
+    """
+    dataset = data[MASK_DATASET]
+    if dataset.attrs.get(PACKED_MASK_ATTR, 0):
+        return PackedMask(dataset)
+    return dataset
+
+
+def _slice_chunks(shape):
+    """单切片的chunk形状"""
+    return (1,) + tuple(shape[1:])
+
+
+def measure_read_throughput(source, compression, num_slices=8):
+    """把前num_slices个切片以给定压缩方式写入临时文件，测量逐切片读取的吞吐量
+
+    Args:
+        source: 源h5py数据集
+        compression: COMPRESSIONS中的名称
+        num_slices: 用于测量的切片数
+
+    Returns:
+        (读取吞吐量MB/s, 压缩后大小相对原始数据的比例)
+    """
+    sample = source[:min(num_slices, source.shape[0])]
+    fd, path = tempfile.mkstemp(suffix='.hdf5')
+    os.close(fd)
+    try:
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('sample', data=sample, chunks=_slice_chunks(sample.shape), **COMPRESSIONS[compression])
+        ratio = os.path.getsize(path) / sample.nbytes
+        with h5py.File(path, 'r', rdcc_nbytes=0) as f:
+            dataset = f['sample']
+            start = time.perf_counter()
+            for idx in range(sample.shape[0]):
+                dataset[idx]
+            elapsed = time.perf_counter() - start
+    finally:
+        os.remove(path)
+    return sample.nbytes / 2 ** 20 / elapsed, ratio
+
+
+def choose_compression(source, candidates=('none', 'lzf', 'gzip')):
+    """按实测读取吞吐量为数据集选择压缩方式"""
+    results = {name: measure_read_throughput(source, name) for name in candidates}
+    for name, (throughput, ratio) in results.items():
+        print(f"  {source.name} {name}: 读取 {throughput:.0f} MB/s，大小比例 {ratio:.2f}")
+    return max(results, key=lambda name: results[name][0])
+
+
+def _copy_slices(source, target, desc):
+    for idx in tqdm(range(source.shape[0]), desc=desc):
+        target[idx] = source[idx]
+
+
+def repack(input_path, output_path, compression='auto'):
+    """重新打包h5数据集
+
+    Args:
+        input_path: 原始h5文件
+        output_path: 输出h5文件
+        compression: 'auto'表示按实测吞吐量为每个数据集选择，否则为COMPRESSIONS中的名称
+
+    Returns:
+        dict: 数据集名称 -> 使用的压缩方式
+    """
+    chosen = {}
+    tmp_path = output_path + '.tmp'
+    with h5py.File(input_path, 'r') as src, h5py.File(tmp_path, 'w') as dst:
+        dst.attrs.update(src.attrs)
+        for name in SLICE_DATASETS:
+            source = src[name]
+            chosen[name] = choose_compression(source) if compression == 'auto' else compression
+            target = dst.create_dataset(name, shape=source.shape, dtype=source.dtype,
+                                        chunks=_slice_chunks(source.shape), **COMPRESSIONS[chosen[name]])
+            target.attrs.update(source.attrs)
+            _copy_slices(source, target, name)
+
+        mask = open_mask(src)
+        binary = all(np.isin(mask[idx], (0, 1)).all() for idx in range(mask.shape[0]))
+        if binary:
+            # 0/1掩模按位打包，单个切片的掩模只占H*W/8字节
+            packed_shape = mask.shape[:-1] + ((mask.shape[-1] + 7) // 8,)
+            target = dst.create_dataset(MASK_DATASET, shape=packed_shape, dtype=np.uint8,
+                                        chunks=_slice_chunks(packed_shape))
+            for idx in range(mask.shape[0]):
+                target[idx] = np.packbits(mask[idx].astype(bool), axis=-1)
+            target.attrs[PACKED_MASK_ATTR] = 1
+            target.attrs['mask_width'] = mask.shape[-1]
+            target.attrs['mask_dtype'] = np.dtype(mask.dtype).str
+            chosen[MASK_DATASET] = 'packed_bits'
+        else:
+            print(f"{MASK_DATASET} 不是0/1掩模，按单切片分块保存但不打包")
+            source = src[MASK_DATASET]
+            target = dst.create_dataset(MASK_DATASET, shape=source.shape, dtype=source.dtype,
+                                        chunks=_slice_chunks(source.shape))
+            _copy_slices(source, target, MASK_DATASET)
+            chosen[MASK_DATASET] = 'none'
+
+        # 其他数据集原样复制
+        for name in src:
+            if name not in SLICE_DATASETS and name != MASK_DATASET:
+                src.copy(name, dst)
+        dst.attrs['repack_compression'] = ','.join(f"{name}={value}" for name, value in chosen.items())
+    shutil.move(tmp_path, output_path)
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按切片对齐的分块和压缩方式重新打包h5数据集")
+    parser.add_argument("input", help="原始h5数据集")
+    parser.add_argument("-o", "--output", default=None, help="输出路径，默认为<输入>_repacked.hdf5")
+    parser.add_argument("--compression", choices=['auto'] + list(COMPRESSIONS), default='auto',
+                        help="auto表示按实测读取吞吐量为每个数据集选择")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.input)[0] + '_repacked.hdf5'
+    chosen = repack(args.input, output_path, compression=args.compression)
+    before = os.path.getsize(args.input) / 2 ** 20
+    after = os.path.getsize(output_path) / 2 ** 20
+    print(f"{args.input} ({before:.1f} MB) -> {output_path} ({after:.1f} MB)")
+    for name, value in chosen.items():
+        print(f"  {name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# 服务格式文件：紧凑、可内存映射的只含权重的模型格式（.inr）
+# 文件布局：
+#   MAGIC(8字节) | 头部长度(uint64, 小端) | JSON头部 | 填充到64字节对齐 | 各张量的原始数据（均64字节对齐）
+# JSON头部包含build_model所需的完整encoder/mlp配置，以及每个张量的dtype、shape和数据偏移。
+# 加载时通过mmap映射文件，模型在meta设备上构建（不分配、不初始化参数），
+# fp32张量直接以torch.frombuffer零拷贝地赋值给Fullmodel的参数。
+# 用法：
+#   python serving_format.py best_model1.pt                         # 转换为 best_model1.inr
+#   python serving_format.py checkpoint.pt -o model.inr --dtype float16 --config config.yaml
+
+import os
+import json
+import mmap
+import math
+import struct
+import yaml
+import argparse
+import torch
+import torch.nn as nn
+
+from model import build_model, get_model_config
+
+
+MAGIC = b"MRIINR01"
+HEADER_LENGTH = struct.Struct("<Q")
+ALIGNMENT = 64
+FORMAT_VERSION = 1
+SERVING_SUFFIX = ".inr"
+
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "int64": torch.int64,
+}
+# 始终以fp32保存的张量（傅里叶频率矩阵B数值很大，半精度会引入明显的相位误差）
+FP32_PREFIXES = ("encoder.",)
+
+
+def _align(offset):
+    """向上对齐到ALIGNMENT字节"""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _dtype_name(dtype):
+    for name, torch_dtype in DTYPES.items():
+        if torch_dtype == dtype:
+            return name
+    raise ValueError(f"Unsupported tensor dtype: {dtype}")
+
+
+def load_trained_model(checkpoint_path, config=None):
+    """加载训练好的模型（.pt或.inr）
+
+    .pt支持三种格式：完整的pickle模型、start.py保存的检查点（model_state_dict）、纯state_dict。
+    后两种需要提供config来构建模型结构。
+
+    Args:
+        checkpoint_path: 模型文件路径
+        config: 训练配置（config.yaml的内容）
+
+    Returns:
+        评估模式下位于CPU的模型
+    """
+    if checkpoint_path.endswith(SERVING_SUFFIX):
+        return load_inr(checkpoint_path)
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    return _model_from_checkpoint(checkpoint, config, checkpoint_path)
+
+
+def _model_from_checkpoint(checkpoint, config, checkpoint_path):
+    """从torch.load的结果构建模型"""
+    if isinstance(checkpoint, nn.Module):
+        return checkpoint.eval()
+    if "training_info" in checkpoint:
+        # 在线训练保存的模型结构与Fullmodel不同（直接以坐标为输入的单通道MLP）
+        raise ValueError("Online training checkpoints are not Fullmodel checkpoints: " + checkpoint_path)
+    if config is None:
+        raise ValueError("config is required to load a state_dict checkpoint: " + checkpoint_path)
+    state_dict = checkpoint.get("model_state_dict", checkpoint)
+    model = build_model(config)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def save_inr(model, path, dtype="float32", metadata=None):
+    """将Fullmodel保存为.inr服务格式
+
+    Args:
+        model: Fullmodel实例
+        path: 保存路径
+        dtype: 权重的存储精度（"float32"、"float16"或"bfloat16"），编码器张量始终为fp32
+        metadata: 额外写入头部的信息（例如指标）
+
+    Returns:
+        写入的字节数
+    """
+    storage_dtype = DTYPES[dtype]
+    tensors, blobs, offset = {}, [], 0
+    for name, tensor in model.state_dict().items():
+        tensor = tensor.detach().cpu().contiguous()
+        if tensor.is_floating_point() and not name.startswith(FP32_PREFIXES):
+            tensor = tensor.to(storage_dtype)
+        data = tensor.reshape(-1).view(torch.uint8).numpy().tobytes()
+        offset = _align(offset)
+        tensors[name] = {
+            "dtype": _dtype_name(tensor.dtype),
+            "shape": list(tensor.shape),
+            "offset": offset,
+            "nbytes": len(data),
+        }
+        blobs.append((offset, data))
+        offset += len(data)
+
+    header = json.dumps({
+        "format_version": FORMAT_VERSION,
+        "config": get_model_config(model),
+        "tensors": tensors,
+        "metadata": metadata or {},
+    }, ensure_ascii=False).encode("utf-8")
+    data_start = _align(len(MAGIC) + HEADER_LENGTH.size + len(header))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for blob_offset, data in blobs:
+            f.write(b"\0" * (data_start + blob_offset - f.tell()))
+            f.write(data)
+        return f.tell()
+
+
+def read_inr_header(path):
+    """只读取.inr文件的头部（不映射张量数据）
+
+    Returns:
+        dict: JSON头部
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not an .inr file: " + path)
+        header_length, = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+        return json.loads(f.read(header_length).decode("utf-8"))
+
+
+def load_inr(path, device="cpu"):
+    """通过mmap加载.inr文件为Fullmodel
+
+    文件以写时复制方式映射，fp32张量与页缓存共享内存、按需分页；
+    以半精度保存的张量在加载时转换为fp32（会产生一次拷贝）。
+    模型先在meta设备上构建，参数不会先随机初始化再被替换。
+
+    Args:
+        path: .inr文件路径
+        device: 目标设备（非CPU设备时权重会被拷贝到设备上）
+
+    Returns:
+        评估模式下的Fullmodel
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an .inr file: " + path)
+    header_length, = HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+    header_start = len(MAGIC) + HEADER_LENGTH.size
+    header = json.loads(buffer[header_start:header_start + header_length].decode("utf-8"))
+    if header.get("format_version", 1) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported .inr format version: {header['format_version']}")
+    data_start = _align(header_start + header_length)
+
+    state_dict = {}
+    for name, info in header["tensors"].items():
+        dtype = DTYPES[info["dtype"]]
+        count = math.prod(info["shape"])
+        # frombuffer持有mmap对象的引用，张量存在期间映射不会被释放
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=count,
+                                  offset=data_start + info["offset"]).view(info["shape"])
+        if dtype in (torch.float16, torch.bfloat16):
+            tensor = tensor.float()
+        state_dict[name] = tensor
+
+    with torch.device("meta"):
+        model = build_model(header["config"])
+    model.load_state_dict(state_dict, assign=True)
+    # 不随state_dict保存的缓冲区仍在meta设备上，在CPU上重新创建
+    for module in model.modules():
+        if any(buffer.is_meta for buffer in module.buffers(recurse=False)):
+            module.init_buffers()
+    return model.to(device).eval()
+
+
+def convert_checkpoint(checkpoint_path, output_path=None, dtype="float32", config=None):
+    """将已有的.pt模型文件转换为.inr格式
+
+    Args:
+        checkpoint_path: .pt模型文件路径
+        output_path: 输出路径，默认与输入同名、后缀为.inr
+        dtype: 权重的存储精度
+        config: 训练配置（检查点只含state_dict时需要）
+
+    Returns:
+        输出文件路径
+    """
+    if output_path is None:
+        output_path = os.path.splitext(checkpoint_path)[0] + SERVING_SUFFIX
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    model = _model_from_checkpoint(checkpoint, config, checkpoint_path)
+    metadata = {"source": os.path.basename(checkpoint_path)}
+    if isinstance(checkpoint, dict):
+        metadata.update({key: float(checkpoint[key]) for key in ("psnr", "ssim") if key in checkpoint})
+    save_inr(model, output_path, dtype=dtype, metadata=metadata)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将.pt模型转换为.inr服务格式")
+    parser.add_argument("checkpoints", nargs="+", help=".pt模型文件")
+    parser.add_argument("-o", "--output", default=None, help="输出路径（只转换一个文件时有效）")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float32")
+    parser.add_argument("--config", default=None, help="训练配置，检查点只含state_dict时用于构建模型")
+    args = parser.parse_args()
+
+    config = None
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+
+    for checkpoint_path in args.checkpoints:
+        output_path = args.output if len(args.checkpoints) == 1 else None
+        output_path = convert_checkpoint(checkpoint_path, output_path, dtype=args.dtype, config=config)
+        before = os.path.getsize(checkpoint_path) / 2 ** 20
+        after = os.path.getsize(output_path) / 2 ** 20
+        print(f"{checkpoint_path} ({before:.2f} MB) -> {output_path} ({after:.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
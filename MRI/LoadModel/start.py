@@ -6,17 +6,21 @@
 # 4. 结果保存和可视化：保存模型检查点、最佳模型和训练曲线
 
 import os
+import copy
+import time
 import yaml
 import torch
 import numpy as np
-from torch.utils.data import Subset, DataLoader
-from model import Fullmodel
-from dataset import MRIDataset
-from train import train_epoch_image
+from torch.utils.data import Subset
+from model import apply_hashgrid_defaults, build_model, share_encoder, StackedFullmodel
+from dataset import MRIDataset, make_data_loader
+from train import MetricScheduler, train_epoch_image
+from meta_init import load_meta_init
+from serving_format import save_inr
 from visualize import save_epoch_results_as_png, save_best_image, plot_loss_curve
 
 
-def save_checkpoint(model, optimizer, epoch, metrics, save_path):
+def save_checkpoint(model, optimizer, epoch, metrics, save_path, state=None):
     """保存模型检查点
     
     将模型状态、优化器状态和评估指标保存到指定路径
@@ -27,11 +31,12 @@ def save_checkpoint(model, optimizer, epoch, metrics, save_path):
         epoch: 当前训练轮数
         metrics: 包含PSNR和SSIM的评估指标字典
         save_path: 模型保存路径
+        state: snapshot_training_state的返回值，给定时保存该快照而不是模型和优化器的当前状态
     """
     checkpoint = {
         'epoch': epoch,
-        'model_state_dict': model.state_dict(),
-        'optimizer_state_dict': optimizer.state_dict(),
+        'model_state_dict': state['model'] if state is not None else model.state_dict(),
+        'optimizer_state_dict': state['optimizer'] if state is not None else optimizer.state_dict(),
         'psnr': metrics['psnr'],
         'ssim': metrics['ssim']
     }
@@ -85,6 +90,64 @@ def setup_device(gpu_id):
     return device
 
 
+def report_encoding_cache_saving(model, coords, epochs, repeats=5):
+    """测量并报告坐标编码缓存每轮节省的时间
+    
+    Args:
+        model: 已启用编码缓存的模型
+        coords: 训练使用的坐标网格
+        epochs: 训练总轮数（用于估算总节省时间）
+        repeats: 计时重复次数
+        
+    Returns:
+        float: 每轮节省的时间（毫秒）
+    """
+    def timed(fn):
+        if coords.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(coords)
+        if coords.is_cuda:
+            torch.cuda.synchronize()
+        return (time.perf_counter() - start) / repeats * 1000.0
+
+    with torch.no_grad():
+        # 第一次调用填充缓存
+        model.encoder(coords)
+        uncached_ms = timed(model.encoder.encode)
+        cached_ms = timed(model.encoder)
+    saved_ms = uncached_ms - cached_ms
+    print(f"坐标编码缓存：每轮编码耗时 {uncached_ms:.2f} ms -> {cached_ms:.2f} ms，"
+          f"每轮节省 {saved_ms:.2f} ms，{epochs} 轮共节省约 {saved_ms * epochs / 1000.0:.1f} s")
+    return saved_ms
+
+
+def snapshot_training_state(model, optimizer):
+    """复制模型和优化器的当前状态
+
+    后台计算指标时，结果要在之后的轮次才能取回；保存检查点、最佳模型和渲染结果时使用评估轮的快照，
+    与同步计算指标时保存的状态一致。只在后台模式的评估轮调用。
+    """
+    return {
+        "model": {key: value.detach().clone() for key, value in model.state_dict().items()},
+        "optimizer": copy.deepcopy(optimizer.state_dict()),
+    }
+
+
+def render_model_and_sample(model, dataset, train_indices, device):
+    """可视化使用的模型和样本
+    
+    堆叠模型拆分出第一个切片的网络，并与该切片的样本一起返回；单个模型沿用原来的可视化样本。
+    
+    Returns:
+        tuple: (模型, 样本)
+    """
+    if isinstance(model, StackedFullmodel):
+        return model.unstack()[0].to(device), dataset[train_indices[0]]
+    return model, dataset[0]
+
+
 def main():
     """主函数：执行模型训练和验证的完整流程
     
@@ -99,34 +162,58 @@ def main():
     # 加载配置文件
     with open("config.yaml", "r", encoding='utf-8') as f:
         config = yaml.safe_load(f)
+    # hashgrid编码使用自己的小型解码器和学习率（结果目录名、优化器和模型结构都按生效的配置）
+    config = apply_hashgrid_defaults(config)
 
     # 设置计算设备
     device = setup_device(config['gpu_id'])
 
+    # 渲染（可视化、检查点快照）时的分块推理内存预算，未配置时根据可用内存自动选择
+    render_memory_budget = config.get("render_memory_budget_mb")
+    if render_memory_budget is not None:
+        render_memory_budget = int(float(render_memory_budget) * 1024 * 1024)
+
     # 准备数据集和数据加载器
-    train_dataset = MRIDataset(config["dataset_path"], split='train')
-    one_image_subset = Subset(train_dataset, [1])
-    train_loader = DataLoader(one_image_subset, batch_size=1, shuffle=False)
+    train_dataset = MRIDataset(config["dataset_path"], split='train',
+                               lazy=config.get("dataset_lazy", True),
+                               cache_slices=config.get("dataset_cache_slices", 8),
+                               kspace_cache_dir=config.get("kspace_cache_dir"),
+                               virtual_coils=config.get("virtual_coils"))
+    # 训练的切片：多个切片时每个切片一个独立网络（StackedFullmodel），所有切片在一步中同时训练
+    train_indices = list(config.get("train_indices", [1]))
+    train_subset = Subset(train_dataset, train_indices)
+    train_loader = make_data_loader(train_subset, batch_size=len(train_indices), shuffle=False,
+                                    num_workers=config.get("num_workers", 0),
+                                    prefetch_factor=config.get("prefetch_factor", 2))
 
     # 初始化模型
-    model = Fullmodel(
-        encoding_mode=config["encoder"]["encoding_mode"],
-        in_features=config["encoder"]["in_features"],
-        out_features=config["encoder"]["out_features"],
-        coordinate_scales=config["encoder"]["coordinate_scales"],
-        mlp_hidden_features=config["mlp"]["mlp_hidden_features"],
-        mlp_hidden_layers=config["mlp"]["mlp_hidden_layers"],
-        omega_0=config["mlp"]["omega_0"],
-        activation=config["mlp"]["activation"],
-    ).to(device)
+    # 多个切片的网络堆叠训练时共享同一个傅里叶编码器
+    models = share_encoder([build_model(config) for _ in train_indices])
+
+    # 从元学习初始化热启动（meta_init.py生成），未配置时使用随机SIREN初始化
+    if config.get("meta_init_path"):
+        for slice_model in models:
+            load_meta_init(slice_model, config["meta_init_path"])
+    stacked = len(models) > 1
+    model = (StackedFullmodel(models) if stacked else models[0]).to(device)
+
+    # 启用坐标编码缓存：B和coordinate_scales固定，坐标网格不变，编码只需计算一次
+    encoding_cache_mb = config.get("encoding_cache_mb")
+    if encoding_cache_mb:
+        model.enable_encoding_cache(int(float(encoding_cache_mb) * 1024 * 1024))
+        report_encoding_cache_saving(model, train_dataset.coords.to(device), config["epochs"])
+
+    # 频率退火：按训练轮数逐步放开高频频带
+    annealing = config.get("frequency_annealing") or {}
+    anneal_epochs = annealing.get("anneal_epochs") if annealing.get("enabled") else None
 
     # 初始化优化器和学习率调度器
     optimizer = torch.optim.Adam(model.parameters(), lr=float(config["learning_rate"]))
     scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1000, gamma=0.9)
 
-    # 初始化训练历史记录
+    # 初始化训练历史记录（PSNR按轮次索引，没有计算指标的轮次为NaN）
     train_loss_history = []
-    train_psnr_history = []
+    train_psnr_history = [float("nan")] * config["epochs"]
     
     # 设置结果保存目录
     result_dir = "{}_{}_{}_B_{}_{}".format(
@@ -148,54 +235,104 @@ def main():
     best_psnr, best_ssim = load_best_metrics(best_metrics_path)
     print("historial Best PSNR:", best_psnr, "Best SSIM:", best_ssim)
 
-    # 开始训练循环
-    print("Start Training!")
-    for epoch in range(config["epochs"]):
-        # 根据监督模式选择训练方法
-        if config["supervision_mode"] in ['kspace', 'kspace_csm', 'image']:
-            loss, psnr, ssim, nse = train_epoch_image(
-                model, train_loader, optimizer, device,
-                supervision_mode=config["supervision_mode"],
-                lambda_tv=config["lambda_tv"]
-            )
-        else:
-            raise ValueError("Unsupport Prediction_mode")
+    # 指标调度：每metric_interval轮评估一次，非评估轮只计算损失；
+    # metric_background为True时PSNR/SSIM/NSE在后台线程中计算，结果在之后的轮次取回
+    save_interval = config.get("save_interval", 1000)
+    metric_scheduler = MetricScheduler(interval=config.get("metric_interval", 1),
+                                       background=config.get("metric_background", False))
+    psnr, ssim, nse = None, None, None
+    evaluated_model = None
 
-        # 记录训练历史
-        train_loss_history.append(loss)
-        train_psnr_history.append(psnr)
-        sample = train_dataset[0]
+    def model_at(state):
+        """第epoch轮的模型：同步计算时就是当前模型，后台计算时把快照加载到一个独立的副本中"""
+        nonlocal evaluated_model
+        if state is None:
+            return model
+        if evaluated_model is None:
+            evaluated_model = copy.deepcopy(model)
+        evaluated_model.load_state_dict(state["model"])
+        return evaluated_model
+
+    def report_metrics(epoch, metrics, state):
+        """处理第epoch轮的指标：记录历史、定期保存检查点和结果、保存最佳模型
+
+        后台计算时结果最多晚MetricScheduler.max_pending轮取回，检查点和渲染结果使用submit时的状态快照，
+        保存的始终是第epoch轮（指标所属轮次）的模型。
+        """
+        nonlocal best_psnr, best_ssim, psnr, ssim, nse
+        psnr, ssim, nse = metrics["psnr"], metrics["ssim"], metrics["nse"]
+        train_psnr_history[epoch] = psnr
 
         # 定期保存检查点和结果
-        if (epoch + 1) % config.get("save_interval", 1000) == 0:
+        if (epoch + 1) % save_interval == 0:
+            render_model, sample = render_model_and_sample(model_at(state), train_dataset, train_indices, device)
             save_epoch_results_as_png(
-                model, sample, device, epoch, result_dir,
-                supervision_mode=config["supervision_mode"]
+                render_model, sample, device, epoch, result_dir,
+                supervision_mode=config["supervision_mode"],
+                memory_budget=render_memory_budget
             )
             checkpoint_path = os.path.join(model_save_dir, f"checkpoint_epoch_{epoch+1}.pt")
-            save_checkpoint(model, optimizer, epoch, {'psnr': psnr, 'ssim': ssim}, checkpoint_path)
+            save_checkpoint(model, optimizer, epoch, metrics, checkpoint_path, state=state)
             print(
-                f"Epoch {epoch + 1}/{config['epochs']}: Loss={loss:.4e}, "
+                f"Epoch {epoch + 1}/{config['epochs']}: Loss={train_loss_history[epoch]:.4e}, "
                 f"PSNR={psnr:.2f}, SSIM={ssim:.4f}, NSE={nse:.4f}"
             )
-        
+
         # 保存性能提升时的最佳模型
         if psnr > best_psnr or ssim > best_ssim:
             best_psnr = max(best_psnr, psnr)
             best_ssim = max(best_ssim, ssim)
+            render_model, sample = render_model_and_sample(model_at(state), train_dataset, train_indices, device)
             save_best_image(
-                model, sample, device, psnr, ssim, result_dir,
-                supervision_mode=config["supervision_mode"]
+                render_model, sample, device, psnr, ssim, result_dir,
+                supervision_mode=config["supervision_mode"],
+                memory_budget=render_memory_budget
             )
             best_model_path = os.path.join(model_save_dir, "best_model.pt")
-            save_checkpoint(model, optimizer, epoch, {'psnr': psnr, 'ssim': ssim}, best_model_path)
-        
+            save_checkpoint(model, optimizer, epoch, metrics, best_model_path, state=state)
+
+    # 开始训练循环
+    print("Start Training!")
+    for epoch in range(config["epochs"]):
+        if anneal_epochs:
+            model.set_anneal_progress(epoch / anneal_epochs)
+
+        # 根据监督模式选择训练方法（非评估轮只计算损失）
+        evaluate = metric_scheduler.should_evaluate(epoch, config["epochs"], save_interval)
+        if config["supervision_mode"] in ['kspace', 'kspace_csm', 'image']:
+            loss, _, _, _ = train_epoch_image(
+                model, train_loader, optimizer, device,
+                supervision_mode=config["supervision_mode"],
+                lambda_tv=config["lambda_tv"],
+                compute_metrics=evaluate,
+                metric_scheduler=metric_scheduler
+            )
+        else:
+            raise ValueError("Unsupport Prediction_mode")
+
+        # 记录训练历史
+        train_loss_history.append(loss)
+        if evaluate:
+            # 后台计算时指标晚几轮才取回，提交时保存本轮的状态快照
+            state = snapshot_training_state(model, optimizer) if metric_scheduler.background else None
+            metric_scheduler.submit(epoch, state)
+        for result in metric_scheduler.poll():
+            report_metrics(*result)
+
         # 更新学习率
         scheduler.step()
 
+    for result in metric_scheduler.finish():
+        report_metrics(*result)
+
     # 训练结束，保存最终模型
     final_model_path = os.path.join(model_save_dir, "final_model.pt")
     save_checkpoint(model, optimizer, config["epochs"]-1, {'psnr': psnr, 'ssim': ssim}, final_model_path)
+    if stacked:
+        # 多切片训练时另外把每个切片的网络保存为独立的.inr模型
+        for index, slice_model in zip(train_indices, model.unstack()):
+            save_inr(slice_model, os.path.join(model_save_dir, f"final_model_slice{index}.inr"),
+                     metadata={"slice_index": index})
 
     # 保存训练曲线和PSNR历史
     loss_curve_path = os.path.join(result_dir, "loss_curve.png")
@@ -4,6 +4,8 @@ import torch
 import numpy as np
 import matplotlib.pyplot as plt
 
+from repack_dataset import open_mask
+
 
 def normalize01(img):
     """
@@ -37,7 +39,7 @@ def load_dataset(file_path):
         # 原始图像：形状 (N, H, W)
         trnOrg = f['trnOrg'][:]
         # 采样掩码：形状 (N, H, W)，1 表示采样到的 k-space 点，0 表示未采样
-        trnMask = f['trnMask'][:]
+        trnMask = open_mask(f)[:]
     return trnOrg, trnMask
 
 
@@ -0,0 +1,42 @@
+# 测试配置：LoadModel中的模块按模块名互相导入（from dataset import ...），测试时把LoadModel加入sys.path
+# 并提供小型的临时h5数据集
+
+import os
+import sys
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_dataset(path, num_samples=4, size=16, coils=4, seed=0):
+    """写入与训练数据集结构相同的小型h5文件（trnOrg、trnMask、trnCsm）"""
+    rng = np.random.default_rng(seed)
+    org = (rng.standard_normal((num_samples, size, size))
+           + 1j * rng.standard_normal((num_samples, size, size))).astype(np.complex64)
+    mask = np.zeros((num_samples, size, size), dtype=np.float32)
+    mask[:, ::2, :] = 1.0          # 按行的Cartesian欠采样
+    csm = (rng.standard_normal((num_samples, coils, size, size))
+           + 1j * rng.standard_normal((num_samples, coils, size, size))).astype(np.complex64)
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('trnOrg', data=org)
+        f.create_dataset('trnMask', data=mask)
+        f.create_dataset('trnCsm', data=csm)
+    return path
+
+
+def model_config(encoding_mode="fourier", hidden_features=32, hidden_layers=2, activation="sine", **mlp):
+    """build_model使用的小型模型配置"""
+    return {
+        "encoder": {"encoding_mode": encoding_mode, "in_features": 2, "out_features": 64,
+                    "coordinate_scales": [1.0, 1.0]},
+        "mlp": {"mlp_hidden_features": hidden_features, "mlp_hidden_layers": hidden_layers,
+                "omega_0": 30, "activation": activation, **mlp},
+    }
+
+
+@pytest.fixture
+def dataset_path(tmp_path):
+    return write_dataset(str(tmp_path / "dataset.hdf5"))
@@ -0,0 +1,65 @@
+import torch
+import pytest
+
+from dataset import MRIDataset, make_data_loader
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_sample_shapes(dataset_path, lazy):
+    dataset = MRIDataset(dataset_path, lazy=lazy)
+    sample = dataset[1]
+    assert len(dataset) == 4
+    assert sample['coords'].shape == (16 * 16, 2)
+    assert sample['gt_img'].shape == (16, 16)
+    assert sample['gt_loss_csm_kspace'].shape == (dataset.C, 16, 16)
+    assert sample['mask'].shape == (dataset.C, 16, 16)
+    assert sample['coil_energy'] == 1.0
+
+
+def test_virtual_coils(dataset_path):
+    dataset = MRIDataset(dataset_path, virtual_coils=2)
+    sample = dataset[0]
+    assert dataset.C == 2
+    assert sample['gt_csm'].shape == (2, 16, 16)
+    assert sample['gt_full_csm_kspace'].shape == (2, 16, 16)
+    assert sample['gt_loss_csm_kspace'].shape == (2, 16, 16)
+    assert sample['mask'].shape == (2, 16, 16)
+    assert 0.0 < sample['coil_energy'] <= 1.0
+
+
+def test_kspace_cache_matches_direct(dataset_path, tmp_path):
+    from kspace_cache import build_cache
+
+    cache_dir = str(tmp_path / "cache")
+    build_cache(dataset_path, cache_dir)
+    direct = MRIDataset(dataset_path, virtual_coils=2)[2]
+    cached = MRIDataset(dataset_path, kspace_cache_dir=cache_dir, virtual_coils=2)[2]
+    for key in ('gt_full_kspace', 'gt_loss_kspace', 'gt_full_csm_kspace', 'gt_loss_csm_kspace', 'mask'):
+        assert torch.allclose(direct[key], cached[key], atol=1e-4), key
+
+
+def test_worker_loader(dataset_path):
+    dataset = MRIDataset(dataset_path)
+    loader = make_data_loader(dataset, batch_size=2, num_workers=2)
+    batches = list(loader)
+    assert len(batches) == 2
+    assert batches[0]['gt_img'].shape == (2, 16, 16)
+    assert batches[0]['coords'].shape == (2, 16 * 16, 2)
+    assert len(batches[0]['mask_index']) == 2
+    assert torch.equal(batches[1]['gt_img'][0], dataset[2]['gt_img'])
+
+
+def test_coil_compression_matrix_computed_once_per_slice(dataset_path, monkeypatch):
+    import dataset as dataset_module
+
+    calls = []
+    original = dataset_module.coil_compression_matrix
+    monkeypatch.setattr(dataset_module, "coil_compression_matrix",
+                        lambda *args: calls.append(1) or original(*args))
+    dataset = MRIDataset(dataset_path, virtual_coils=2)
+    first = dataset[1]
+    second = dataset[1]
+    dataset[2]
+    assert len(calls) == 2
+    assert torch.equal(first["gt_csm"], second["gt_csm"])
+    assert first["coil_energy"] == second["coil_energy"]
@@ -0,0 +1,27 @@
+import torch
+
+from conftest import model_config
+from model import ExpertMLP, build_model
+from inference import make_coordinate_grid
+from distill import build_student, distill
+from prune import flops_per_point, tradeoff_report
+
+
+def test_partitioned_teacher_distills_to_dense_student():
+    torch.manual_seed(0)
+    teacher = build_model(model_config(hidden_features=32, experts=[2, 2])).eval()
+    student = build_student(teacher, hidden_features=16, hidden_layers=1)
+    assert isinstance(student.net, ExpertMLP)
+    assert torch.equal(student.encoder.B, teacher.encoder.B)
+
+    coords = make_coordinate_grid(16, 16)
+    distill(teacher, student, coords, 16, 16, steps=2, batch_size=64, log_interval=1)
+    report = tradeoff_report(teacher, student, coords, 16, 16, repeats=1)
+    assert 0 < report["flops_ratio"] < 1
+
+
+def test_flops_count_one_expert_per_point():
+    torch.manual_seed(0)
+    dense = build_model(model_config(hidden_features=32))
+    partitioned = build_model(model_config(hidden_features=32, experts=[2, 2]))
+    assert flops_per_point(partitioned) == flops_per_point(dense)
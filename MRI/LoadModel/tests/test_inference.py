@@ -0,0 +1,97 @@
+import pytest
+import torch
+
+from conftest import model_config
+from model import build_model
+from inference import InferenceEngine, ModelStack, evaluate_tiled, fold_model, make_coordinate_grid
+
+
+def _model(**mlp):
+    torch.manual_seed(0)
+    return build_model(model_config(**mlp))
+
+
+@pytest.mark.parametrize("activation", ["sine", "relu"])
+def test_fold_model_matches_eager(activation):
+    model = _model(activation=activation).eval()
+    coords = make_coordinate_grid(16, 16)
+    with torch.no_grad():
+        torch.testing.assert_close(fold_model(model)(coords), model(coords), atol=1e-4, rtol=1e-4)
+
+
+def test_fold_model_keeps_annealing_weights():
+    torch.manual_seed(0)
+    model = build_model({**model_config(), "frequency_annealing": {"enabled": True, "num_bands": 4}}).eval()
+    model.set_anneal_progress(0.5)
+    coords = make_coordinate_grid(16, 16)
+    with torch.no_grad():
+        torch.testing.assert_close(fold_model(model)(coords), model(coords), atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize("backend", ["jit", "folded", "eager"])
+def test_engine_matches_eager(backend):
+    model = _model().eval()
+    coords = make_coordinate_grid(16, 16)
+    with torch.no_grad():
+        expected = model(coords)
+    engine = InferenceEngine(model, backend=backend)
+    assert engine.backend == backend
+    torch.testing.assert_close(engine(coords), expected, atol=1e-4, rtol=1e-4)
+
+
+def test_unfoldable_model_falls_back_to_eager():
+    model = _model(experts=[2, 2]).eval()
+    coords = make_coordinate_grid(16, 16)
+    engine = InferenceEngine(model, backend="jit")
+    assert engine.backend == "eager"
+    with torch.no_grad():
+        torch.testing.assert_close(engine(coords), model(coords))
+
+
+def test_eager_engine_leaves_caller_model_untouched():
+    model = _model().train()
+    InferenceEngine(model, backend="eager")
+    assert model.training
+    assert all(module.training for module in model.modules())
+
+
+@pytest.mark.parametrize("tile_size", [1, 7, 64, 1000])
+def test_evaluate_tiled_matches_full_pass(tile_size):
+    model = _model().eval()
+    coords = make_coordinate_grid(16, 16)
+    with torch.no_grad():
+        expected = model(coords)
+    torch.testing.assert_close(evaluate_tiled(model, coords, tile_size=tile_size), expected)
+
+
+def test_evaluate_tiled_memory_budget_sets_tile_size():
+    model = _model().eval()
+    coords = make_coordinate_grid(64, 64)
+    calls = []
+
+    def counted(tile):
+        calls.append(tile.shape[0])
+        return model(tile)
+
+    # 每个坐标点4个宽度为32的fp32激活：预算恰好容纳1024个点
+    output = evaluate_tiled(counted, coords, memory_budget=1024 * 4 * 32 * 4, width=32)
+    assert calls == [1024] * 4
+    with torch.no_grad():
+        torch.testing.assert_close(output, model(coords))
+
+
+@pytest.mark.parametrize("activation", ["sine", "relu"])
+def test_model_stack_matches_individual_engines(activation):
+    torch.manual_seed(0)
+    models = [build_model(model_config(activation=activation)).eval() for _ in range(3)]
+    coords = make_coordinate_grid(16, 16)
+    output = ModelStack(models)(coords)
+    assert output.shape == (3, 256, 2)
+    for i, model in enumerate(models):
+        torch.testing.assert_close(output[i], InferenceEngine(model, backend="folded")(coords),
+                                   atol=1e-4, rtol=1e-4)
+
+
+def test_model_stack_rejects_mixed_architectures():
+    with pytest.raises(ValueError):
+        ModelStack([_model(hidden_features=32), _model(hidden_features=16)])
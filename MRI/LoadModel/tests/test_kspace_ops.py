@@ -0,0 +1,92 @@
+import torch
+import pytest
+
+from kspace_ops import (COLUMN_LINES, NON_CARTESIAN, ROW_LINES, forward_sampled, gather_sampled, mask_to_index,
+                        sampled_error, sampled_kspace_error)
+
+
+SIZE = 32
+COILS = 4
+
+
+def _masks():
+    generator = torch.Generator().manual_seed(0)
+    rows = torch.zeros(SIZE, SIZE)
+    rows[::4] = 1                           # 1/4的行：部分DFT
+    half_rows = torch.zeros(SIZE, SIZE)
+    half_rows[::2] = 1                      # 1/2的行（2倍加速）：完整fft2后gather
+    dense_rows = torch.zeros(SIZE, SIZE)
+    dense_rows[::4] = 1
+    dense_rows[1::4] = 1
+    dense_rows[2::4] = 1                    # 3/4的行：完整fft2后gather
+    columns = rows.T.clone()
+    random = (torch.rand(SIZE, SIZE, generator=generator) < 0.3).float()
+    weighted = random * torch.rand(SIZE, SIZE, generator=generator)
+    return {"rows": (rows, ROW_LINES), "half_rows": (half_rows, ROW_LINES), "dense_rows": (dense_rows, ROW_LINES),
+            "columns": (columns, COLUMN_LINES),
+            "random": (random, NON_CARTESIAN), "weighted": (weighted, NON_CARTESIAN)}
+
+
+def _random_problem():
+    generator = torch.Generator().manual_seed(1)
+    image = torch.randn(SIZE, SIZE, 2, generator=generator, dtype=torch.float64)
+    csm = torch.randn(COILS, SIZE, SIZE, 2, generator=generator, dtype=torch.float64)
+    gt = torch.randn(COILS, SIZE, SIZE, 2, generator=generator, dtype=torch.float64)
+    return (torch.view_as_complex(image).to(torch.complex64).requires_grad_(),
+            torch.view_as_complex(csm).to(torch.complex64), torch.view_as_complex(gt).to(torch.complex64))
+
+
+def _dense_loss(image, csm, gt, mask):
+    error = (torch.view_as_real(torch.fft.fft2(image * csm) - gt) ** 2).sum(dim=-1)
+    coil_mask = mask.expand(COILS, -1, -1)
+    return (error * coil_mask).sum() / (coil_mask.sum() + 1e-6)
+
+
+@pytest.mark.parametrize("name", list(_masks()))
+def test_mask_to_index_kind(name):
+    mask, line_axis = _masks()[name]
+    index = mask_to_index(mask)
+    assert int(index['line_axis']) == line_axis
+    assert torch.isclose(index['total_weight'], mask.sum())
+    # 部分DFT只用于4倍及以上加速的线采样
+    assert bool(index['dft'].numel()) == (name in ("rows", "columns"))
+
+
+@pytest.mark.parametrize("name", list(_masks()))
+def test_sampled_loss_matches_dense(name):
+    mask, _ = _masks()[name]
+    index = mask_to_index(mask)
+
+    image, csm, gt = _random_problem()
+    dense = _dense_loss(image, csm, gt, mask)
+    dense_grad, = torch.autograd.grad(dense, image)
+
+    image, csm, gt = _random_problem()
+    sampled = sampled_error(forward_sampled(image * csm, index), gather_sampled(gt, index), index, COILS)
+    sampled_grad, = torch.autograd.grad(sampled, image)
+
+    assert torch.allclose(sampled, dense, rtol=1e-4)
+    assert torch.allclose(sampled_grad, dense_grad, rtol=1e-3, atol=1e-6 * dense_grad.abs().max())
+
+
+@pytest.mark.parametrize("name", list(_masks()))
+def test_sampled_kspace_error_matches_dense(name):
+    mask, _ = _masks()[name]
+    image, csm, gt = _random_problem()
+    pred_kspace = torch.fft.fft2(image * csm)
+    dense = _dense_loss(image, csm, gt, mask)
+    assert torch.allclose(sampled_kspace_error(pred_kspace, gt, mask_to_index(mask)), dense, rtol=1e-5)
+
+
+def test_kspace_csm_loss_sampled_matches_dense(dataset_path):
+    from dataset import MRIDataset, make_data_loader
+    from train import kspace_csm_loss
+
+    batch = next(iter(make_data_loader(MRIDataset(dataset_path), batch_size=2)))
+    dense_batch = {key: value for key, value in batch.items() if key != 'mask_index'}
+    generator = torch.Generator().manual_seed(2)
+    pred = torch.view_as_complex(torch.randn(2, 16, 16, 2, generator=generator))
+
+    sampled = kspace_csm_loss(pred, batch, 'cpu')
+    dense = kspace_csm_loss(pred, dense_batch, 'cpu')
+    assert torch.allclose(sampled, dense, rtol=1e-4)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import torch
+
+from metrics import image_quality, nse, psnr, ssim
+
+skimage_metrics = pytest.importorskip("skimage.metrics")
+
+
+def _images(seed=0, batch=3, size=32):
+    rng = np.random.default_rng(seed)
+    target = rng.random((batch, size, size))
+    pred = np.clip(target + 0.1 * rng.standard_normal(target.shape), 0.0, 1.0)
+    return pred, target
+
+
+def test_psnr_and_nse_match_reference():
+    pred, target = _images()
+    expected_psnr = [skimage_metrics.peak_signal_noise_ratio(t, p, data_range=1.0) for p, t in zip(pred, target)]
+    expected_nse = [np.sum((p - t) ** 2) / np.sum(t ** 2) for p, t in zip(pred, target)]
+    np.testing.assert_allclose(psnr(pred, target).numpy(), expected_psnr, rtol=1e-10)
+    np.testing.assert_allclose(nse(pred, target).numpy(), expected_nse, rtol=1e-10)
+
+
+@pytest.mark.parametrize("gaussian", [True, False])
+def test_ssim_matches_skimage(gaussian):
+    pred, target = _images()
+    options = dict(gaussian_weights=True, sigma=1.5, use_sample_covariance=False) if gaussian else {}
+    expected = [skimage_metrics.structural_similarity(p, t, data_range=t.max() - t.min(), **options)
+                for p, t in zip(pred, target)]
+    np.testing.assert_allclose(ssim(pred, target, gaussian=gaussian).numpy(), expected, atol=1e-8)
+
+
+def test_image_quality_keeps_uniform_ssim_and_batch_shape():
+    pred, target = _images(batch=4)
+    pred, target = torch.from_numpy(pred).reshape(2, 2, 32, 32), torch.from_numpy(target).reshape(2, 2, 32, 32)
+    quality = image_quality(pred, target)
+    assert {key: tuple(value.shape) for key, value in quality.items()} == {"psnr": (2, 2), "ssim": (2, 2), "nse": (2, 2)}
+    torch.testing.assert_close(quality["ssim"], ssim(pred, target, gaussian=False))
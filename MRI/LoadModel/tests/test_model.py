@@ -0,0 +1,134 @@
+import torch
+import pytest
+
+from conftest import model_config
+from model import Fullmodel, StackedFullmodel, apply_hashgrid_defaults, build_model, get_model_config, share_encoder
+from inference import make_coordinate_grid
+
+
+def _models(count, **mlp):
+    torch.manual_seed(0)
+    return share_encoder([build_model(model_config(**mlp)) for _ in range(count)])
+
+
+def test_get_model_config_round_trip():
+    config = model_config()
+    model = build_model(config)
+    rebuilt = build_model(get_model_config(model))
+    rebuilt.load_state_dict(model.state_dict())
+    coords = make_coordinate_grid(8, 8)
+    assert torch.equal(rebuilt(coords), model(coords))
+
+
+@pytest.mark.parametrize("activation", ["sine", "relu"])
+def test_stacked_matches_individual(activation):
+    models = _models(3, activation=activation)
+    stacked = StackedFullmodel(models)
+    coords = make_coordinate_grid(8, 8)
+    output = stacked(coords)
+    assert output.shape == (3, 64, 2)
+    for i, model in enumerate(models):
+        assert torch.allclose(output[i], model(coords), atol=1e-5)
+
+
+def test_stacked_rejects_different_encoders():
+    torch.manual_seed(0)
+    models = [build_model(model_config()) for _ in range(2)]
+    assert not torch.equal(models[0].encoder.B, models[1].encoder.B)
+    with pytest.raises(ValueError, match="identical encoders"):
+        StackedFullmodel(models)
+    # 共享编码器后可以堆叠，输出与各模型一致
+    stacked = StackedFullmodel(share_encoder(models))
+    coords = make_coordinate_grid(8, 8)
+    torch.testing.assert_close(stacked(coords)[1], models[1](coords), atol=1e-5, rtol=1e-5)
+
+
+def test_stacked_is_not_fullmodel():
+    stacked = StackedFullmodel(_models(2))
+    assert not isinstance(stacked, Fullmodel)
+    with pytest.raises(TypeError):
+        get_model_config(stacked)
+
+
+def test_unstack_round_trip(tmp_path):
+    from serving_format import load_inr, save_inr
+
+    stacked = StackedFullmodel(_models(2))
+    coords = make_coordinate_grid(8, 8)
+    output = stacked(coords)
+    for i, model in enumerate(stacked.unstack()):
+        assert isinstance(model, Fullmodel)
+        assert torch.allclose(model(coords), output[i], atol=1e-5)
+        path = str(tmp_path / f"slice{i}.inr")
+        save_inr(model, path, metadata={"slice_index": i})
+        assert torch.allclose(load_inr(path)(coords), output[i], atol=1e-5)
+
+
+def test_annealing_weights_follow_progress_and_checkpoint():
+    torch.manual_seed(0)
+    config = {**model_config(), "frequency_annealing": {"enabled": True, "num_bands": 4}}
+    model = build_model(config)
+    coords = make_coordinate_grid(8, 8)
+    full = model(coords)
+    assert model.encoder.annealing_weights() is None
+
+    model.set_anneal_progress(0.25)
+    weights = model.encoder.annealing_weights()
+    assert weights.shape == (64,) and weights.min() == 0 and weights.max() == 1
+    partial = model(coords)
+    assert not torch.allclose(partial, full)
+    torch.testing.assert_close(model.encoder(coords), model.encoder.encode(coords) * weights)
+
+    # 加载检查点时按保存的进度重新计算权重
+    restored = build_model(config)
+    restored.load_state_dict(model.state_dict())
+    torch.testing.assert_close(restored(coords), partial)
+    model.set_anneal_progress(1.0)
+    torch.testing.assert_close(model(coords), full)
+
+
+
+def test_encoding_cache_matches_uncached():
+    torch.manual_seed(0)
+    model = build_model(model_config())
+    coords = make_coordinate_grid(8, 8)
+    shifted = coords + 0.5
+    expected, expected_shifted = model(coords), model(shifted)
+
+    model.enable_encoding_cache()
+    torch.testing.assert_close(model(coords), expected)
+    # 数据加载器每步产生内容相同的新张量，按内容命中缓存；内容不同的坐标不能命中
+    torch.testing.assert_close(model(coords.clone()), expected)
+    torch.testing.assert_close(model(shifted), expected_shifted)
+    assert sum(len(entries) for entries in model.encoder._encoding_cache.values()) == 2
+
+    # 上限只够一个条目时按LRU淘汰
+    entry_bytes = model.encoder._encoding_cache_bytes // 2
+    model.enable_encoding_cache(entry_bytes)
+    model(coords)
+    torch.testing.assert_close(model(shifted), expected_shifted)
+    assert model.encoder._encoding_cache_bytes == entry_bytes
+
+    model.disable_encoding_cache()
+    torch.testing.assert_close(model(coords), expected)
+
+
+def test_hashgrid_uses_its_own_decoder_defaults():
+    defaults = {"mlp_hidden_features": 16, "mlp_hidden_layers": 1, "activation": "relu", "learning_rate": 1e-2}
+    config = {**model_config(hidden_features=64, hidden_layers=3), "learning_rate": 1e-4,
+              "hashgrid_defaults": defaults}
+    config["encoder"].update(encoding_mode="hashgrid", hash_levels=4, hash_log2_table_size=8)
+
+    effective = apply_hashgrid_defaults(config)
+    assert effective["learning_rate"] == 1e-2
+    assert config["mlp"]["mlp_hidden_features"] == 64 and config["learning_rate"] == 1e-4
+    restored = get_model_config(build_model(config))
+    assert restored["mlp"]["mlp_hidden_features"] == 16
+    assert restored["mlp"]["mlp_hidden_layers"] == 1
+    assert restored["mlp"]["activation"] == "relu"
+    # 还原的配置没有hashgrid_defaults，重建得到同样的结构
+    assert get_model_config(build_model(restored)) == restored
+
+    # fourier编码不受影响
+    fourier = {**model_config(hidden_features=64), "hashgrid_defaults": defaults}
+    assert get_model_config(build_model(fourier))["mlp"]["mlp_hidden_features"] == 64
@@ -0,0 +1,55 @@
+import sys
+
+import pytest
+import torch
+
+from conftest import model_config
+from model import build_model, get_model_config
+from inference import make_coordinate_grid
+from serving_format import save_inr
+import prune
+
+
+def test_prune_to_width_builds_dense_model():
+    torch.manual_seed(0)
+    model = build_model(model_config(hidden_features=32))
+    coords = make_coordinate_grid(8, 8)
+    with torch.no_grad():
+        teacher_output = model(coords)
+    pruned = prune.prune_to_width(model, teacher_output, coords, 16, finetune_steps=2, learning_rate=1e-5)
+    assert get_model_config(pruned)["mlp"]["mlp_hidden_features"] == 16
+    assert pruned(coords).shape == teacher_output.shape
+
+
+def test_prune_rejects_partitioned_experts():
+    model = build_model(model_config(experts=[2, 2]))
+    coords = make_coordinate_grid(8, 8)
+    with pytest.raises(ValueError, match="ExpertMLP"):
+        prune.prune_to_width(model, model(coords).detach(), coords, 16, finetune_steps=1, learning_rate=1e-5)
+
+
+@pytest.mark.parametrize("width", [0, 32, 64])
+def test_prune_rejects_widths_not_below_current(width):
+    model = build_model(model_config(hidden_features=32))
+    coords = make_coordinate_grid(8, 8)
+    with pytest.raises(ValueError, match="width"):
+        prune.prune_to_width(model, model(coords).detach(), coords, width, finetune_steps=1, learning_rate=1e-5)
+
+
+@pytest.mark.parametrize("widths", [["64"], ["16", "16"]])
+def test_cli_rejects_invalid_widths(monkeypatch, tmp_path, widths):
+    checkpoint = str(tmp_path / "model.inr")
+    save_inr(build_model(model_config(hidden_features=32)), checkpoint)
+    monkeypatch.setattr(sys, "argv", ["prune.py", "--checkpoint", checkpoint, "--model-dir", str(tmp_path / "out"),
+                                      "--config", str(tmp_path / "missing.yaml"), "--widths", *widths])
+    with pytest.raises(SystemExit):
+        prune.main()
+    assert not (tmp_path / "out").exists()
+
+
+def test_promote_must_be_a_pruned_width(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "argv", ["prune.py", "--checkpoint", "missing.pt", "--model-dir", str(tmp_path),
+                                      "--widths", "128", "64", "--promote", "96"])
+    with pytest.raises(SystemExit):
+        prune.main()
+    assert not (tmp_path / "info.json").exists()
@@ -0,0 +1,104 @@
+import pytest
+import torch
+
+from conftest import model_config
+from model import build_model
+from inference import make_coordinate_grid
+import serving_format
+from serving_format import ALIGNMENT, convert_checkpoint, load_inr, load_trained_model, read_inr_header, save_inr
+
+
+def _model(**mlp):
+    torch.manual_seed(0)
+    return build_model(model_config(**mlp)).eval()
+
+
+@pytest.mark.parametrize("mlp", [{}, {"activation": "relu"}, {"experts": [2, 2]}])
+def test_round_trip_is_exact(tmp_path, mlp):
+    model = _model(**mlp)
+    path = str(tmp_path / "model.inr")
+    save_inr(model, path, metadata={"psnr": 35.0})
+    loaded = load_inr(path)
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(loaded.state_dict()[name], tensor), name
+    coords = make_coordinate_grid(8, 8)
+    with torch.no_grad():
+        assert torch.equal(loaded(coords), model(coords))
+
+    header = read_inr_header(path)
+    assert header["metadata"] == {"psnr": 35.0}
+    assert all(info["offset"] % ALIGNMENT == 0 for info in header["tensors"].values())
+
+
+def test_load_maps_parameters_from_the_file(tmp_path, monkeypatch):
+    model = _model()
+    path = str(tmp_path / "model.inr")
+    save_inr(model, path)
+    # 加载时模型在meta设备上构建，不分配、不初始化参数
+    built_on_meta = []
+
+    def spy_build_model(config):
+        built = build_model(config)
+        built_on_meta.append(all(parameter.is_meta for parameter in built.parameters()))
+        return built
+
+    monkeypatch.setattr(serving_format, "build_model", spy_build_model)
+    loaded = load_inr(path)
+    assert built_on_meta == [True]
+    tensors = read_inr_header(path)["tensors"]
+    parameters = dict(loaded.named_parameters())
+    assert not any(tensor.is_meta for tensor in loaded.state_dict().values())
+    # 每个参数都是映射缓冲区中对应偏移处的视图（没有另外分配的副本）
+    base_name = next(iter(tensors))
+    base = parameters[base_name].data_ptr() - tensors[base_name]["offset"]
+    for name, parameter in parameters.items():
+        assert parameter.data_ptr() - base == tensors[name]["offset"], name
+        assert parameter.requires_grad == dict(model.named_parameters())[name].requires_grad, name
+
+
+def test_hashgrid_round_trip_restores_non_persistent_buffers(tmp_path):
+    torch.manual_seed(0)
+    config = model_config(encoding_mode="hashgrid", activation="relu")
+    config["encoder"].update(hash_levels=4, hash_log2_table_size=8, hash_finest_resolution=32)
+    model = build_model(config).eval()
+    path = str(tmp_path / "model.inr")
+    save_inr(model, path)
+    loaded = load_inr(path)
+    assert torch.equal(loaded.encoder.corner_offsets, model.encoder.corner_offsets)
+    coords = make_coordinate_grid(8, 8)
+    with torch.no_grad():
+        assert torch.equal(loaded(coords), model(coords))
+
+
+def test_half_precision_keeps_encoder_in_fp32(tmp_path):
+    model = _model()
+    path = str(tmp_path / "model.inr")
+    save_inr(model, path, dtype="float16")
+    tensors = read_inr_header(path)["tensors"]
+    assert tensors["encoder.B"]["dtype"] == "float32"
+    assert {info["dtype"] for name, info in tensors.items() if name.startswith("net.")} == {"float16"}
+    loaded = load_inr(path)
+    assert torch.equal(loaded.encoder.B, model.encoder.B)
+    coords = make_coordinate_grid(8, 8)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded(coords), model(coords), atol=5e-2, rtol=5e-2)
+
+
+def test_convert_checkpoint_matches_training_checkpoint(tmp_path):
+    config = model_config()
+    model = _model()
+    checkpoint_path = str(tmp_path / "best_model1.pt")
+    torch.save({"model_state_dict": model.state_dict(), "psnr": 33.5}, checkpoint_path)
+    output_path = convert_checkpoint(checkpoint_path, config=config)
+    assert output_path.endswith("best_model1.inr")
+    assert read_inr_header(output_path)["metadata"] == {"source": "best_model1.pt", "psnr": 33.5}
+    coords = make_coordinate_grid(8, 8)
+    with torch.no_grad():
+        assert torch.equal(load_trained_model(output_path)(coords), load_trained_model(checkpoint_path, config)(coords))
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "model.inr"
+    path.write_bytes(b"not an inr file")
+    with pytest.raises(ValueError):
+        load_inr(str(path))
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+import yaml
+
+from conftest import model_config, write_dataset
+import start
+
+
+def _run(tmp_path, background):
+    """在tmp_path中用小型配置运行start.main，返回结果目录"""
+    run_dir = tmp_path / ("background" if background else "sync")
+    run_dir.mkdir()
+    config = {
+        **model_config(),
+        "gpu_id": -1,
+        "dataset_path": write_dataset(str(run_dir / "dataset.hdf5")),
+        "prediction_mode": "kspace", "supervision_mode": "kspace_csm",
+        "use_penalty": True, "use_tv": True, "lambda_tv": 1e-5,
+        "learning_rate": 1e-3, "epochs": 6, "save_interval": 2,
+        "metric_interval": 1, "metric_background": background,
+        "train_indices": [1], "result_dir": str(run_dir),
+    }
+    with open(run_dir / "config.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    try:
+        torch.manual_seed(0)
+        start.main()
+    finally:
+        os.chdir(cwd)
+    return next(path for path in run_dir.iterdir() if (path / "checkpoints").is_dir())
+
+
+def _load(path):
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def test_background_metrics_save_the_evaluated_state(tmp_path):
+    sync_dir = _run(tmp_path, background=False)
+    background_dir = _run(tmp_path, background=True)
+
+    names = sorted(os.listdir(sync_dir / "checkpoints"))
+    assert "best_model.pt" in names and "checkpoint_epoch_2.pt" in names
+    assert names == sorted(os.listdir(background_dir / "checkpoints"))
+    for name in names:
+        expected, actual = _load(sync_dir / "checkpoints" / name), _load(background_dir / "checkpoints" / name)
+        assert actual["epoch"] == expected["epoch"], name
+        assert actual["psnr"] == pytest.approx(expected["psnr"]), name
+        for key, value in expected["model_state_dict"].items():
+            torch.testing.assert_close(actual["model_state_dict"][key], value, msg=f"{name}: {key}")
+
+    history = [np.load(path / ".." / "train_psnr_history.npz")["train_psnr_history"]
+               for path in (sync_dir, background_dir)]
+    np.testing.assert_allclose(history[1], history[0], rtol=1e-5)
+
+
+def test_snapshot_is_independent_of_later_steps():
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.1)
+    model(torch.ones(1, 4)).sum().backward()
+    optimizer.step()
+    state = start.snapshot_training_state(model, optimizer)
+    weight = model.weight.detach().clone()
+    exp_avg = optimizer.state[model.weight]["exp_avg"].clone()
+
+    model(torch.ones(1, 4)).sum().backward()
+    optimizer.step()
+    assert torch.equal(state["model"]["weight"], weight)
+    assert torch.equal(state["optimizer"]["state"][0]["exp_avg"], exp_avg)
+    assert not torch.equal(model.weight, weight)
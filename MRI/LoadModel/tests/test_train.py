@@ -0,0 +1,54 @@
+import torch
+import pytest
+from torch.utils.data import Subset
+
+from conftest import model_config
+from dataset import MRIDataset, make_data_loader
+from model import build_model
+from train import MetricScheduler, train_epoch_image
+
+
+def test_should_evaluate():
+    scheduler = MetricScheduler(interval=10, background=False)
+    evaluated = [epoch for epoch in range(25) if scheduler.should_evaluate(epoch, 25, save_interval=4)]
+    assert evaluated == [3, 7, 9, 11, 15, 19, 23, 24]
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_scheduled_metrics_match_inline(dataset_path, background):
+    loader = make_data_loader(Subset(MRIDataset(dataset_path), [1]))
+
+    def run(scheduler):
+        torch.manual_seed(0)
+        model = build_model(model_config())
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+        results = []
+        for epoch in range(3):
+            loss, psnr, ssim, nse = train_epoch_image(model, loader, optimizer, 'cpu', supervision_mode="kspace_csm",
+                                                      metric_scheduler=scheduler)
+            if scheduler is None:
+                results.append((epoch, {"psnr": float(psnr), "ssim": float(ssim), "nse": float(nse)}, None))
+            else:
+                assert psnr is None
+                scheduler.submit(epoch)
+                results.extend(scheduler.poll())
+        if scheduler is not None:
+            results.extend(scheduler.finish())
+        return results
+
+    inline = run(None)
+    scheduled = run(MetricScheduler(background=background))
+    assert [epoch for epoch, _, _ in scheduled] == [0, 1, 2]
+    for (_, expected, _), (_, actual, _) in zip(inline, scheduled):
+        for key in expected:
+            assert actual[key] == pytest.approx(expected[key], rel=1e-5)
+
+
+def test_loss_only_epoch(dataset_path):
+    loader = make_data_loader(Subset(MRIDataset(dataset_path), [0]))
+    model = build_model(model_config())
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    loss, psnr, ssim, nse = train_epoch_image(model, loader, optimizer, 'cpu', supervision_mode="kspace_csm",
+                                              compute_metrics=False)
+    assert isinstance(loss, float)
+    assert psnr is None and ssim is None and nse is None
@@ -3,13 +3,16 @@
 # 1. 预测结果可视化
 # 2. 图像质量评估（PSNR, SSIM, NSE）
 # 3. 训练循环实现
+# 4. 指标调度：按间隔评估，指标在后台线程中由分离的预测快照计算
 
 import torch
 import numpy as np
 import matplotlib.pyplot as plt
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from torchmetrics.functional import peak_signal_noise_ratio
-from skimage.metrics import structural_similarity as ssim_metric
+from kspace_ops import forward_sampled, gather_sampled, mask_index_to, sample_mask_index, sampled_error
+from metrics import image_quality, nse, psnr, ssim
 
 def vis_pre(pred_img_complex):
     """可视化预测结果的统计信息
@@ -176,60 +179,239 @@ def final_output_image(pred_kspace, gt_kspace, mask):
     return final_image_np
 
 def compute_psnr(img1, img2):
-    """计算峰值信噪比（PSNR）
+    """计算峰值信噪比（PSNR，数据范围为1）
     
     Args:
-        img1, img2: 待比较的两个图像
+        img1, img2: 待比较的两个图像（张量或数组，(H, W)或批量的(B, H, W)）
     
     Returns:
         PSNR值
     """
-    if isinstance(img1, np.ndarray):
-        img1 = torch.from_numpy(img1).float()
-    if isinstance(img2, np.ndarray):
-        img2 = torch.from_numpy(img2).float()
-    return peak_signal_noise_ratio(img1, img2, data_range=1.0)
+    return psnr(img1, img2, data_range=1.0)
 
 def compute_ssim(img1, img2):
-    """计算结构相似性（SSIM）
+    """计算结构相似性（SSIM，7x7均匀窗口，数据范围为img2的max - min）
     
     Args:
-        img1, img2: 待比较的两个图像
+        img1, img2: 待比较的两个图像（张量或数组，(H, W)或批量的(B, H, W)）
     
     Returns:
         SSIM值
     """
-    return ssim_metric(img1, img2, data_range=img2.max() - img2.min())
+    return ssim(img1, img2, gaussian=False)
 
 def compute_nse(img1, img2):
     """计算归一化平方误差（NSE）
     
     Args:
-        img1, img2: 待比较的两个图像
+        img1, img2: 待比较的两个图像（张量或数组，(H, W)或批量的(B, H, W)）
     
     Returns:
         NSE值
     """
-    numerator = np.sum((img1 - img2) ** 2)
-    denominator = np.sum(img2 ** 2)
-    return numerator / denominator
+    return nse(img1, img2)
 
 def get_image_from_prediction(pred_flat, H, W):
     """从预测结果重构图像
     
     Args:
-        pred_flat: 预测的平坦张量
+        pred_flat: 预测的平坦张量（[H*W, 2]，或堆叠模型的[B, H*W, 2]）
         H, W: 目标图像的高度和宽度
     
     Returns:
-        重构的复数图像
+        重构的复数图像（[H, W]或[B, H, W]）
     """
-    img_complex = torch.view_as_complex(pred_flat.view(H, W, 2))
+    img_complex = torch.view_as_complex(pred_flat.reshape(*pred_flat.shape[:-2], H, W, 2))
     return img_complex
 
-def train_epoch_image(model, dataloader, optimizer, device, supervision_mode="image", lambda_tv=1e-5):
+def _same_mask_index(mask_indices):
+    """判断批次中各切片的采样索引是否相同（相同时可以一次性批量计算）"""
+    first = mask_indices[0]
+    return all(all(torch.equal(first[key], other[key]) for key in first) for other in mask_indices[1:])
+
+def kspace_csm_loss(pred_img_complex, batch, device, lambda_tv=1e-5):
+    """kspace_csm监督模式的损失
+    
+    线圈K空间MSE + 背景惩罚 + 总变差正则化。批次包含B个切片时（堆叠模型），
+    线圈加权和FFT对所有切片批量计算，返回各切片损失之和（每个切片的网络得到与单独训练相同的梯度）。
+    
+    Args:
+        pred_img_complex: 预测的复数图像 [H, W]，或B个切片的 [B, H, W]
+        batch: 数据加载器返回的批次（包含gt_csm、gt_loss_csm_kspace、mask）
+        device: 计算设备
+        lambda_tv: 总变差正则化系数
+    
+    Returns:
+        总损失
+    """
+    # 获取线圈灵敏度图 [B, C, H, W]
+    gt_csm = batch["gt_csm"].to(device, non_blocking=True)
+    H, W = pred_img_complex.shape[-2:]
+    # 线圈数由gt_csm决定（物理线圈或线圈压缩后的虚拟线圈），广播代替复制
+    pred_img_complex_expanded = pred_img_complex.reshape(-1, 1, H, W)
+    num_slices = pred_img_complex_expanded.shape[0]
+
+    # 计算背景惩罚
+    mask_real = torch.where(gt_csm.real == 0,
+                            torch.tensor(1.0, device=gt_csm.device),
+                            torch.tensor(0.0, device=gt_csm.device))
+    mask_imag = torch.where(gt_csm.imag == 0,
+                            torch.tensor(1.0, device=gt_csm.device),
+                            torch.tensor(0.0, device=gt_csm.device))
+
+    penalty_real = pred_img_complex_expanded.real * mask_real
+    penalty_imag = pred_img_complex_expanded.imag * mask_imag
+
+    background_penalty_loss = (penalty_real ** 2).sum() + (penalty_imag ** 2).sum()
+
+    # 计算线圈图像
+    csm_pred_img_complex = pred_img_complex_expanded * gt_csm
+
+    # 计算K空间损失（各切片分别归一化后求和）
+    gt_kspace = batch["gt_loss_csm_kspace"].to(device, non_blocking=True)
+    if "mask_index" in batch:
+        # 只在采样位置计算误差（MRIDataset提供的稀疏索引），Cartesian线采样时只计算采样线的K空间
+        mask_indices = [mask_index_to(sample_mask_index(batch, i), device) for i in range(num_slices)]
+        num_coils = gt_csm.shape[1]
+        if _same_mask_index(mask_indices):
+            mask_index = mask_indices[0]
+            pred_sampled = forward_sampled(csm_pred_img_complex, mask_index)
+            mse_loss_k = sampled_error(pred_sampled, gather_sampled(gt_kspace, mask_index), mask_index, num_coils)
+        else:
+            mse_loss_k = sum(
+                sampled_error(forward_sampled(csm_pred_img_complex[i], mask_index),
+                              gather_sampled(gt_kspace[i], mask_index), mask_index, num_coils)
+                for i, mask_index in enumerate(mask_indices))
+    else:
+        pred_kspace = torch.fft.fft2(csm_pred_img_complex)
+        pred_real = torch.view_as_real(pred_kspace)
+        gt_real = torch.view_as_real(gt_kspace)
+        diff = pred_real - gt_real
+        error = (diff ** 2).sum(dim=-1)
+
+        mask = batch["mask"].to(device, non_blocking=True)
+        if mask.ndim == 2:
+            mask = mask.unsqueeze(0)
+        mask = mask.reshape(num_slices, -1, H, W)
+        mse_loss_k = ((error * mask).sum(dim=(1, 2, 3)) / (mask.sum(dim=(1, 2, 3)) + 1e-6)).sum()
+
+    # 总损失
+    mse_loss = 1 * mse_loss_k + 0.01 * background_penalty_loss
+
+    # 计算总变差损失（每个切片取平均后求和）
+    mag = torch.abs(pred_img_complex).reshape(num_slices, H, W)
+    tv_h = torch.mean(torch.abs(mag[:, :, 1:] - mag[:, :, :-1]), dim=(1, 2))
+    tv_v = torch.mean(torch.abs(mag[:, 1:, :] - mag[:, :-1, :]), dim=(1, 2))
+    tv_loss = (tv_h + tv_v).sum()
+
+    # 计算总损失
+    lambda_tv_tensor = torch.tensor(float(lambda_tv), device=device, dtype=mse_loss.dtype)
+    loss = mse_loss + lambda_tv_tensor * tv_loss
+    return loss
+
+def image_metrics(pred_img_complex, gt_img):
+    """逐切片计算预测图像的PSNR、SSIM和NSE之和（批量计算，结果留在设备上）
+
+    Args:
+        pred_img_complex: 预测的复数图像（[H, W]或[B, H, W]）
+        gt_img: 真实图像（[B, H, W]）
+
+    Returns:
+        (psnr之和, ssim之和, nse之和, 切片数)
+    """
+    gt_mag = torch.abs(gt_img).detach()
+    pred_mag = torch.abs(pred_img_complex).detach().reshape(gt_mag.shape)
+    quality = image_quality(pred_mag, gt_mag)
+    return quality["psnr"].sum(), quality["ssim"].sum(), quality["nse"].sum(), gt_mag.shape[0]
+
+
+def _snapshot_metrics(snapshots):
+    """由一轮中收集的预测快照计算每个切片的平均指标"""
+    total_psnr, total_ssim, total_nse, count = 0, 0, 0, 0
+    for pred_img_complex, gt_img in snapshots:
+        psnr, ssim, nse, num_slices = image_metrics(pred_img_complex, gt_img)
+        total_psnr += psnr
+        total_ssim += ssim
+        total_nse += nse
+        count += num_slices
+    return {"psnr": float(total_psnr / count), "ssim": float(total_ssim / count), "nse": float(total_nse / count)}
+
+
+class MetricScheduler:
+    """训练指标的调度器
+
+    每interval轮评估一次（保存间隔的整数倍和最后一轮总会评估），其余轮只计算损失。
+    评估轮中train_epoch_image只收集分离的预测快照（collect），submit把PSNR/SSIM/NSE的计算
+    交给后台线程，训练继续下一轮；完成的结果由poll/finish按轮次顺序取回。
+
+    参数:
+        interval: 评估间隔（轮）
+        background: 是否在后台线程中计算；False时在submit中同步计算
+        max_pending: 允许同时等待计算的轮数，超过时submit等待最早的一轮完成，避免快照堆积
+    """
+    def __init__(self, interval=1, background=True, max_pending=2):
+        self.interval = max(int(interval), 1)
+        self.background = background
+        self.max_pending = max(int(max_pending), 1)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics") if background else None
+        self._snapshots = []
+        self._pending = deque()
+
+    def should_evaluate(self, epoch, num_epochs, save_interval=None):
+        """第epoch轮（从0开始）是否需要计算指标"""
+        step = epoch + 1
+        if step == num_epochs or step % self.interval == 0:
+            return True
+        return bool(save_interval) and step % save_interval == 0
+
+    def collect(self, pred_img_complex, gt_img):
+        """收集一个批次的预测快照（只分离计算图，不拷贝到CPU；预测张量之后不会被原地修改）"""
+        self._snapshots.append((pred_img_complex.detach(), gt_img.detach()))
+
+    def submit(self, epoch, payload=None):
+        """提交本轮收集的快照
+
+        Args:
+            epoch: 轮次
+            payload: 与结果一起返回的附加数据（例如该轮的模型状态快照）
+        """
+        snapshots, self._snapshots = self._snapshots, []
+        if self._executor is None:
+            future = Future()
+            future.set_result(_snapshot_metrics(snapshots))
+        else:
+            if len(self._pending) >= self.max_pending:
+                self._pending[0][1].result()
+            future = self._executor.submit(_snapshot_metrics, snapshots)
+        self._pending.append((epoch, future, payload))
+
+    def poll(self):
+        """返回已完成的结果列表 [(epoch, metrics, payload)]，按轮次顺序"""
+        results = []
+        while self._pending and self._pending[0][1].done():
+            epoch, future, payload = self._pending.popleft()
+            results.append((epoch, future.result(), payload))
+        return results
+
+    def finish(self):
+        """等待所有提交的计算完成并返回剩余结果，之后关闭后台线程"""
+        results = []
+        while self._pending:
+            epoch, future, payload = self._pending.popleft()
+            results.append((epoch, future.result(), payload))
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        return results
+
+
+def train_epoch_image(model, dataloader, optimizer, device, supervision_mode="image", lambda_tv=1e-5,
+                      compute_metrics=True, metric_scheduler=None):
     """训练一个epoch
     
+    批次包含多个切片时，model需要是切片数相同的StackedFullmodel（每个切片一个网络），
+    所有切片在一步中同时训练；单个Fullmodel只能训练batch_size=1的批次。
+    
     Args:
         model: 神经网络模型
         dataloader: 数据加载器
@@ -237,95 +419,58 @@ def train_epoch_image(model, dataloader, optimizer, device, supervision_mode="im
         device: 计算设备
         supervision_mode: 监督模式
         lambda_tv: 总变差正则化系数
+        compute_metrics: False时只计算损失，返回的指标为None
+        metric_scheduler: MetricScheduler，给定时只向其收集预测快照（由调用者submit），返回的指标为None
     
     Returns:
-        loss: 平均损失值
-        psnr: 平均PSNR值
-        ssim: 平均SSIM值
-        nse: 平均NSE值
+        loss: 每个切片的平均损失值
+        psnr: 每个切片的平均PSNR值
+        ssim: 每个切片的平均SSIM值
+        nse: 每个切片的平均NSE值
     """
     model.train()
     total_loss, total_psnr, total_ssim, total_nse = 0, 0, 0, 0
     count = 0
+    inline_metrics = compute_metrics and metric_scheduler is None
     
     for batch in dataloader:
-        # 获取输入数据
-        coords = batch['coords'][0].to(device)
-        gt_img = batch['gt_img'][0].to(device)
-        mask = batch['mask'][0].to(device)
-        H, W = gt_img.shape
+        # 获取输入数据（坐标网格对所有切片相同）
+        coords = batch['coords'][0].to(device, non_blocking=True)
+        gt_img = batch['gt_img'].to(device, non_blocking=True)
+        num_slices = gt_img.shape[0]
+        H, W = gt_img.shape[-2:]
+        if num_slices != getattr(model, "num_models", 1):
+            raise ValueError(f"Batch of {num_slices} slices requires a StackedFullmodel with {num_slices} models")
 
         # 前向传播
         pred_flat = model(coords)
         pred_img_complex = get_image_from_prediction(pred_flat, H, W)
 
         if supervision_mode == "kspace_csm":
-            # 获取线圈灵敏度图
-            gt_csm = batch["gt_csm"].to(device)
-            pred_img_complex_expanded = pred_img_complex.unsqueeze(0).unsqueeze(0).repeat(1, 12, 1, 1)
-
-            # 计算背景惩罚
-            mask_real = torch.where(gt_csm.real == 0,
-                                    torch.tensor(1.0, device=gt_csm.device),
-                                    torch.tensor(0.0, device=gt_csm.device))
-            mask_imag = torch.where(gt_csm.imag == 0,
-                                    torch.tensor(1.0, device=gt_csm.device),
-                                    torch.tensor(0.0, device=gt_csm.device))
-
-            penalty_real = pred_img_complex.real * mask_real
-            penalty_imag = pred_img_complex.imag * mask_imag
-
-            background_penalty_loss = (penalty_real ** 2).sum() + (penalty_imag ** 2).sum()
-
-            # 计算线圈图像
-            csm_pred_img_complex = pred_img_complex_expanded * gt_csm
-
-            # 计算K空间损失
-            pred_kspace = torch.fft.fft2(csm_pred_img_complex)
-            gt_kspace = batch["gt_loss_csm_kspace"].to(device)
-            pred_real = torch.view_as_real(pred_kspace)
-            gt_real = torch.view_as_real(gt_kspace)
-            diff = pred_real - gt_real
-            error = (diff ** 2).sum(dim=-1)
-
-            mask = batch["mask"].to(device)
-            if mask.ndim == 2:
-                mask = mask.unsqueeze(0)
-            mse_loss_k = (error * mask).sum() / (mask.sum() + 1e-6)
-
-            # 总损失
-            mse_loss = 1 * mse_loss_k + 0.01 * background_penalty_loss
+            loss = kspace_csm_loss(pred_img_complex, batch, device, lambda_tv=lambda_tv)
         else:
             raise ValueError("Unsupport Supervision_mode")
 
-        # 计算总变差损失
-        mag = torch.abs(pred_img_complex)
-        if mag.dim() > 2:
-            mag = mag.squeeze(0)
-        tv_h = torch.mean(torch.abs(mag[:, 1:] - mag[:, :-1]))
-        tv_v = torch.mean(torch.abs(mag[1:, :] - mag[:-1, :]))
-        tv_loss = tv_h + tv_v
-
-        # 计算总损失
-        lambda_tv_tensor = torch.tensor(float(lambda_tv), device=device, dtype=mse_loss.dtype)
-        loss = mse_loss + lambda_tv_tensor * tv_loss
-
         # 反向传播
         optimizer.zero_grad()
         loss.backward()
         optimizer.step()
 
-        # 计算评估指标
-        total_loss += loss.item()
-        pred_img_np = torch.abs(pred_img_complex).detach().cpu().numpy()
-        gt_img_np = torch.abs(gt_img).detach().cpu().numpy()
+        # 损失在设备上累加，轮末才同步一次
+        total_loss += loss.detach()
+        count += num_slices
 
-        total_psnr += compute_psnr(pred_img_np, gt_img_np)
-        total_ssim += compute_ssim(pred_img_np, gt_img_np)
-        total_nse += compute_nse(pred_img_np, gt_img_np)
-
-        count += 1
+        # 计算评估指标（逐切片）
+        if inline_metrics:
+            psnr, ssim, nse, _ = image_metrics(pred_img_complex, gt_img)
+            total_psnr += psnr
+            total_ssim += ssim
+            total_nse += nse
+        elif compute_metrics:
+            metric_scheduler.collect(pred_img_complex, gt_img)
 
     # 返回平均指标
-    return total_loss / count, total_psnr / count, total_ssim / count, total_nse / count
-
+    loss = float(total_loss) / count
+    if not inline_metrics:
+        return loss, None, None, None
+    return loss, total_psnr / count, total_ssim / count, total_nse / count
@@ -11,6 +11,8 @@ import numpy as np
 
 import matplotlib.pyplot as plt
 
+from inference import evaluate_tiled
+
 
 def get_image_from_prediction(pred_flat, H, W):
     """从预测结果重构图像
@@ -26,7 +28,7 @@ def get_image_from_prediction(pred_flat, H, W):
     return img_complex
 
 
-def save_epoch_results_as_png(model, sample, device, epoch, save_dir, supervision_mode="image"):
+def save_epoch_results_as_png(model, sample, device, epoch, save_dir, supervision_mode="image", memory_budget=None):
     """保存每个epoch的训练结果
     
     Args:
@@ -36,6 +38,7 @@ def save_epoch_results_as_png(model, sample, device, epoch, save_dir, supervisio
         epoch: 当前epoch
         save_dir: 保存目录
         supervision_mode: 监督模式
+        memory_budget: 分块推理的内存预算（字节），None表示自动选择
     """
     # 创建保存目录
     epoch_dir = os.path.join(save_dir, f"epoch_{epoch + 1}")
@@ -45,9 +48,8 @@ def save_epoch_results_as_png(model, sample, device, epoch, save_dir, supervisio
     model.eval()
     coords = sample['coords'].to(device)
     
-    # 进行预测
-    with torch.no_grad():
-        pred_flat = model(coords)
+    # 分块进行预测
+    pred_flat = evaluate_tiled(model, coords, memory_budget=memory_budget)
     
     H, W = sample['gt_img'].shape
     
@@ -83,7 +85,7 @@ def save_epoch_results_as_png(model, sample, device, epoch, save_dir, supervisio
         raise ValueError("Unsupport Prediction_mode")
 
 
-def save_best_image(model, sample, device, psnr, ssim, save_dir, supervision_mode="image"):
+def save_best_image(model, sample, device, psnr, ssim, save_dir, supervision_mode="image", memory_budget=None):
     """保存最佳训练结果
     
     Args:
@@ -94,14 +96,14 @@ def save_best_image(model, sample, device, psnr, ssim, save_dir, supervision_mod
         ssim: 结构相似性
         save_dir: 保存目录
         supervision_mode: 监督模式
+        memory_budget: 分块推理的内存预算（字节），None表示自动选择
     """
     os.makedirs(save_dir, exist_ok=True)
     model.eval()
     coords = sample['coords'].to(device)
     
-    # 进行预测
-    with torch.no_grad():
-        pred_flat = model(coords)
+    # 分块进行预测
+    pred_flat = evaluate_tiled(model, coords, memory_budget=memory_budget)
     
     H, W = sample['gt_img'].shape
     
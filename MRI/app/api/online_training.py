@@ -48,6 +48,8 @@ plt.rcParams['ytick.labelsize'] = 10
 from MRI.app.services.auth import get_current_user
 from MRI.app.models.user import User
 from MRI.app.services.model_service import model_service
+from MRI.LoadModel.inference import evaluate_tiled
+from MRI.LoadModel.metrics import nse, psnr, ssim
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -214,28 +216,49 @@ def train_epoch_image(model, dataloader, optimizer, device, supervision_mode='im
         loss.backward()
         optimizer.step()
         
-        # 计算指标
+        # 计算指标（逐图像批量计算，在设备上累加，轮末才同步）
         with torch.no_grad():
-            total_loss += loss.item()
-            # 简化的PSNR计算
-            mse = torch.mean((pred - gt_img) ** 2)
-            psnr = 20 * torch.log10(1.0 / torch.sqrt(mse))
-            total_psnr += psnr.item()
-            # 简化的SSIM计算（这里只是示例，实际应该使用proper SSIM）
-            total_ssim += 1.0 - mse.item()
-            # NSE (Normalized Square Error)
-            total_nse += mse.item() / torch.mean(gt_img ** 2).item()
+            total_loss += loss.detach()
+            total_psnr += psnr(pred, gt_img).mean()
+            total_ssim += ssim(pred, gt_img, gaussian=False).mean()
+            total_nse += nse(pred, gt_img).mean()
         
         batch_count += 1
     
     # 计算平均值
-    avg_loss = total_loss / batch_count
-    avg_psnr = total_psnr / batch_count
-    avg_ssim = total_ssim / batch_count
-    avg_nse = total_nse / batch_count
+    avg_loss = float(total_loss) / batch_count
+    avg_psnr = float(total_psnr) / batch_count
+    avg_ssim = float(total_ssim) / batch_count
+    avg_nse = float(total_nse) / batch_count
     
     return avg_loss, avg_psnr, avg_ssim, avg_nse
 
+def warm_start(model, init_path):
+    """从元学习初始化（meta_init.py --target online生成）加载初始权重
+    
+    Args:
+        model: 在线训练的模型
+        init_path: 初始化文件路径，相对路径按模型保存目录解析
+        
+    Returns:
+        是否成功加载
+    """
+    path = Path(init_path)
+    if not path.is_absolute():
+        path = MODELS_DIR / path
+    if not path.exists():
+        logger.warning(f"初始化文件不存在，使用随机初始化: {path}")
+        return False
+    checkpoint = torch.load(str(path), map_location="cpu", weights_only=True)
+    state_dict = checkpoint.get("model_state_dict", checkpoint)
+    try:
+        model.load_state_dict(state_dict)
+    except RuntimeError as e:
+        logger.warning(f"初始化与模型结构不一致，使用随机初始化: {e}")
+        return False
+    logger.info(f"从元学习初始化启动: {path}")
+    return True
+
 def train_model_background(task_id: str, image_path: str, config: Dict[str, Any], user_id: int):
     """在后台执行模型训练
     
@@ -301,7 +324,10 @@ def train_model_background(task_id: str, image_path: str, config: Dict[str, Any]
             mlp_hidden_layers=config["mlp"]["mlp_hidden_layers"],
             omega_0=config["mlp"]["omega_0"],
             activation=config["mlp"]["activation"]
-        ).to(device)
+        )
+        if config.get("init_path"):
+            warm_start(model, config["init_path"])
+        model = model.to(device)
         
         # 创建优化器
         optimizer = torch.optim.Adam(model.parameters(), lr=config["learning_rate"])
@@ -446,7 +472,8 @@ async def start_training(
     omega_0: float = Form(30.0),
     activation: str = Form("sine"),
     supervision_mode: str = Form("image"),
-    lambda_tv: float = Form(1e-5)
+    lambda_tv: float = Form(1e-5),
+    init_path: Optional[str] = Form(None)
 ):
     """启动在线训练
     
@@ -483,6 +510,7 @@ async def start_training(
             "use_gpu": use_gpu,
             "supervision_mode": supervision_mode,
             "lambda_tv": lambda_tv,
+            "init_path": init_path,
             "encoder": {
                 "encoding_mode": encoder_mode,
                 "in_features": in_features,
@@ -941,8 +969,8 @@ def save_epoch_results_as_png(model, data, device, epoch, output_dir, supervisio
         coords = data['coords'].to(device)
         gt_img = data['gt_img'].to(device)
         
-        # 预测
-        pred = model(coords).view(gt_img.shape)
+        # 分块预测
+        pred = evaluate_tiled(model, coords).view(gt_img.shape)
         
         # 保存结果
         pred_np = pred.cpu().numpy()
@@ -976,8 +1004,8 @@ def save_best_image(model, data, device, psnr, ssim, output_dir, supervision_mod
         coords = data['coords'].to(device)
         gt_img = data['gt_img'].to(device)
         
-        # 预测
-        pred = model(coords).view(gt_img.shape)
+        # 分块预测
+        pred = evaluate_tiled(model, coords).view(gt_img.shape)
         
         # 保存结果
         pred_np = pred.cpu().numpy()
@@ -6,7 +6,7 @@
 包含图像重建相关的接口
 """
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, status
+from fastapi import APIRouter, UploadFile, File, Form, Body, HTTPException, Depends, status
 from fastapi.responses import JSONResponse
 from typing import Optional, List, Dict, Any
 import logging
@@ -50,6 +50,39 @@ async def get_available_models():
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"获取模型列表失败: {str(e)}")
 
+# 批量渲染切片堆栈
+@router.post("/stack")
+async def reconstruct_stack(
+    model_ids: List[str] = Body(..., embed=True),
+    height: int = Body(256),
+    width: int = Body(256),
+    current_user: User = Depends(get_current_user)
+):
+    """一次渲染多个切片模型（切片堆栈查看），结构相同的fp32模型批量求值"""
+    if not model_ids:
+        raise HTTPException(status_code=400, detail="model_ids不能为空")
+    try:
+        start_time = datetime.now()
+        images = model_service.predict_stack(model_ids, height=height, width=width)
+        execution_time = (datetime.now() - start_time).total_seconds()
+        
+        results = {}
+        for model_id, image in images.items():
+            buffered = io.BytesIO()
+            Image.fromarray((image * 255).astype(np.uint8)).save(buffered, format="PNG")
+            results[model_id] = base64.b64encode(buffered.getvalue()).decode()
+        
+        return {
+            "success": True,
+            "reconstructed_images": results,
+            "execution_time": execution_time
+        }
+    except Exception as e:
+        logger.error(f"批量渲染切片堆栈时出错: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"批量渲染失败: {str(e)}")
+
 # 提交重建任务
 @router.post("/")
 async def reconstruct_image(
@@ -21,11 +21,15 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 # 导入原有的模型和工具函数
 from MRI.LoadModel.model import Fullmodel
+from MRI.LoadModel.inference import (InferenceEngine, ModelStack, build_engine, make_coordinate_grid,
+                                     DEFAULT_MIN_PSNR)
 
 # 为了兼容性，将 MRI.LoadModel 模块设置为可通过 'model' 名称访问
 import sys
 import MRI.LoadModel.model
 sys.modules['model'] = MRI.LoadModel.model
+from MRI.LoadModel.model import build_model
+from MRI.LoadModel.serving_format import load_inr, SERVING_SUFFIX
 
 # 自定义函数，用于从模型输出生成图像
 def get_image_from_prediction(prediction):
@@ -75,6 +79,11 @@ class ModelService:
         self.models_dir = Path(__file__).resolve().parent.parent / "models"
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.loaded_models = {}  # 缓存已加载的模型
+        self.inference_engines = {}  # 缓存冻结后的推理引擎
+        self.model_stacks = {}  # 缓存多模型批量推理的权重堆叠
+        self.inference_backend = "jit"  # 推理引擎后端：jit/compile/folded/eager
+        self.render_memory_budget = None  # 分块推理内存预算（字节），None表示根据可用内存自动选择
+        self.default_precision = "fp32"  # 推理精度，可在模型info.json的inference.precision中单独设置
         
         logger.info(f"ModelService initialized. Using device: {self.device}")
         logger.info(f"Models directory: {self.models_dir}")
@@ -278,16 +287,79 @@ class ModelService:
         logger.warning(f"No metrics found for model {model_id}")
         return {}
     
-    def load_model(self, model_id: str) -> Any:
+    def _resolve_variant(self, model_id: str, variant: Optional[str] = None) -> Optional[str]:
+        """
+        确定要使用的模型变体
+        
+        未显式指定时读取info.json的 "inference": {"variant": "int8"}；
+        变体未在info.json的variants中登记时返回None（使用fp32原始模型）。
+        
+        Args:
+            model_id: 模型ID
+            variant: 显式指定的变体名称
+            
+        Returns:
+            Optional[str]: 变体名称
+        """
+        info = self._load_info_json(model_id)
+        if variant is None:
+            variant = info.get("inference", {}).get("variant")
+        if variant is not None and variant not in info.get("variants", {}):
+            logger.warning(f"模型 {model_id} 没有登记变体 {variant}，使用原始模型")
+            return None
+        return variant
+    
+    def _load_variant(self, model_id: str, variant: str) -> Any:
+        """
+        加载info.json中登记的模型变体（quantize.py生成的int8 TorchScript模型或prune.py生成的.inr模型）
+        
+        Args:
+            model_id: 模型ID
+            variant: 变体名称
+            
+        Returns:
+            模型实例
+        """
+        variant_info = self._load_info_json(model_id)["variants"][variant]
+        model_path = os.path.join(self.models_dir, model_id, variant_info["model_filename"])
+        if not os.path.exists(model_path):
+            error_msg = f"找不到模型变体文件: {model_path}"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+        
+        logger.info(f"加载模型变体 {variant}: {model_path}")
+        if variant_info.get("format") == "torchscript":
+            model = torch.jit.load(model_path, map_location=self.device)
+        elif variant_info.get("format") == "inr":
+            model = load_inr(model_path, device=self.device)
+        else:
+            model = torch.load(model_path, map_location=self.device, weights_only=False)
+        return model.eval()
+    
+    def _engine_key(self, model_id: str, variant: Optional[str]) -> str:
+        """推理引擎和模型缓存使用的键"""
+        return model_id if variant is None else f"{model_id}@{variant}"
+    
+    def load_model(self, model_id: str, variant: Optional[str] = None) -> Any:
         """
         加载指定的模型
         
         Args:
             model_id: 模型ID
+            variant: 模型变体（例如"int8"），None表示按info.json的inference.variant选择
             
         Returns:
             模型实例
         """
+        variant = self._resolve_variant(model_id, variant)
+        if variant is not None:
+            key = self._engine_key(model_id, variant)
+            if key not in self.loaded_models:
+                self.loaded_models[key] = self._load_variant(model_id, variant)
+                self.inference_engines.pop(key, None)
+                logger.info(f"模型 {model_id} 的变体 {variant} 成功加载")
+            return self.loaded_models[key]
+        
         if model_id in self.loaded_models:
             logger.info(f"返回缓存的模型: {model_id}")
             return self.loaded_models[model_id]
@@ -326,7 +398,7 @@ class ModelService:
                     logger.info(f"找到模型文件: {model_path}")
         else:
             # 尝试常见的模型文件名
-            common_names = ["best_model.pt", "1.pt", "model.pt", "checkpoint.pt", "best_model1.pt"]
+            common_names = ["model.inr", "best_model.inr", "best_model.pt", "1.pt", "model.pt", "checkpoint.pt", "best_model1.pt"]
             for name in common_names:
                 potential_path = os.path.join(model_dir, name)
                 if os.path.exists(potential_path):
@@ -349,6 +421,13 @@ class ModelService:
                         logger.info(f"在默认位置找到模型文件: {model_path}")
                         break
         
+        # 优先使用同名的.inr服务格式（mmap零拷贝加载，不需要反序列化pickle）
+        candidate_path = model_path or (os.path.join(model_dir, model_filename) if model_filename else None)
+        if candidate_path:
+            serving_path = os.path.splitext(candidate_path)[0] + SERVING_SUFFIX
+            if os.path.exists(serving_path):
+                model_path = serving_path
+        
         if not model_path or not os.path.exists(model_path):
             error_msg = f"找不到模型文件: {model_id}"
             logger.error(error_msg)
@@ -357,32 +436,11 @@ class ModelService:
         logger.info(f"加载模型: {model_path}")
         
         try:
-            # 添加 Fullmodel 到安全全局变量列表
-            torch.serialization.add_safe_globals([Fullmodel])
-            
-            # 尝试不同的加载方式
-            try:
-                # 先尝试直接加载整个模型，显式设置weights_only=False
-                model = torch.load(model_path, map_location=self.device, weights_only=False)
-                logger.info("成功加载完整模型")
-            except Exception as e:
-                logger.warning(f"加载完整模型失败，尝试只加载权重: {e}")
-                # 如果失败，尝试只加载权重
-                # 创建一个空模型实例
-                model = Fullmodel(
-                    encoding_mode="fourier",
-                    in_features=2,
-                    out_features=20,
-                    coordinate_scales=[1.0, 1.0],
-                    mlp_hidden_features=256,
-                    mlp_hidden_layers=4,
-                    omega_0=30,
-                    activation="sine"
-                )
-                # 加载权重，显式设置weights_only=True
-                state_dict = torch.load(model_path, map_location=self.device, weights_only=True)
-                model.load_state_dict(state_dict)
-                logger.info("成功加载模型权重")
+            if model_path.endswith(SERVING_SUFFIX):
+                model = load_inr(model_path, device=self.device)
+                logger.info("成功加载.inr服务格式模型")
+            else:
+                model = self._load_pt_model(model_id, model_path)
             
             # 确保模型在正确的设备上并设置为评估模式
             model = model.to(self.device)
@@ -390,6 +448,8 @@ class ModelService:
             
             # 缓存已加载的模型
             self.loaded_models[model_id] = model
+            self.inference_engines.pop(model_id, None)
+            self.model_stacks = {key: stack for key, stack in self.model_stacks.items() if model_id not in key}
             
             logger.info(f"模型 {model_id} 成功加载")
             return model
@@ -399,13 +459,108 @@ class ModelService:
             logger.error(traceback.format_exc())
             raise
     
-    def predict(self, model_id: str, input_data: np.ndarray) -> Dict[str, Any]:
+    def _load_info_json(self, model_id: str) -> Dict:
+        """
+        读取模型目录下的原始info.json（不补充默认值）
+        
+        Args:
+            model_id: 模型ID
+            
+        Returns:
+            Dict: info.json内容，文件不存在或读取失败时返回空字典
+        """
+        info_path = os.path.join(self.models_dir, model_id, "info.json")
+        if not os.path.exists(info_path):
+            return {}
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"无法读取 {info_path}: {e}")
+            return {}
+    
+    def _load_pt_model(self, model_id: str, model_path: str) -> Any:
+        """
+        加载.pt格式的模型文件
+        
+        先尝试加载完整的pickle模型；失败时按info.json中的config构建模型结构并只加载权重。
+        
+        Args:
+            model_id: 模型ID
+            model_path: 模型文件路径
+            
+        Returns:
+            模型实例
+        """
+        # 添加 Fullmodel 到安全全局变量列表
+        torch.serialization.add_safe_globals([Fullmodel])
+        
+        try:
+            # 先尝试直接加载整个模型，显式设置weights_only=False
+            model = torch.load(model_path, map_location=self.device, weights_only=False)
+            logger.info("成功加载完整模型")
+            return model
+        except Exception as e:
+            logger.warning(f"加载完整模型失败，尝试只加载权重: {e}")
+        
+        # 按info.json中的模型配置创建空模型实例
+        model_config = self._load_info_json(model_id).get("config", self.default_model_config["config"])
+        model = build_model(model_config)
+        # 加载权重，显式设置weights_only=True
+        state_dict = torch.load(model_path, map_location=self.device, weights_only=True)
+        model.load_state_dict(state_dict.get("model_state_dict", state_dict))
+        logger.info("成功加载模型权重")
+        return model
+    
+    def get_inference_engine(self, model_id: str, variant: Optional[str] = None) -> InferenceEngine:
+        """
+        获取指定模型的推理引擎（折叠常数并编译后的冻结模型）
+        
+        推理精度从info.json的 "inference": {"precision": "bf16", "min_psnr": 40.0} 读取，
+        低精度渲染与fp32渲染的PSNR低于min_psnr时自动退回fp32。
+        TorchScript变体（例如已量化的int8模型）直接以fp32输入输出执行，不再叠加低精度设置。
+        
+        Args:
+            model_id: 模型ID
+            variant: 模型变体，None表示按info.json的inference.variant选择
+            
+        Returns:
+            InferenceEngine: 推理引擎实例
+        """
+        variant = self._resolve_variant(model_id, variant)
+        key = self._engine_key(model_id, variant)
+        if key in self.inference_engines:
+            return self.inference_engines[key]
+        
+        model = self.load_model(model_id, variant)
+        inference_info = self._load_info_json(model_id).get("inference", {})
+        precision = inference_info.get("precision", self.default_precision)
+        if variant is not None and isinstance(model, torch.jit.ScriptModule):
+            precision = "fp32"
+        min_psnr = inference_info.get("min_psnr", DEFAULT_MIN_PSNR)
+        try:
+            engine = build_engine(model, backend=self.inference_backend, device=self.device,
+                                  memory_budget=self.render_memory_budget,
+                                  precision=precision, min_psnr=min_psnr)
+        except Exception as e:
+            logger.warning(f"创建推理引擎失败，使用eager模式: {e}")
+            engine = InferenceEngine(model, backend="eager", device=self.device,
+                                     memory_budget=self.render_memory_budget)
+        logger.info(f"模型 {key} 推理引擎已就绪，后端: {engine.backend}，精度: {engine.precision}")
+        if engine.guard_psnr is not None:
+            logger.info(f"模型 {key} {precision}渲染相对fp32的PSNR: {engine.guard_psnr:.2f} dB")
+        
+        self.inference_engines[key] = engine
+        return engine
+    
+    def predict(self, model_id: str, input_data: np.ndarray, variant: Optional[str] = None) -> Dict[str, Any]:
         """
         使用指定模型进行预测
         
         Args:
             model_id: 模型ID
             input_data: 输入数据
+            variant: 模型变体（例如"int8"），None表示按info.json的inference.variant选择
             
         Returns:
             Dict: 预测结果
@@ -417,8 +572,8 @@ class ModelService:
         original_height, original_width = input_data.shape
         logger.info(f"原始输入图像尺寸: {original_width}x{original_height}")
         
-        # 加载模型
-        model = self.load_model(model_id)
+        # 加载模型并获取推理引擎
+        engine = self.get_inference_engine(model_id, variant)
         
         try:
             # 准备输入数据 - 处理为模型期望的格式
@@ -430,24 +585,15 @@ class ModelService:
                 raise ValueError(f"无法处理形状为 {input_data.shape} 的输入数据。需要2D数据。")
                 
             height, width = input_data.shape
-            y_coords = np.linspace(-1, 1, height)
-            x_coords = np.linspace(-1, 1, width)
-            
-            # 创建网格坐标
-            grid_x, grid_y = np.meshgrid(x_coords, y_coords)
             
-            # 将坐标展平并堆叠
-            grid_coords = np.stack([grid_x.flatten(), grid_y.flatten()], axis=1)
-            
-            # 转换为torch张量
-            coords_tensor = torch.from_numpy(grid_coords).float().to(self.device)
+            # 直接在目标设备上生成float32坐标网格
+            coords_tensor = make_coordinate_grid(height, width, device=self.device)
             
             logger.info(f"准备的输入坐标形状: {coords_tensor.shape}")
             
             # 执行预测
-            with torch.no_grad():
-                prediction = model(coords_tensor)
-                logger.info(f"原始预测形状: {prediction.shape}")
+            prediction = engine(coords_tensor)
+            logger.info(f"原始预测形状: {prediction.shape}")
             
             # 处理预测结果
             pred_complex = prediction[:, 0] + 1j * prediction[:, 1]
@@ -485,6 +631,66 @@ class ModelService:
             logger.error(traceback.format_exc())
             raise
     
+    def _stack_eligible(self, model_id: str) -> bool:
+        """
+        模型是否可以参与ModelStack批量渲染
+        
+        与predict使用相同的变体和精度解析：只有使用fp32原始模型（没有启用变体、inference.precision为fp32）
+        的模型参与堆叠，ModelStack的输出与其fp32推理引擎一致。
+        """
+        if self._resolve_variant(model_id) is not None:
+            return False
+        inference_info = self._load_info_json(model_id).get("inference", {})
+        return inference_info.get("precision", self.default_precision) == "fp32"
+    
+    def predict_stack(self, model_ids: List[str], height: int = 256, width: int = 256) -> Dict[str, np.ndarray]:
+        """
+        一次性渲染多个切片模型（例如查看整个切片堆栈时）
+        
+        使用fp32原始模型的切片被打包为ModelStack，在共享坐标网格上一次批量求值；
+        启用了变体或低精度的模型、以及无法堆叠的模型（结构不同或无法折叠）与predict一样
+        逐个通过各自的推理引擎渲染。
+        
+        Args:
+            model_ids: 模型ID列表
+            height: 渲染高度
+            width: 渲染宽度
+            
+        Returns:
+            Dict[str, np.ndarray]: 模型ID到归一化幅值图像的映射
+        """
+        logger.info(f"批量渲染 {len(model_ids)} 个模型，尺寸 {width}x{height}")
+        coords = make_coordinate_grid(height, width, device=self.device)
+        stackable = [model_id for model_id in model_ids if self._stack_eligible(model_id)]
+        key = tuple(stackable)
+        
+        predictions = {}
+        if len(stackable) > 1 and key not in self.model_stacks:
+            try:
+                models = [self.load_model(model_id) for model_id in stackable]
+                self.model_stacks[key] = ModelStack(models, device=self.device,
+                                                    memory_budget=self.render_memory_budget)
+            except ValueError as e:
+                logger.warning(f"模型无法堆叠，逐个渲染: {e}")
+                self.model_stacks[key] = None
+        
+        stack = self.model_stacks.get(key) if len(stackable) > 1 else None
+        if stack is not None:
+            stacked = stack(coords)
+            for model_id, prediction in zip(stackable, stacked):
+                predictions[model_id] = prediction
+        for model_id in model_ids:
+            if model_id not in predictions:
+                predictions[model_id] = self.get_inference_engine(model_id)(coords)
+        
+        images = {}
+        for model_id in model_ids:
+            prediction = predictions[model_id]
+            magnitude = torch.sqrt(prediction[:, 0] ** 2 + prediction[:, 1] ** 2)
+            magnitude = magnitude.reshape(height, width).cpu().numpy()
+            images[model_id] = (magnitude - magnitude.min()) / (magnitude.max() - magnitude.min() + 1e-8)
+        return images
+    
     def _get_original_image(self, model_id: str) -> Optional[np.ndarray]:
         """
         获取指定模型对应的原始图像